@@ -0,0 +1,88 @@
+"""Async access to Database for code running on an event loop (see asgi.py).
+
+``AsyncDatabase`` offers every read and write method of ``Database`` as a
+coroutine: ``await adb.get_child_details(email)``. The drivers are blocking,
+so each call runs the existing method on a dedicated thread pool with one
+thread per pooled connection. The coroutine waits for a connection on an
+asyncio semaphore, which holds no thread. Thousands of coroutines can
+therefore wait on the database, while only as many threads exist as there
+are connections to use. A caller that gets no connection within
+DB_POOL_TIMEOUT seconds gets PoolTimeout, as with the blocking pool.
+
+Context variables flow both ways as with a direct call: a write pins the
+calling coroutine's reads to the primary (see replicas.py).
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from config import Config
+from pool import PoolTimeout
+
+# Database methods that are awaited as they are
+METHODS = frozenset((
+    'get_version', 'get_children_for_parent', 'get_child_details', 'get_balance_as_of',
+    'get_earnings_history', 'get_earnings_page', 'get_monthly_summary',
+    'add_earnings', 'update_monthly_allowance', 'process_past_allowances',
+    'import_earnings', 'insert_accounts',
+))
+
+
+class AsyncDatabase:
+    def __init__(self, db, max_connections=None):
+        self.db = db
+        if max_connections is None:
+            # Every pool a read or write might check out from
+            max_connections = db.pool.max_size + sum(r.pool.max_size for r in db.replicas.replicas)
+        self.max_connections = max_connections
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix='db')
+        self._slots = self._loop = None  # Made for the event loop using them
+        self.waiting = 0
+        self.running = 0
+
+    def __getattr__(self, name):
+        if name not in METHODS:
+            raise AttributeError(name)
+        method = getattr(self.db, name)
+
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking database call on a connection thread once one is free"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._slots, self._loop = asyncio.Semaphore(self.max_connections), loop
+        slots = self._slots
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(slots.acquire(), Config.DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise PoolTimeout("Timed out after %.2fs waiting for a database connection" % Config.DB_POOL_TIMEOUT)
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        context = contextvars.copy_context()
+        try:
+            return await loop.run_in_executor(
+                self._executor, partial(context.run, fn, *args, **kwargs))
+        finally:
+            self.running -= 1
+            slots.release()
+            for var, value in context.items():
+                if var.get(None) is not value:
+                    var.set(value)
+
+    def stats(self):
+        return {
+            'max_connections': self.max_connections,
+            'waiting': self.waiting,
+            'running': self.running,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
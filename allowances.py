@@ -0,0 +1,49 @@
+"""Date arithmetic for monthly allowances.
+
+An allowance is due once per month on ``allowance_day``, clamped to the last
+day of months that are too short (a day-31 allowance is paid on 30 April and
+28 or 29 February). Payments are tracked per month, so a month that already
+has an allowance entry is never paid again.
+"""
+import calendar
+from datetime import date, datetime
+
+
+def to_date(value):
+    """Normalise a DATE/TIMESTAMP column value or ISO string to a date"""
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    if isinstance(value, datetime):
+        return value.date()
+    return date.fromisoformat(str(value)[:10])
+
+
+def due_date(year, month, allowance_day):
+    """The day the allowance is paid in the given month"""
+    return date(year, month, min(int(allowance_day), calendar.monthrange(year, month)[1]))
+
+
+def month_index(day):
+    return day.year * 12 + day.month - 1
+
+
+def due_dates(start_date, allowance_day, until, paid_through=None):
+    """All unpaid due dates from ``start_date`` up to and including ``until``.
+
+    ``paid_through`` is the date of the last allowance already paid; months up
+    to and including it are skipped. Computed in one pass over the month
+    range, so the cost depends only on how many payments are missing.
+    """
+    start_date = to_date(start_date)
+    until = to_date(until)
+    first = month_index(start_date)
+    if paid_through is not None:
+        first = max(first, month_index(to_date(paid_through)) + 1)
+    last = month_index(until)
+
+    dates = [due_date(index // 12, index % 12 + 1, allowance_day) for index in range(first, last + 1)]
+    return [d for d in dates if start_date <= d <= until]
+
+
+def allowance_description(day):
+    return f"Monthly Allowance for {day.strftime('%B %Y')}"
@@ -1,14 +1,192 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, abort, jsonify, make_response
 from functools import wraps
+import hashlib
+import hmac
+import io
+import logging
+import click
+from datetime import date, timezone
 from database import Database
+from hashing import HasherBusy
+from writebehind import QueueFull
 from config import Config
+import migrations
+import scheduler
+import rollups
+import transfer
+import onboarding
+import metrics
+import assets
+import health
+import rendering
+import replicas
+import events
+
+logging.basicConfig(level=Config.LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
 app = Flask(__name__)
 app.secret_key = Config.SECRET_KEY
 
-# Initialize database only once when the application starts
+# Initialize database only once when the application starts; it connects
+# lazily on first use and never touches the schema
 db = Database()
 
+# The Database the health, metrics and events hooks read; swap it, and the
+# one the routes use, with use_database()
+app.extensions['db'] = db
+
+# Shared template bytecode and cached page fragments; set up before
+# anything below touches the Jinja environment
+rendering.init_app(app)
+
+# Request/query/bcrypt timings, exported on /metrics
+metrics.init_app(app, db)
+
+# Fingerprinted static files under /assets, linked with asset_url()
+assets.init_app(app)
+
+# /health/live and /health/ready for the orchestrator
+health.init_app(app)
+
+# A session that just wrote keeps reading from the primary for a few seconds
+replicas.init_app(app)
+
+# Live balance and earnings updates; caps the streams each user may hold open
+events.init_app(app)
+
+def use_database(database):
+    """Serve from ``database`` instead, e.g. a benchmark's; returns the one replaced"""
+    global db
+    previous, db = db, database
+    app.extensions['db'] = database
+    metrics.register_database(database)
+    return previous
+
+@app.cli.command('migrate')
+@click.option('--target', type=int, help='Stop after this schema version.')
+def migrate_command(target):
+    """Apply pending schema migrations."""
+    try:
+        applied = migrations.migrate(db, target)
+    except migrations.MigrationError as e:
+        raise click.ClickException(str(e))
+    if applied:
+        for version in applied:
+            click.echo(f"Applied migration {version}")
+    else:
+        click.echo("Schema is up to date")
+
+@app.cli.command('run-allowances')
+@click.option('--date', 'run_date', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Pay allowances due up to this day (default: today).')
+@click.option('--workers', default=4, show_default=True, help='Parallel shards.')
+@click.option('--batch-size', default=500, show_default=True, help='Children per transaction.')
+def run_allowances_command(run_date, workers, batch_size):
+    """Credit every allowance that has fallen due."""
+    report = scheduler.run_allowances(db, run_date.date() if run_date else None, workers, batch_size)
+    click.echo(
+        f"{report['run_date']}: credited {report['children_credited']} of {report['due']} due children "
+        f"({report['payments']} payments, {report['skipped']} already done) in {report['elapsed']:.2f}s, "
+        f"{report['children_per_second']:.0f} children/s"
+    )
+
+@app.cli.command('verify-ledger')
+@click.option('--child', 'children', multiple=True, help='Only check this child (repeatable).')
+@click.option('--repair', is_flag=True, help='Rebuild the snapshots of children that fail the check.')
+def verify_ledger_command(children, repair):
+    """Check balance snapshots and balances against the earnings ledger."""
+    report = db.verify_ledger(list(children) or None)
+    for email, period_end, stored, actual in report['bad_snapshots']:
+        click.echo(f"Snapshot {email} @ {period_end}: stored {stored}, ledger {actual}")
+    for email, stored, actual in report['bad_balances']:
+        click.echo(f"Balance {email}: stored {stored}, ledger {actual}")
+    click.echo(
+        f"Checked {report['snapshots']} snapshots and {report['entries']} entries "
+        f"for {report['children']} children: "
+        f"{len(report['bad_snapshots'])} bad snapshots, {len(report['bad_balances'])} bad balances"
+    )
+    if report['bad_snapshots'] and repair:
+        broken = sorted({row[0] for row in report['bad_snapshots']})
+        db.rebuild_snapshots(broken)
+        click.echo(f"Rebuilt snapshots for {len(broken)} children")
+    elif report['bad_snapshots'] or report['bad_balances']:
+        raise SystemExit(1)
+
+@app.cli.command('rebuild-rollups')
+@click.option('--child', 'children', multiple=True, help='Only rebuild this child (repeatable).')
+def rebuild_rollups_command(children):
+    """Recompute monthly earnings rollups from the ledger."""
+    rows = db.rebuild_rollups(list(children) or None)
+    click.echo(f"Rebuilt {rows} monthly rollup rows")
+
+@app.cli.command('export-earnings')
+@click.option('--child', 'children', multiple=True, help='Export this child (repeatable).')
+@click.option('--parent', help="Export all of this parent's children.")
+@click.option('--format', 'fmt', type=click.Choice(sorted(transfer.FORMATS)), default='csv', show_default=True)
+@click.option('--output', type=click.File('w'), default='-', help='File to write (default: stdout).')
+def export_earnings_command(children, parent, fmt, output):
+    """Stream children's earnings ledgers as CSV or NDJSON."""
+    child_emails = list(children)
+    if parent:
+        child_emails += [child[1] for child in db.get_children_for_parent(parent)]
+    if not child_emails:
+        raise click.UsageError('Give --child or --parent')
+    for chunk in transfer.EXPORTERS[fmt](db.iter_earnings(child_emails)):
+        output.write(chunk)
+
+@app.cli.command('import-earnings')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(sorted(transfer.READERS)),
+              help='File format (default: from the extension).')
+def import_earnings_command(path, fmt):
+    """Bulk-load earnings from a CSV or NDJSON file."""
+    with open(path, encoding='utf-8', newline='') as lines:
+        report = transfer.load(db, lines, fmt or transfer.format_of(path))
+    for line, error in report['rejected']:
+        click.echo(f"Line {line}: {error}", err=True)
+    click.echo(f"Imported {report['imported']} earnings for {report['children']} children, "
+               f"rejected {len(report['rejected'])}")
+
+@app.cli.command('register-families')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(sorted(transfer.READERS)),
+              help='File format (default: from the extension).')
+@click.option('--processes', type=int, help='Password hashing processes (default: one per core).')
+@click.option('--batch-size', default=onboarding.BATCH_SIZE, show_default=True, help='Families per batch.')
+def register_families_command(path, fmt, processes, batch_size):
+    """Bulk-register parents and children from a CSV or NDJSON file."""
+    with open(path, encoding='utf-8', newline='') as lines:
+        report = onboarding.load(db, lines, fmt or transfer.format_of(path), processes, batch_size)
+    for line, error in report['rejected']:
+        click.echo(f"Line {line}: {error}", err=True)
+    click.echo(f"Registered {report['parents']} parents and {report['children']} children, "
+               f"rejected {len(report['rejected'])}")
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static assets into static/dist."""
+    manifest = assets.build(app.static_folder)
+    app.extensions['assets'] = manifest
+    for path, target in sorted(manifest.items()):
+        click.echo(f"{path} -> {assets.DIST}/{target}")
+
+@app.cli.command('compile-templates')
+def compile_templates_command():
+    """Compile every template into the shared bytecode cache."""
+    for name in rendering.compile_templates(app):
+        click.echo(f"Compiled {name}")
+
+@app.cli.command('serve')
+@click.option('--asgi', is_flag=True, help='Serve through the event loop instead (see asgi.py).')
+def serve_command(asgi):
+    """Run the production server (pre-forked workers; see serve.py)."""
+    if asgi:
+        import asgi as asgi_server
+        asgi_server.run()
+        return
+    import serve
+    serve.run(app)
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -18,6 +196,54 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def page_validators(account_type, email, version=None):
+    """ETag and Last-Modified for a page built from one account's data.
+
+    The account's version is bumped by every write that changes what the
+    page shows; the page also varies with the viewer, the query string and
+    the deployed release. ``version`` is the account's db.get_version(), if
+    already read. Returns (None, None) for unknown accounts.
+    """
+    if version is None:
+        version = db.get_version(account_type, email)
+    if version is None:
+        return None, None
+    varies = repr((Config.RELEASE, session.get('user_email'), session.get('user_name'), request.full_path))
+    digest = hashlib.sha1(varies.encode('utf-8')).hexdigest()[:16]
+    last_modified = version[1].replace(tzinfo=timezone.utc) if version[1] else None
+    return f'{account_type}-{version[0]}-{digest}', last_modified
+
+def stream_resume_point():
+    """The event id a page's live updates resume from, or None if pages don't stream"""
+    if not db.events or not app.config['EVENT_STREAMS']:
+        return None
+    return db.events.latest_id()
+
+def set_validators(response, etag, last_modified):
+    if etag:
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        # Browsers may keep the page but must check it is current before reuse
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+    return response
+
+def not_modified(etag, last_modified):
+    """A 304 response if the client's copy is current, else None"""
+    if etag is None or '_flashes' in session:
+        # A pending flash message has to be rendered into a fresh page
+        return None
+    if request.if_none_match:
+        current = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        current = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        current = False
+    if not current:
+        return None
+    return set_validators(Response(status=304), etag, last_modified)
+
 @app.route('/')
 def landing():
     if 'user_email' in session:
@@ -32,20 +258,18 @@ def login():
         email = request.form['email']
         password = request.form['password']
         
-        # Try parent login
-        parent = db.verify_parent(email, password)
-        if parent:
-            session['user_email'] = email
-            session['user_type'] = 'parent'
-            session['user_name'] = parent['name']
-            return redirect(url_for('dashboard'))
+        try:
+            account = db.verify_credentials(email, password)
+        except HasherBusy:
+            flash('Too many people are logging in right now. Please try again in a moment.')
+            return render_template('login.html'), 503
         
-        # Try child login
-        child = db.verify_child(email, password)
-        if child:
+        if account:
             session['user_email'] = email
-            session['user_type'] = 'child'
-            session['user_name'] = child['name']
+            session['user_type'] = account['type']
+            session['user_name'] = account['name']
+            if account['type'] == 'parent':
+                return redirect(url_for('dashboard'))
             return redirect(url_for('game_home'))
         
         flash('Invalid credentials')
@@ -60,10 +284,14 @@ def register(user_type):
         related_email = request.form['related_email']
         
         success = False
-        if user_type == 'parent':
-            success = db.create_parent(name, email, password, related_email)
-        else:
-            success = db.create_child(name, email, password, related_email)
+        try:
+            if user_type == 'parent':
+                success = db.create_parent(name, email, password, related_email)
+            else:
+                success = db.create_child(name, email, password, related_email)
+        except HasherBusy:
+            flash('We are busy right now. Please try again in a moment.')
+            return render_template('register.html', user_type=user_type), 503
         
         if success:
             flash('Registration successful! Please login.')
@@ -79,15 +307,44 @@ def dashboard():
     if session.get('user_type') != 'parent':
         return redirect(url_for('game_home'))
     
-    children = db.get_children_for_parent(session['user_email'])
-    return render_template('dashboard.html', children=children)
+    with db.versioned('parent', session['user_email']) as version:
+        etag, last_modified = page_validators('parent', session['user_email'], version)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        children = db.get_children_for_parent(session['user_email'])
+    return set_validators(make_response(render_template('dashboard.html', children=children)), etag, last_modified)
+
+def monthly_summary():
+    today = date.today()
+    rows = db.get_monthly_summary(session['user_email'], Config.SUMMARY_MONTHS, today)
+    return rollups.summarize(rows, today, Config.SUMMARY_MONTHS)
+
+@app.route('/dashboard/summary')
+@login_required
+def dashboard_summary():
+    if session.get('user_type') != 'parent':
+        return redirect(url_for('game_home'))
+    return render_template('summary.html', summary=monthly_summary())
+
+@app.route('/api/summary')
+@login_required
+def summary_json():
+    if session.get('user_type') != 'parent':
+        abort(403)
+    return jsonify(monthly_summary())
 
 @app.route('/game-home')
 @login_required
 def game_home():
     if session.get('user_type') != 'child':
         return redirect(url_for('dashboard'))
-    return render_template('game_home.html')
+    # Read before the balance, so the stream replays anything newer
+    last_event_id = stream_resume_point()
+    # From the primary at the current version, never another worker's older cache
+    with db.versioned('child', session['user_email']):
+        child = db.get_child_details(session['user_email'])
+    return render_template('game_home.html', child=child, last_event_id=last_event_id)
 
 @app.route('/logout')
 def logout():
@@ -100,14 +357,39 @@ def child_details(child_email):
     if session.get('user_type') != 'parent':
         return redirect(url_for('game_home'))
     
-    child = db.get_child_details(child_email)
-    earnings_history = db.get_earnings_history(child_email)
-    
-    if not child:
-        flash('Child not found')
-        return redirect(url_for('dashboard'))
+    # Read before the version, so the stream replays anything newer than the page
+    last_event_id = stream_resume_point()
+    # Everything the page shows is read at the version its ETag carries
+    with db.versioned('child', child_email) as version:
+        etag, last_modified = page_validators('child', child_email, version)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        
+        child = db.get_child_details(child_email)
+        if not child:
+            flash('Child not found')
+            return redirect(url_for('dashboard'))
+        
+        # Earnings are paged newest first; `before` is the cursor of the last row shown
+        before = request.args.get('before')
+        
+        def earnings_context():
+            earnings_history, next_cursor = db.get_earnings_page(child_email, Config.EARNINGS_PAGE_SIZE, before)
+            return dict(earnings=earnings_history, next_cursor=next_cursor, older_page=bool(before),
+                        child_email=child_email)
+        
+        # The rendered list is reused until the child's ledger version changes
+        try:
+            earnings_list = rendering.fragment('_earnings_list.html',
+                                               (child_email, *version, before, Config.EARNINGS_PAGE_SIZE),
+                                               earnings_context)
+        except ValueError:
+            abort(400)
     
-    return render_template('child_details.html', child=child, earnings=earnings_history)
+    page = render_template('child_details.html', child=child, earnings_list=earnings_list,
+                           last_event_id=last_event_id, newest_page=not before)
+    return set_validators(make_response(page), etag, last_modified)
 
 @app.route('/child/<child_email>/update-allowance', methods=['POST'])
 @login_required
@@ -135,12 +417,101 @@ def add_earnings(child_email):
     amount = request.form.get('amount')
     description = request.form.get('description')
     
-    if db.add_earnings(child_email, amount, description):
+    try:
+        added = db.add_earnings(child_email, amount, description)
+    except QueueFull:
+        # Write-behind queue is saturated; tell the client to back off
+        return 'Too many earnings are waiting to be saved. Please retry shortly.', 503, {'Retry-After': '1'}
+    
+    if added:
         flash('Earnings added successfully')
     else:
         flash('Failed to add earnings')
     
     return redirect(url_for('child_details', child_email=child_email))
 
+@app.route('/child/<child_email>/events')
+@login_required
+def child_events(child_email):
+    # Server-sent events. Off unless EVENT_STREAMS is set, as the ASGI server
+    # does; it serves them natively, without holding a thread (see events.py)
+    if not db.events or not app.config['EVENT_STREAMS']:
+        abort(404)
+    user_email = session['user_email']
+    if not events.may_watch(db, user_email, session.get('user_type'), child_email):
+        abort(403)
+    limiter = app.extensions['event_streams']
+    if not limiter.acquire(user_email):
+        return 'Too many live update streams are open.', 429
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    response = Response(events.stream(db.events, child_email, last_event_id), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(lambda: limiter.release(user_email))
+    return response
+
+def family_emails():
+    """The parent's children's emails, which authorize exports and imports"""
+    # At the parent's current version, never from a cache a write hasn't reached
+    with db.versioned('parent', session['user_email']):
+        return [child[1] for child in db.get_children_for_parent(session['user_email'])]
+
+def export_response(child_emails, fmt, filename):
+    if fmt not in transfer.FORMATS:
+        abort(404)
+    rows = db.iter_earnings(child_emails)
+    return Response(transfer.EXPORTERS[fmt](rows), mimetype=transfer.FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{filename}.{fmt}"'
+    })
+
+@app.route('/child/<child_email>/earnings.<fmt>')
+@login_required
+def export_child_earnings(child_email, fmt):
+    if session.get('user_type') != 'parent' or child_email not in family_emails():
+        abort(403)
+    return export_response([child_email], fmt, f'earnings-{child_email}')
+
+@app.route('/earnings.<fmt>')
+@login_required
+def export_family_earnings(fmt):
+    if session.get('user_type') != 'parent':
+        abort(403)
+    return export_response(family_emails(), fmt, 'earnings')
+
+@app.route('/import/earnings', methods=['POST'])
+@login_required
+def import_earnings():
+    if session.get('user_type') != 'parent':
+        abort(403)
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify(error='No file uploaded'), 400
+    fmt = request.form.get('format') or transfer.format_of(upload.filename)
+    if fmt not in transfer.READERS:
+        return jsonify(error=f'Unknown format {fmt}'), 400
+    # Parse the upload as it is read rather than loading it into memory
+    lines = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+    report = transfer.load(db, lines, fmt, allowed_children=family_emails())
+    report['rejected'] = [{'line': line, 'error': error} for line, error in report['rejected']]
+    return jsonify(report)
+
+@app.route('/api/families', methods=['POST'])
+def register_families():
+    # For onboarding tools, not browsers: authorized by a shared token
+    token = request.headers.get('Authorization', '')
+    expected = f'Bearer {Config.ONBOARDING_TOKEN}'.encode('utf-8')
+    if not Config.ONBOARDING_TOKEN or not hmac.compare_digest(token.encode('utf-8'), expected):
+        abort(404 if not Config.ONBOARDING_TOKEN else 401)
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify(error='No file uploaded'), 400
+    fmt = request.form.get('format') or transfer.format_of(upload.filename)
+    if fmt not in transfer.READERS:
+        return jsonify(error=f'Unknown format {fmt}'), 400
+    lines = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+    report = onboarding.load(db, lines, fmt, executor=onboarding.shared_executor())
+    report['rejected'] = [{'line': line, 'error': error} for line, error in report['rejected']]
+    return jsonify(report)
+
 if __name__ == '__main__':
+    # Development server only; production runs `python serve.py`
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,292 @@
+"""ASGI serving mode: the Flask app behind an event loop.
+
+    python asgi.py             # or: flask --app app serve --asgi
+
+Under ``serve.py`` every connection holds a worker thread from its first
+byte to its last, so a few dozen slow clients can occupy the server. Here
+uvicorn handles connections on an event loop. A request body is read in
+full before the app sees it, and the response is written back as the
+client can take it. Neither step holds a thread, so one process holds
+thousands of idle or slow connections.
+
+Flask still handles each request, with the same routes and templates, on
+one of ASGI_THREADS threads. A thread is busy only while the request is
+actually being handled. Streamed responses such as exports are pulled a
+chunk at a time, and the thread is released between chunks.
+
+Routes in ``NATIVE_ROUTES`` are coroutines that skip Flask and threads
+entirely. They use ``AsyncDatabase`` (see aio.py) when they need the
+database. Health checks live here, so probes are answered even when every
+thread is busy. So do the live update streams (see events.py): each is open
+for as long as its page, and here an idle one holds no thread at all.
+"""
+import asyncio
+import io
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from config import Config, server_workers
+import events
+import health
+
+# Request bodies are read into memory; larger ones are refused
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+_DONE = object()
+
+
+def _next_chunk(iterator):
+    return next(iterator, _DONE)
+
+
+def environ_for(scope, body):
+    """A WSGI environ for an ASGI http scope and its complete body"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    path = scope.get('root_path', '') + scope['path']
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': unquote(scope['path'], errors='surrogateescape').encode('utf-8', 'surrogateescape').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'RAW_URI': path,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            raise ValueError("Request body too large")
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def liveness(server, scope, receive, send):
+    await send_json(send, 200, {'status': 'ok'})
+
+
+async def readiness(server, scope, receive, send):
+    adb = server.adb
+    if health.is_draining():
+        return await send_json(send, 503, {'status': 'draining'})
+    error = await adb.run(health.check_database, adb.db)
+    if error:
+        return await send_json(send, 503, {'status': 'unavailable', 'database': error})
+    await send_json(send, 200, {'status': 'ok'})
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def child_events(server, scope, receive, send):
+    """The Flask ``child_events`` route, streaming without a thread"""
+    app, adb = server.app, server.adb
+    db = adb.db
+    if not db.events:
+        return await send_json(send, 404, {'error': 'Not found'})
+    request = app.request_class(environ_for(scope, b''))
+    session = app.session_interface.open_session(app, request) or {}
+    user_email, child_email = session.get('user_email'), scope['path_params']['child_email']
+    if not user_email:
+        return await send_json(send, 401, {'error': 'Not logged in'})
+    if not await adb.run(events.may_watch, db, user_email, session.get('user_type'), child_email):
+        return await send_json(send, 403, {'error': 'Forbidden'})
+    limiter = app.extensions['event_streams']
+    if not limiter.acquire(user_email):
+        return await send_json(send, 429, {'error': 'Too many live update streams are open'})
+
+    async def pump():
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        async for chunk in events.stream_async(db.events, child_email, last_event_id):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    # Streams end when the client goes away or falls too far behind
+    pumping = asyncio.ensure_future(pump())
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({pumping, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        limiter.release(user_email)
+        for task in (pumping, disconnected):
+            task.cancel()
+        await asyncio.gather(pumping, disconnected, return_exceptions=True)
+
+
+# (method, path pattern, coroutine(server, scope, receive, send)); the
+# pattern's named groups are passed in scope['path_params']
+NATIVE_ROUTES = [
+    ('GET', re.compile(r'/health/live'), liveness),
+    ('GET', re.compile(r'/health/ready'), readiness),
+    ('GET', re.compile(r'/child/(?P<child_email>[^/]+)/events'), child_events),
+]
+
+
+def native_route(scope):
+    for method, pattern, handler in NATIVE_ROUTES:
+        match = pattern.fullmatch(scope['path']) if method == scope['method'] else None
+        if match:
+            scope['path_params'] = match.groupdict()
+            return handler
+    return None
+
+
+class ASGIApp:
+    def __init__(self, app, adb, threads=None):
+        self.app = app
+        self.adb = adb
+        self._executor = ThreadPoolExecutor(max_workers=threads or Config.ASGI_THREADS, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        native = native_route(scope)
+        if native is not None:
+            return await native(self, scope, receive, send)
+        await self.call_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                health.mark_draining()
+                loop = asyncio.get_running_loop()
+                # Flushes the write-behind queue before closing connections
+                await loop.run_in_executor(None, self.adb.db.close)
+                self._executor.shutdown(wait=False)
+                self.adb.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def call_wsgi(self, scope, receive, send):
+        try:
+            body = await read_body(receive)
+        except ValueError:
+            return await send_json(send, 413, {'error': 'Request body too large'})
+        if body is None:
+            return  # The client went away before sending its request
+
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            return lambda data: None  # The legacy write() callable; Flask never uses it
+
+        def call():
+            stream = self.app(environ_for(scope, body), start_response)
+            iterator = iter(stream)
+            # Flask wraps every body in an iterator, so even a buffered page
+            # is pulled chunk by chunk; its first (and usually only) chunk
+            # comes back with the call, saving a trip to the thread pool
+            try:
+                return stream, iterator, _next_chunk(iterator)
+            except BaseException:
+                close = getattr(stream, 'close', None)
+                if close is not None:
+                    close()
+                raise
+
+        stream, iterator, chunk = await loop.run_in_executor(self._executor, call)
+        await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+        try:
+            while chunk is not _DONE:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(self._executor, _next_chunk, iterator)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            close = getattr(stream, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(self._executor, close)
+
+
+def create_app(app=None, db=None):
+    """The ASGI application around the Flask app and its Database"""
+    import metrics
+    from aio import AsyncDatabase
+
+    if app is None:
+        from app import app, db
+    # Pages may open live update streams; child_events serves them without threads
+    app.config['EVENT_STREAMS'] = True
+    if db.events is None and not Config.EVENTS_BROKER:
+        # Built before it was known this process serves streams
+        db.events = events.create_event_bus(streams=True)
+    adb = AsyncDatabase(db)
+    metrics.REGISTRY.register(metrics.Gauge(
+        'db_async', 'Coroutines waiting for and using database connections', ('stat',),
+        lambda: {(key,): value for key, value in adb.stats().items()}))
+    return ASGIApp(app, adb)
+
+
+def run():
+    import uvicorn
+
+    host, _, port = Config.SERVE_BIND.rpartition(':')
+    uvicorn.run(
+        'asgi:create_app',
+        factory=True,
+        host=host or '0.0.0.0',
+        port=int(port),
+        # Each worker imports the app itself, so nothing is shared through fork
+        workers=server_workers(),
+        timeout_keep_alive=Config.SERVE_KEEPALIVE,
+        timeout_graceful_shutdown=Config.SERVE_GRACEFUL_TIMEOUT,
+        access_log=Config.SERVE_ACCESS_LOG,
+    )
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,130 @@
+"""Fingerprinted, precompressed static assets.
+
+``flask build-assets`` copies every CSS and JS file under ``static/`` to
+``static/dist/`` under a name that carries a hash of its content
+(``css/style.3f2a9c1b7d4e.css``). It also writes ``.gz`` and, when the
+optional ``brotli`` package is installed, ``.br`` variants, plus a
+``manifest.json`` mapping each source path to its fingerprinted one.
+
+Templates link assets through ``asset_url('css/style.css')``. Once a
+manifest exists, that names the fingerprinted file under ``/assets/``. The
+handler there serves the best precompressed variant the client accepts,
+marked cacheable for a year and immutable. A changed file gets a new name, so
+browsers never need to revalidate and repeat page views make no asset
+requests. Without a build (e.g. in development) ``asset_url`` falls back
+to Flask's plain static URLs.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+
+from flask import Response, abort, current_app, request, url_for
+
+try:
+    import brotli
+except ImportError:  # Optional; only gzip variants are built without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+EXTENSIONS = ('.css', '.js')
+HASH_LENGTH = 12
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Preferred encodings, best first, with the suffix of their precompressed file
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def fingerprint(path, content):
+    """``css/style.css`` -> ``css/style.<hash>.css``"""
+    stem, extension = os.path.splitext(path)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{extension}"
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def build(static_dir):
+    """Fingerprint and compress the assets in ``static_dir``; returns the manifest"""
+    dist_dir = os.path.join(static_dir, DIST)
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    if brotli is None:
+        logger.warning("brotli is not installed; building gzip variants only")
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist_dir)
+        for name in sorted(files):
+            if not name.endswith(EXTENSIONS):
+                continue
+            source = os.path.join(root, name)
+            path = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                content = f.read()
+            target = fingerprint(path, content)
+            output = os.path.join(dist_dir, target)
+            _write(output, content)
+            # mtime=0 keeps the gzip output byte-for-byte reproducible
+            _write(output + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write(output + '.br', brotli.compress(content, quality=11))
+            manifest[path] = target
+
+    _write(os.path.join(dist_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(static_dir):
+    try:
+        with open(os.path.join(static_dir, DIST, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def asset_url(filename):
+    """URL of an asset: fingerprinted when built, Flask's static URL otherwise"""
+    target = current_app.extensions['assets'].get(filename)
+    if target is None:
+        return url_for('static', filename=filename)
+    return url_for('serve_asset', filename=target)
+
+
+def serve_asset(filename):
+    """Serve a fingerprinted asset, precompressed to suit Accept-Encoding"""
+    dist_dir = os.path.realpath(os.path.join(current_app.static_folder, DIST))
+    path = os.path.realpath(os.path.join(dist_dir, filename))
+    if not path.startswith(dist_dir + os.sep) or not filename.endswith(EXTENSIONS) or not os.path.isfile(path):
+        abort(404)
+
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if request.accept_encodings[name] and os.path.isfile(path + suffix):
+            encoding, path = name, path + suffix
+            break
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    response = Response(content, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def init_app(app):
+    """Register the asset route and the ``asset_url`` template helper"""
+    app.extensions['assets'] = load_manifest(app.static_folder)
+    app.add_url_rule('/assets/<path:filename>', 'serve_asset', serve_asset)
+    app.add_template_global(asset_url)
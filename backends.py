@@ -0,0 +1,167 @@
+"""Storage backends behind Database.
+
+A backend opens DB-API connections and names the SQL dialect its migrations
+and queries use. ``Database`` only talks to connections, so the same code
+runs on either implementation:
+
+  * ``SingleStoreBackend`` - the production database, reached over the network
+  * ``SQLiteBackend``      - an embedded file in WAL mode for tests, benchmarks
+                             and single-node deployments
+
+``create_backend`` picks one from ``Config.DB_BACKEND``, and
+``create_replica_backends`` builds the same kind for each ``DB_REPLICAS``
+entry.
+"""
+import re
+import sqlite3
+from datetime import date, datetime
+from decimal import Decimal
+
+from config import Config
+
+
+def is_duplicate_key(error):
+    """True if a statement failed on a unique key; both drivers raise IntegrityError"""
+    return type(error).__name__ == 'IntegrityError'
+
+
+class Backend:
+    dialect = None
+
+    def connect(self, streaming=False):
+        """Open a new DB-API connection.
+
+        A ``streaming`` connection fetches result rows from the server as
+        they are read instead of buffering the whole result set; it is not
+        pooled, and is used for exports of unbounded size.
+        """
+        raise NotImplementedError
+
+    def describe(self):
+        return self.dialect
+
+
+class SingleStoreBackend(Backend):
+    dialect = 'singlestore'
+
+    def __init__(self, host, port, user, password, database):
+        self.host = host
+        self.port = int(port)
+        self.user = user
+        self.password = password
+        self.database = database
+
+    def connect(self, streaming=False):
+        import singlestoredb
+
+        return singlestoredb.connect(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            buffered=not streaming
+        )
+
+    def describe(self):
+        return f"singlestore://{self.user}@{self.host}:{self.port}/{self.database}"
+
+
+# SQLite has no DECIMAL, DATE or TIMESTAMP types; store them as text and
+# convert them back by declared column type, like the SingleStore driver does
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()[:10]))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(
+    value.decode() if len(value) > 10 else value.decode() + ' 00:00:00'))
+sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode()).quantize(Decimal('0.01')))
+
+_FOR_UPDATE = re.compile(r'\s+FOR\s+UPDATE\s*$', re.IGNORECASE)
+
+
+class SQLiteCursor:
+    """Runs the MySQL-flavoured queries used by Database on sqlite3.
+
+    ``%s`` placeholders become ``?``, and ``SELECT ... FOR UPDATE`` takes the
+    database write lock (``BEGIN IMMEDIATE``) before running the plain SELECT,
+    which gives the same no-lost-update guarantee the row lock gives.
+    """
+
+    def __init__(self, conn, cursor):
+        self._conn = conn
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        sql, locking = _FOR_UPDATE.subn('', sql)
+        if locking and not self._conn.in_transaction:
+            self._cursor.execute("BEGIN IMMEDIATE")
+        self._cursor.execute(sql.replace('%s', '?'), tuple(params or ()))
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(sql.replace('%s', '?'), [tuple(p) for p in seq_of_params])
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class SQLiteConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return SQLiteCursor(self._conn, self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class SQLiteBackend(Backend):
+    dialect = 'sqlite'
+
+    def __init__(self, path, busy_timeout=30.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+
+    def connect(self, streaming=False):
+        # sqlite3 cursors already step through results lazily
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False  # Connections move between threads through the pool
+        )
+        # WAL lets readers run alongside the single writer
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return SQLiteConnection(conn)
+
+    def describe(self):
+        return f"sqlite:///{self.path}"
+
+
+def create_backend():
+    if Config.DB_BACKEND == 'singlestore':
+        return SingleStoreBackend(Config.DB_HOST, Config.DB_PORT, Config.DB_USER, Config.DB_PASSWORD, Config.DB_NAME)
+    if Config.DB_BACKEND == 'sqlite':
+        return SQLiteBackend(Config.SQLITE_PATH)
+    raise ValueError(f"Unknown DB_BACKEND: {Config.DB_BACKEND}")
+
+
+def create_replica_backends():
+    """One backend per configured read replica, of the primary's kind"""
+    if Config.DB_BACKEND == 'singlestore':
+        replicas = []
+        for entry in Config.DB_REPLICAS:
+            host, _, port = entry.partition(':')
+            replicas.append(SingleStoreBackend(host, port or Config.DB_PORT, Config.DB_USER,
+                                               Config.DB_PASSWORD, Config.DB_NAME))
+        return replicas
+    if Config.DB_BACKEND == 'sqlite':
+        return [SQLiteBackend(path) for path in Config.DB_REPLICAS]
+    raise ValueError(f"Unknown DB_BACKEND: {Config.DB_BACKEND}")
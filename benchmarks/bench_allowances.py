@@ -0,0 +1,75 @@
+"""Back-fill latency of Database.process_past_allowances by history length.
+
+Creates one throwaway child per back-fill length, times the back-fill and
+removes the child again. With the batched back-fill the time should stay
+roughly flat from one year to twenty, since the number of statements no
+longer grows with the number of months.
+
+    python benchmarks/bench_allowances.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+MONTHS = [1, 12, 60, 120, 240]
+
+
+def months_ago(today, months):
+    index = today.year * 12 + today.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def cleanup(db, email):
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM earnings WHERE child_email = %s", (email,))
+        cursor.execute("DELETE FROM children WHERE email = %s", (email,))
+        conn.commit()
+
+
+def run(db, months, repeat):
+    today = date.today()
+    timings = []
+    for i in range(repeat):
+        email = f"bench-allowance-{months}-{i}@example.com"
+        cleanup(db, email)
+        db.create_child('Bench', email, 'password', 'bench-parent@example.com')
+        with db.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE children
+                SET monthly_allowance = %s, allowance_day = %s, allowance_start_date = %s
+                WHERE email = %s
+            """, (10, 31, months_ago(today, months), email))
+            conn.commit()
+
+        start = time.perf_counter()
+        credited = db.process_past_allowances(email, today)
+        timings.append(time.perf_counter() - start)
+        cleanup(db, email)
+    timings.sort()
+    return credited, timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    db = Database()
+    db.create_tables()
+    print(f"{'months':>8} {'payments':>9} {'median ms':>10}")
+    for months in MONTHS:
+        credited, median = run(db, months, args.repeat)
+        print(f"{months:>8} {credited:>9} {median * 1000:>10.2f}")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
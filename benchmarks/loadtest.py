@@ -0,0 +1,321 @@
+"""Reproducible load test for the Flask app.
+
+Seeds synthetic families into a local SQLite database, then drives a mixed
+workload through the WSGI app from a fixed number of concurrent clients and
+reports p50/p95/p99 latency and throughput per endpoint. Results are written
+as JSON; pass an earlier result as --baseline to see the change per endpoint.
+
+    python benchmarks/loadtest.py --parents 10000 --children-per-parent 3 \\
+        --earnings-per-child 100 --concurrency 16 --duration 60 --output results.json
+
+The database is only reseeded when it is missing or --reseed is given, so
+repeated runs measure the same data. Every client uses its own seeded random
+generator, so the sequence of requests is the same from run to run.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import allowances
+from backends import SQLiteBackend
+from config import Config
+from database import Database
+from hashing import PasswordHasher
+
+PASSWORD = 'password'
+DEFAULT_MIX = 'login=10,dashboard=30,child_details=40,add_earnings=15,update_allowance=5'
+HISTORY_MONTHS = 24
+
+
+def parent_email(i):
+    return f'parent{i}@bench.local'
+
+
+def child_email(i, j):
+    return f'child{i}-{j}@bench.local'
+
+
+def seed(path, parents, children_per_parent, earnings_per_child, bcrypt_rounds, rng_seed=42):
+    """Create a fresh database at ``path`` filled with synthetic families"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    db = Database(SQLiteBackend(path), cache=False)
+    db.create_tables()
+
+    # Every account shares one password, so hash it once at the configured cost
+    password_hash = PasswordHasher(rounds=bcrypt_rounds).hash(PASSWORD)
+    rng = random.Random(rng_seed)
+    today = date.today()
+    start_index = today.year * 12 + today.month - 1 - HISTORY_MONTHS
+    start_date = date(start_index // 12, start_index % 12 + 1, 1)
+    window = (datetime.now() - datetime.combine(start_date, datetime.min.time())).total_seconds()
+
+    conn = SQLiteBackend(path).connect()
+    cursor = conn.cursor()
+    started = time.monotonic()
+    total_earnings = 0
+    for i in range(parents):
+        cursor.execute("""
+            INSERT INTO parents (name, email, password_hash, child_email)
+            VALUES (%s, %s, %s, %s)
+        """, (f'Parent {i}', parent_email(i), password_hash, child_email(i, 0)))
+
+        children, earnings = [], []
+        for j in range(children_per_parent):
+            email = child_email(i, j)
+            allowance_day = rng.randint(1, 31)
+            rows = [
+                (email, 10, allowances.allowance_description(day), 'allowance', datetime(day.year, day.month, day.day))
+                for day in allowances.due_dates(start_date, allowance_day, today)
+            ][:earnings_per_child]
+            for _ in range(earnings_per_child - len(rows)):
+                created_at = datetime.combine(start_date, datetime.min.time()) + timedelta(seconds=rng.uniform(0, window))
+                rows.append((email, rng.choice((1, 2, 5, 10)), 'Chores', 'extra', created_at.replace(microsecond=0)))
+            balance = sum(row[1] for row in rows)
+            children.append((f'Child {i}-{j}', email, password_hash, parent_email(i), 10, allowance_day, start_date, balance))
+            earnings.extend(rows)
+
+        cursor.executemany("""
+            INSERT INTO children (name, email, password_hash, parent_email,
+                                  monthly_allowance, allowance_day, allowance_start_date, balance)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, children)
+        cursor.executemany("""
+            INSERT INTO earnings (child_email, amount, description, type, created_at)
+            VALUES (%s, %s, %s, %s, %s)
+        """, earnings)
+        total_earnings += len(earnings)
+        if i % 1000 == 999:
+            conn.commit()
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    db.close()
+    print(f"Seeded {parents} parents, {parents * children_per_parent} children and "
+          f"{total_earnings} earnings in {time.monotonic() - started:.1f}s")
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, weight = part.split('=')
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(OPERATIONS)
+    if unknown:
+        raise ValueError(f"Unknown operations in mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def login_as(client, email, user_type):
+    with client.session_transaction() as sess:
+        sess['user_email'] = email
+        sess['user_type'] = user_type
+        sess['user_name'] = 'Bench'
+
+
+def op_login(client, rng, family):
+    i, j = family
+    email = parent_email(i) if rng.random() < 0.5 else child_email(i, j)
+    response = client.post('/login', data={'email': email, 'password': PASSWORD})
+    return response.status_code == 302
+
+
+def op_dashboard(client, rng, family):
+    login_as(client, parent_email(family[0]), 'parent')
+    return client.get('/dashboard').status_code == 200
+
+
+def op_child_details(client, rng, family):
+    login_as(client, parent_email(family[0]), 'parent')
+    return client.get(f'/child/{child_email(*family)}').status_code == 200
+
+
+def op_add_earnings(client, rng, family):
+    login_as(client, parent_email(family[0]), 'parent')
+    response = client.post(f'/child/{child_email(*family)}/add-earnings',
+                           data={'amount': rng.choice(('1', '2.50', '5')), 'description': 'Bench chores'})
+    return response.status_code == 302
+
+
+def op_update_allowance(client, rng, family):
+    login_as(client, parent_email(family[0]), 'parent')
+    start = date.today().replace(day=1) - timedelta(days=HISTORY_MONTHS * 31)
+    response = client.post(f'/child/{child_email(*family)}/update-allowance', data={
+        'amount': '10', 'allowance_day': str(rng.randint(1, 28)), 'start_date': start.isoformat()})
+    return response.status_code == 302
+
+
+OPERATIONS = {
+    'login': op_login,
+    'dashboard': op_dashboard,
+    'child_details': op_child_details,
+    'add_earnings': op_add_earnings,
+    'update_allowance': op_update_allowance,
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(app, parents, children_per_parent, mix, concurrency, duration=None, requests=None, rng_seed=42):
+    """Drive ``app`` from ``concurrency`` clients; returns per-operation results"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    remaining = [requests]
+    deadline = time.monotonic() + duration if duration else None
+
+    def take():
+        if deadline is not None:
+            return time.monotonic() < deadline
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def client_loop(worker):
+        rng = random.Random(rng_seed * 1000 + worker)
+        client = app.test_client()
+        local = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        while take():
+            name = rng.choices(names, weights)[0]
+            family = (rng.randrange(parents), rng.randrange(children_per_parent))
+            start = time.perf_counter()
+            try:
+                ok = OPERATIONS[name](client, rng, family)
+            except Exception:
+                ok = False
+            local[name].append(time.perf_counter() - start)
+            if not ok:
+                local_errors[name] += 1
+        with lock:
+            for name in names:
+                latencies[name].extend(local[name])
+                errors[name] += local_errors[name]
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client_loop, args=(worker,)) for worker in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    results = {}
+    for name in names:
+        values = sorted(latencies[name])
+        results[name] = {
+            'requests': len(values),
+            'errors': errors[name],
+            'throughput_rps': len(values) / elapsed if elapsed else 0.0,
+            'mean_ms': sum(values) / len(values) * 1000 if values else 0.0,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+        }
+    everything = sorted(v for values in latencies.values() for v in values)
+    results['total'] = {
+        'requests': len(everything),
+        'errors': sum(errors.values()),
+        'throughput_rps': len(everything) / elapsed if elapsed else 0.0,
+        'mean_ms': sum(everything) / len(everything) * 1000 if everything else 0.0,
+        'p50_ms': percentile(everything, 0.50) * 1000,
+        'p95_ms': percentile(everything, 0.95) * 1000,
+        'p99_ms': percentile(everything, 0.99) * 1000,
+    }
+    return results, elapsed
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def print_results(results, baseline=None):
+    print(f"{'endpoint':<18} {'reqs':>7} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, r in results.items():
+        line = (f"{name:<18} {r['requests']:>7} {r['errors']:>5} {r['throughput_rps']:>8.1f} "
+                f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+        previous = (baseline or {}).get(name)
+        if previous and previous['p95_ms']:
+            change = (r['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100
+            line += f"   p95 {change:+.1f}% vs baseline"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loadtest.db'))
+    parser.add_argument('--reseed', action='store_true', help='Rebuild the database even if it exists.')
+    parser.add_argument('--parents', type=int, default=1000)
+    parser.add_argument('--children-per-parent', type=int, default=3)
+    parser.add_argument('--earnings-per-child', type=int, default=100)
+    parser.add_argument('--bcrypt-rounds', type=int, default=Config.BCRYPT_ROUNDS,
+                        help='Cost of the seeded password hashes and of the app under test.')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Operation weights, e.g. "login=10,dashboard=30".')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, help='Seconds to run (default: until --requests are sent).')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    parser.add_argument('--baseline', help='Earlier JSON result to compare p95 latency against.')
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    if args.reseed or not os.path.exists(args.db):
+        seed(args.db, args.parents, args.children_per_parent, args.earnings_per_child, args.bcrypt_rounds, args.seed)
+
+    import app as webapp
+    webapp.app.config['TESTING'] = True
+    # Hash at the seeded cost so logins measure checking, not one-off rehashing
+    hasher = PasswordHasher(rounds=args.bcrypt_rounds, max_workers=Config.BCRYPT_MAX_WORKERS,
+                            max_queue=Config.BCRYPT_MAX_QUEUE, queue_timeout=Config.BCRYPT_QUEUE_TIMEOUT)
+    db = Database(SQLiteBackend(args.db), hasher=hasher)
+    previous = webapp.use_database(db)
+    try:
+        results, elapsed = run_load(webapp.app, args.parents, args.children_per_parent, mix, args.concurrency,
+                                    args.duration, None if args.duration else args.requests, args.seed)
+    finally:
+        webapp.use_database(previous)
+        db.close()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+                'elapsed': elapsed,
+                'results': results,
+            }, f, indent=2)
+        print(f"Wrote {args.output}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
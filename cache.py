@@ -0,0 +1,238 @@
+"""Read-through cache for Database read methods.
+
+Results are cached under the method name and arguments with a TTL and LRU
+eviction. Every entry is tagged with the child and/or parent it depends on
+(``child:<email>``, ``parent:<email>``); write paths invalidate a tag, which
+retires every entry carrying it at once. Invalidation bumps a per-tag
+generation that is part of each entry's key, so nothing has to enumerate the
+affected keys and stale entries simply age out.
+
+Backends:
+  * ``MemoryBackend``  - per-process OrderedDict; the default for a single worker
+  * ``SQLiteBackend``  - a local key-value file shared by every worker on a host,
+                         so invalidations reach them all; the default when the
+                         server runs several
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from config import Config, server_workers
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return (value,)
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """Key-value stand-in shared across processes through one SQLite file"""
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self.evictions = 0
+
+    def _conn(self):
+        # The file is created on first use, so processes that never touch
+        # the cache (e.g. build steps) leave nothing behind
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires_at REAL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_idx ON cache (accessed_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None and row[1] <= now:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return (pickle.loads(row[0]),)
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now + ttl if ttl else None, now)
+        )
+        evicted = conn.execute("""
+            DELETE FROM cache WHERE key IN (
+                SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,)).rowcount
+        self.evictions += max(evicted, 0)
+
+    def clear(self):
+        self._conn().execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+class Cache:
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _generation(self, tag):
+        found = self.backend.get('tag:' + tag)
+        if found is None:
+            # Unknown tags start at a fresh generation so nothing cached
+            # before a restart of the tag store can be mistaken for current
+            generation = uuid.uuid4().hex
+            self.backend.set('tag:' + tag, generation)
+            return generation
+        return found[0]
+
+    def _key(self, key, tags):
+        generations = [self._generation(tag) for tag in tags]
+        return repr(key) + '|' + '|'.join(generations)
+
+    def get_or_load(self, key, tags, load, single_flight=None):
+        """Return the cached value for ``key`` or call ``load`` and cache it.
+
+        Concurrent misses share one ``load`` through ``single_flight`` if
+        given. They are coalesced on the generation-qualified key, so a miss
+        after an invalidation never joins a load that started before it.
+        """
+        full_key = self._key(key, tags)
+        found = self.backend.get(full_key)
+        if found is not None:
+            with self._lock:
+                self.hits += 1
+            return found[0]
+
+        with self._lock:
+            self.misses += 1
+        value = single_flight.do(full_key, load) if single_flight else load()
+        self.backend.set(full_key, value, self.ttl)
+        return value
+
+    def invalidate(self, *tags):
+        """Retire every entry tagged with any of ``tags``"""
+        for tag in tags:
+            self.backend.set('tag:' + tag, uuid.uuid4().hex)
+        with self._lock:
+            self.invalidations += len(tags)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.backend.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self.backend),
+            }
+
+
+def default_backend():
+    """'sqlite' if the server runs several workers, so a write's invalidation
+    reaches all of them, else 'memory'"""
+    return 'sqlite' if server_workers() > 1 else 'memory'
+
+
+def create_cache(ttl=None):
+    """Build the cache configured in Config, or None if caching is off"""
+    name = Config.CACHE_BACKEND or default_backend()
+    if name == 'none':
+        return None
+    if name == 'sqlite':
+        backend = SQLiteBackend(Config.CACHE_PATH, Config.CACHE_MAX_ENTRIES)
+    elif name == 'memory':
+        backend = MemoryBackend(Config.CACHE_MAX_ENTRIES)
+    else:
+        raise ValueError(f"Unknown CACHE_BACKEND: {name}")
+    return Cache(backend, Config.CACHE_TTL if ttl is None else ttl)
+
+
+def cached(*tags):
+    """Cache a Database read method through ``self.cache``.
+
+    ``tags`` are format strings over the call's positional arguments, e.g.
+    ``@cached('child:{0}')`` tags the entry with the child's email. Reads
+    pinned to the primary after a write skip the cache (see replicas.py).
+    Inside ``Database.versioned()`` the key also carries the version. A
+    ``@coalesced`` method below is coalesced on the cache key instead of its
+    arguments.
+    """
+    def decorator(method):
+        load = getattr(method, 'uncoalesced', method)
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.cache or self.reads_pinned():
+                return method(self, *args, **kwargs)
+            key = (method.__name__, self.read_version()) + args + tuple(sorted(kwargs.items()))
+            return self.cache.get_or_load(
+                key,
+                [tag.format(*args) for tag in tags],
+                lambda: load(self, *args, **kwargs),
+                self.single_flight if load is not method else None
+            )
+        return wrapper
+    return decorator
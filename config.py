@@ -4,9 +4,122 @@ from dotenv import load_dotenv
 load_dotenv()
 
 class Config:
-    SECRET_KEY = 'your-very-secure-secret-key-here'
-    DB_HOST = 'svc-3482219c-a389-4079-b18b-d50662524e8a-shared-dml.aws-virginia-6.svc.singlestore.com'
-    DB_PORT = '3333'
-    DB_USER = 'game'
-    DB_PASSWORD = 'password'
-    DB_NAME = 'db_deepak_34363'
+    SECRET_KEY = os.getenv('SECRET_KEY', 'your-very-secure-secret-key-here')
+    RELEASE = os.getenv('RELEASE', '')  # Deployed build id; part of page ETags so a deploy changes them
+
+    # Storage backend: 'singlestore' or 'sqlite' (embedded, for tests and single-node setups)
+    DB_BACKEND = os.getenv('DB_BACKEND', 'singlestore')
+    DB_HOST = os.getenv('DB_HOST', 'svc-3482219c-a389-4079-b18b-d50662524e8a-shared-dml.aws-virginia-6.svc.singlestore.com')
+    DB_PORT = os.getenv('DB_PORT', '3333')
+    DB_USER = os.getenv('DB_USER', 'game')
+    DB_PASSWORD = os.getenv('DB_PASSWORD', 'password')
+    DB_NAME = os.getenv('DB_NAME', 'db_deepak_34363')
+    SQLITE_PATH = os.getenv('SQLITE_PATH', 'game.db')
+
+    # Read replicas: comma-separated host[:port] (singlestore) or file paths (sqlite).
+    # Reads are spread over the healthy ones; empty sends everything to the primary.
+    DB_REPLICAS = [r.strip() for r in os.getenv('DB_REPLICAS', '').split(',') if r.strip()]
+    DB_REPLICA_RETRY_AFTER = float(os.getenv('DB_REPLICA_RETRY_AFTER', '10'))  # Seconds a failed replica is skipped
+    DB_REPLICA_CHECKOUT_TIMEOUT = float(os.getenv('DB_REPLICA_CHECKOUT_TIMEOUT', '1'))  # Then try the next one
+    READ_YOUR_WRITES_WINDOW = float(os.getenv('READ_YOUR_WRITES_WINDOW', '5'))  # Seconds a session reads the primary after writing
+
+    # Connection pool sizing; connections are checked out per database call
+    DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))  # Seconds to wait for a free connection
+    DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))  # Ping connections idle this long
+
+    # Earnings rows shown per page on the child details page
+    EARNINGS_PAGE_SIZE = int(os.getenv('EARNINGS_PAGE_SIZE', '50'))
+
+    # Balances are read from ledger snapshots plus the rows after them; cut a
+    # new snapshot once a child has this many rows past the latest one
+    LEDGER_SNAPSHOT_EVERY = int(os.getenv('LEDGER_SNAPSHOT_EVERY', '100'))
+
+    # Months of totals on the parent dashboard summary
+    SUMMARY_MONTHS = int(os.getenv('SUMMARY_MONTHS', '12'))
+
+    # Read-through cache for dashboard and child detail reads
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', '')  # 'memory', 'sqlite' or 'none'; empty is 'sqlite' with several workers
+    CACHE_TTL = float(os.getenv('CACHE_TTL', '30'))
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+    CACHE_PATH = os.getenv('CACHE_PATH', 'cache.db')  # Shared file for the 'sqlite' backend
+
+    # Identical reads running at the same time share one query
+    SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', '1') == '1'
+    SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', '2'))  # Seconds to wait before querying anyway
+
+    # Template rendering: compiled templates shared by the workers on a host, and
+    # rendered fragments (the earnings list) cached by the version of their data
+    TEMPLATE_CACHE_DIR = os.getenv('TEMPLATE_CACHE_DIR', 'template-cache')  # Empty disables it
+    FRAGMENT_CACHE_ENABLED = os.getenv('FRAGMENT_CACHE_ENABLED', '1') == '1'
+    FRAGMENT_CACHE_TTL = float(os.getenv('FRAGMENT_CACHE_TTL', '3600'))  # Keys carry the version, so this only bounds memory
+
+    # Live balance and earnings updates over server-sent events (events.py); pages
+    # only stream under the ASGI server, where an open stream holds no thread
+    # 'memory', 'sqlite' (shared by workers on a host) or 'none'. Empty builds none
+    # outside the ASGI server, and there picks 'sqlite' when it runs several workers
+    EVENTS_BROKER = os.getenv('EVENTS_BROKER', '')
+    EVENTS_BROKER_PATH = os.getenv('EVENTS_BROKER_PATH', 'events.db')
+    EVENTS_POLL_INTERVAL = float(os.getenv('EVENTS_POLL_INTERVAL', '0.2'))  # Seconds between 'sqlite' broker polls
+    EVENTS_RETENTION = float(os.getenv('EVENTS_RETENTION', '3600'))  # Seconds the 'sqlite' broker keeps events
+    EVENTS_HISTORY = int(os.getenv('EVENTS_HISTORY', '1000'))  # Events the 'memory' bus keeps for resuming
+    EVENTS_HEARTBEAT = float(os.getenv('EVENTS_HEARTBEAT', '15'))  # Seconds between keep-alive comments
+    EVENTS_MAX_PER_USER = int(os.getenv('EVENTS_MAX_PER_USER', '5'))  # Open streams per user and process
+    EVENTS_MAX_PENDING = int(os.getenv('EVENTS_MAX_PENDING', '100'))  # Unsent events before a slow stream is closed
+
+    # Password hashing runs on a bounded pool so login spikes can't starve other requests
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))  # Changing this rehashes passwords on next login
+    BCRYPT_MAX_WORKERS = int(os.getenv('BCRYPT_MAX_WORKERS', '4'))
+    BCRYPT_MAX_QUEUE = int(os.getenv('BCRYPT_MAX_QUEUE', '32'))
+    BCRYPT_QUEUE_TIMEOUT = float(os.getenv('BCRYPT_QUEUE_TIMEOUT', '0.5'))  # Seconds to wait for a queue slot
+
+    # Bulk family registration (flask register-families, POST /api/families)
+    ONBOARDING_PROCESSES = int(os.getenv('ONBOARDING_PROCESSES', '0'))  # Hashing processes; 0 = one per available core
+    ONBOARDING_TOKEN = os.getenv('ONBOARDING_TOKEN', '')  # Bearer token for the API; empty disables it
+
+    # Write-behind for add_earnings: queue entries and commit them in groups
+    WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', '0') == '1'
+    WRITE_BEHIND_MAX_QUEUE = int(os.getenv('WRITE_BEHIND_MAX_QUEUE', '1000'))
+    WRITE_BEHIND_FLUSH_SIZE = int(os.getenv('WRITE_BEHIND_FLUSH_SIZE', '200'))  # Most entries per commit
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.01'))  # Seconds to gather a batch
+    WRITE_BEHIND_ENQUEUE_TIMEOUT = float(os.getenv('WRITE_BEHIND_ENQUEUE_TIMEOUT', '0.5'))  # Seconds to wait for room
+
+    # Production server (serve.py): pre-forked gunicorn workers with threads
+    SERVE_BIND = os.getenv('SERVE_BIND', '0.0.0.0:5000')
+    SERVE_WORKERS = int(os.getenv('SERVE_WORKERS', '0'))  # 0 = one per available core
+    SERVE_THREADS = int(os.getenv('SERVE_THREADS', '4'))
+    SERVE_MAX_REQUESTS = int(os.getenv('SERVE_MAX_REQUESTS', '10000'))  # Recycle a worker after this many; 0 = never
+    SERVE_MAX_REQUESTS_JITTER = int(os.getenv('SERVE_MAX_REQUESTS_JITTER', '1000'))
+    SERVE_TIMEOUT = int(os.getenv('SERVE_TIMEOUT', '30'))  # Seconds before a stuck worker is killed
+    SERVE_GRACEFUL_TIMEOUT = int(os.getenv('SERVE_GRACEFUL_TIMEOUT', '30'))  # Seconds to drain on shutdown
+    SERVE_KEEPALIVE = int(os.getenv('SERVE_KEEPALIVE', '5'))
+    SERVE_ACCESS_LOG = os.getenv('SERVE_ACCESS_LOG', '1') == '1'
+    ASGI_THREADS = int(os.getenv('ASGI_THREADS', '32'))  # Flask request threads per worker in ASGI mode (asgi.py)
+    READINESS_TIMEOUT = float(os.getenv('READINESS_TIMEOUT', '1'))  # Seconds the readiness check waits for a connection
+
+    # Instrumentation
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD', '0.5'))  # Seconds; slower SQL is logged
+    # /metrics is served to scrapers sending Authorization: Bearer <METRICS_TOKEN>
+    # and to these comma-separated networks; anyone else gets a 404
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    METRICS_ALLOWED_NETWORKS = [n.strip() for n in os.getenv('METRICS_ALLOWED_NETWORKS', '127.0.0.0/8,::1/128').split(',')
+                                if n.strip()]
+    PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', '0') == '1'
+    PROFILER_TOKEN = os.getenv('PROFILER_TOKEN', '')  # Requests sending X-Profile: <token> are sampled
+    PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0.005'))  # Seconds between stack samples
+    PROFILER_DIR = os.getenv('PROFILER_DIR', 'profiles')
+
+
+def available_cores():
+    """Cores this process may run on, honouring container CPU affinity"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def server_workers():
+    """Worker processes the production servers (serve.py, asgi.py) start"""
+    return Config.SERVE_WORKERS or available_cores()
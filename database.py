@@ -1,286 +1,825 @@
-import singlestoredb as db
 from config import Config
-import bcrypt
+from backends import create_backend, create_replica_backends, is_duplicate_key
+from pool import ConnectionPool
+from replicas import Replica, ReplicaSet
+from cache import cached, create_cache
+from singleflight import coalesced, create_single_flight
+from events import create_event_bus
+from hashing import HasherBusy, create_hasher
+from writebehind import create_write_behind
+from metrics import tracked, instrument_connection, POOL_WAIT
+import migrations
+import allowances
+import ledger
+import rollups
+import replicas
+import base64
+import itertools
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+# Rows per multi-row INSERT statement
+INSERT_BATCH_SIZE = 500
+
+# Table holding each account type
+ACCOUNT_TABLES = {'parent': 'parents', 'child': 'children'}
+
+# Column linking each account type to the other
+RELATED_COLUMNS = {'parent': 'child_email', 'child': 'parent_email'}
+
+# Multi-row insert that skips rows colliding with a unique key
+INSERT_IGNORE = {'singlestore': 'INSERT IGNORE INTO', 'sqlite': 'INSERT OR IGNORE INTO'}
+
+# The account version reads in a Database.versioned() block are made at
+_read_version = ContextVar('read_version', default=None)
+
+def encode_cursor(created_at, entry_id):
+    """Opaque pagination cursor pointing just past an earnings row"""
+    value = f"{created_at.isoformat(' ')}|{entry_id}"
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for anything malformed"""
+    try:
+        value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, entry_id = value.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(entry_id)
+    except ValueError as e:
+        raise ValueError(f"Invalid earnings cursor: {cursor!r}") from e
 
 class Database:
-    def __init__(self):
-        self.conn = None
-        self.connect()
-        self.drop_tables()
-        self.create_tables()
+    def __init__(self, backend=None, cache=None, hasher=None, write_behind=None, replica_backends=None,
+                 single_flight=None, events=None):
+        # Each argument defaults to the one configured in Config; pass
+        # cache=False, single_flight=False or events=False to disable
+        # caching, read coalescing or live updates, write_behind=True/False to force
+        # group-committed add_earnings on or off, replica_backends=[] for
+        # no read replicas
+        self.backend = backend or create_backend()
+        self.dialect = self.backend.dialect
+        self.cache = create_cache() if cache is None else cache
+        self.hasher = hasher or create_hasher()
+        self.single_flight = create_single_flight() if single_flight is None else single_flight
+        self.events = create_event_bus() if events is None else events
+        self.pool = self._create_pool(self.connect)
+        if replica_backends is None:
+            replica_backends = create_replica_backends() if backend is None else []
+        self.replicas = ReplicaSet(
+            [Replica(replica, self._create_pool(replica.connect)) for replica in replica_backends],
+            retry_after=Config.DB_REPLICA_RETRY_AFTER,
+            checkout_timeout=Config.DB_REPLICA_CHECKOUT_TIMEOUT
+        )
+        if write_behind is None:
+            write_behind = Config.WRITE_BEHIND_ENABLED
+        self.write_behind = create_write_behind(self._flush_earnings) if write_behind else None
+        # Connections are opened lazily on first use. The schema is managed
+        # by `flask migrate`, so starting a process never runs DDL.
 
-    def drop_tables(self):
-        """Drop existing tables to recreate with new schema"""
-        cursor = self.conn.cursor()
+    def _create_pool(self, connect):
+        return ConnectionPool(
+            instrument_connection(connect),
+            min_size=Config.DB_POOL_MIN_SIZE,
+            max_size=Config.DB_POOL_MAX_SIZE,
+            timeout=Config.DB_POOL_TIMEOUT,
+            health_check_interval=Config.DB_POOL_HEALTH_CHECK_INTERVAL,
+            on_checkout=POOL_WAIT.observe
+        )
+
+    def reads_pinned(self):
+        """True while reads must see this context's own recent writes"""
+        return replicas.reads_from_primary()
+
+    def read_version(self):
+        """The version of the enclosing versioned() block, or None; cached and
+        coalesced reads are keyed by it as well as their arguments"""
+        return _read_version.get()
+
+    @contextmanager
+    def versioned(self, account_type, email):
+        """Read an account's version and yield it, for a page validated by it.
+
+        The version and every read in the block come from the primary, so
+        they can't straddle replicas that are at different points. Cached
+        and coalesced reads in the block are keyed by the version. Requests
+        for the same version share them, and nothing loaded before a write,
+        in any worker, is served after it.
+        """
+        token = _read_version.set((account_type, email))
         try:
-            cursor.execute("DROP TABLE IF EXISTS earnings")  # Drop earnings first due to potential foreign key
-            cursor.execute("DROP TABLE IF EXISTS children")
-            cursor.execute("DROP TABLE IF EXISTS parents")
-            self.conn.commit()
-        except Exception as e:
-            print(f"Error dropping tables: {e}")
+            version = self.get_version(account_type, email)
+            _read_version.set((account_type, email) + tuple(version or ()))
+            yield version
+        finally:
+            _read_version.reset(token)
+
+    @contextmanager
+    def read_connection(self):
+        """A connection for reads: a replica's, or the primary's when there
+        are none, none is healthy, this context wrote recently or it is
+        reading at a version"""
+        if self.replicas and not replicas.reads_from_primary() and _read_version.get() is None:
+            with self.replicas.connection(self.pool) as conn:
+                yield conn
+        else:
+            with self.pool.connection() as conn:
+                yield conn
+
+    def _wrote(self):
+        # Without replicas this still keeps the writer off cached and
+        # in-flight reads that may predate the write
+        replicas.stick_to_primary(Config.READ_YOUR_WRITES_WINDOW)
+
+    def drop_tables(self):
+        """Drop all tables, including the migration history; used by tests"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("DROP TABLE IF EXISTS earnings")  # Drop earnings first due to potential foreign key
+                cursor.execute("DROP TABLE IF EXISTS children")
+                cursor.execute("DROP TABLE IF EXISTS parents")
+                cursor.execute("DROP TABLE IF EXISTS allowance_runs")
+                cursor.execute("DROP TABLE IF EXISTS balance_snapshots")
+                cursor.execute("DROP TABLE IF EXISTS earnings_monthly")
+                cursor.execute("DROP TABLE IF EXISTS schema_version")
+                conn.commit()
+                if self.cache:
+                    self.cache.clear()
+            except Exception:
+                logger.exception("Error dropping tables")
 
     def connect(self):
+        """Open a new connection; used by the pool whenever it needs one"""
         try:
-            self.conn = db.connect(
-                host=Config.DB_HOST,
-                port=int(Config.DB_PORT),
-                user=Config.DB_USER,
-                password=Config.DB_PASSWORD,
-                database=Config.DB_NAME
-            )
-        except Exception as e:
-            print(f"Database connection error: {e}")
+            return self.backend.connect()
+        except Exception:
+            logger.exception("Database connection error")
             raise
 
     def create_tables(self):
-        cursor = self.conn.cursor()
-        
-        # Create parents table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS parents (
-                id INT AUTO_INCREMENT,
-                name VARCHAR(100) NOT NULL,
-                email VARCHAR(100) NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                child_email VARCHAR(100),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (id, email),
-                INDEX parent_email_idx (email)
-            )
-        """)
-        
-        # Create children table with financial fields
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS children (
-                id INT AUTO_INCREMENT,
-                name VARCHAR(100) NOT NULL,
-                email VARCHAR(100) NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                parent_email VARCHAR(100),
-                monthly_allowance DECIMAL(10,2) DEFAULT 0.00,
-                allowance_day INT DEFAULT 1,  # Day of month for allowance
-                allowance_start_date DATE,    # When allowance starts
-                balance DECIMAL(10,2) DEFAULT 0.00,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (id, email),
-                INDEX child_email_idx (email)
-            )
-        """)
-        
-        # Create earnings table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS earnings (
-                id INT AUTO_INCREMENT,
-                child_email VARCHAR(100) NOT NULL,
-                amount DECIMAL(10,2) NOT NULL,
-                description TEXT,
-                type VARCHAR(20) NOT NULL,    # 'allowance' or 'extra'
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (id)
-            )
-        """)
-        
-        self.conn.commit()
+        """Bring the schema up to date by applying any pending migrations"""
+        return migrations.migrate(self)
 
+    @tracked
     def create_parent(self, name, email, password, child_email):
-        cursor = self.conn.cursor()
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        
-        try:
-            # First check if email already exists
-            cursor.execute("SELECT id FROM parents WHERE email = %s", (email,))
-            if cursor.fetchone():
-                print("Email already exists")
+        return self.insert_parent(name, email, self.hasher.hash(password), child_email)
+
+    @tracked
+    def insert_parent(self, name, email, password_hash, child_email):
+        """Register a parent whose password is already hashed; False if the email is taken"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # The unique key on email turns away an existing account
+                cursor.execute("""
+                    INSERT INTO parents (name, email, password_hash, child_email, updated_at)
+                    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+                """, (name, email, password_hash, child_email))
+                conn.commit()
+                self.invalidate(parents=[email])
+                return True
+            except Exception as e:
+                if is_duplicate_key(e):
+                    logger.info("Email already exists: %s", email)
+                else:
+                    logger.exception("Error creating parent")
                 return False
-            
-            cursor.execute("""
-                INSERT INTO parents (name, email, password_hash, child_email)
-                VALUES (%s, %s, %s, %s)
-            """, (name, email, password_hash, child_email))
-            self.conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error creating parent: {e}")
-            return False
 
+    @tracked
     def create_child(self, name, email, password, parent_email):
-        cursor = self.conn.cursor()
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        
-        try:
-            # First check if email already exists
-            cursor.execute("SELECT id FROM children WHERE email = %s", (email,))
-            if cursor.fetchone():
-                print("Email already exists")
+        return self.insert_child(name, email, self.hasher.hash(password), parent_email)
+
+    @tracked
+    def insert_child(self, name, email, password_hash, parent_email):
+        """Register a child whose password is already hashed; False if the email is taken"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # The unique key on email turns away an existing account
+                cursor.execute("""
+                    INSERT INTO children (name, email, password_hash, parent_email, updated_at)
+                    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+                """, (name, email, password_hash, parent_email))
+                # The parent's dashboard lists their children
+                self._bump_versions(cursor, 'parent', [parent_email])
+                conn.commit()
+                self.invalidate(children=[email], parents=[parent_email])
+                return True
+            except Exception as e:
+                if is_duplicate_key(e):
+                    logger.info("Email already exists: %s", email)
+                else:
+                    logger.exception("Error creating child")
                 return False
-            
+
+    @tracked
+    def insert_accounts(self, account_type, accounts):
+        """Register (ref, name, email, password_hash, related_email) accounts of one type.
+
+        Accounts go in multi-row statements that skip emails already taken,
+        all in one transaction. The unique key on email decides, so two
+        imports racing for an email can't both get it. A row counts as
+        inserted only if the stored hash is the one it brought. Returns
+        (inserted emails, [(ref, reason)] rejected).
+        """
+        table = ACCOUNT_TABLES[account_type]
+        inserted, rejected = set(), []
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for i in range(0, len(accounts), INSERT_BATCH_SIZE):
+                    batch = accounts[i:i + INSERT_BATCH_SIZE]
+                    cursor.execute(
+                        f"{INSERT_IGNORE[self.dialect]} {table} "
+                        f"(name, email, password_hash, {RELATED_COLUMNS[account_type]}, updated_at) VALUES "
+                        + ", ".join(["(%s, %s, %s, %s, CURRENT_TIMESTAMP)"] * len(batch)),
+                        [value for _, name, email, password_hash, related in batch
+                         for value in (name, email, password_hash, related)]
+                    )
+                    cursor.execute(f"""
+                        SELECT email, password_hash FROM {table}
+                        WHERE email IN ({", ".join(["%s"] * len(batch))})
+                    """, [account[2] for account in batch])
+                    stored = dict(cursor.fetchall())
+                    for ref, _, email, password_hash, _ in batch:
+                        if stored.get(email) == password_hash and email not in inserted:
+                            inserted.add(email)
+                        else:
+                            rejected.append((ref, f"{email} is already registered"))
+                parents = {account[4] for account in accounts if account[2] in inserted} \
+                    if account_type == 'child' else set()
+                # Their dashboards list the new children
+                self._bump_versions(cursor, 'parent', parents)
+                conn.commit()
+            except Exception:
+                logger.exception("Error registering %s accounts", account_type)
+                raise
+        if account_type == 'child':
+            self.invalidate(children=inserted, parents=parents)
+        else:
+            self.invalidate(parents=inserted)
+        return inserted, rejected
+
+    @tracked
+    def verify_credentials(self, email, password):
+        """Log in a parent or child with one lookup.
+
+        Both account tables are searched in a single indexed UNION query and
+        only the matching hash is checked, parents first as before. Returns
+        {'type': 'parent' or 'child', 'name': ...} or None. Hashes made with an
+        outdated cost factor are upgraded on successful login.
+        """
+        # Check the password after the connection is back in the pool
+        for account_type, password_hash, name in self.find_accounts(email):
+            if self.hasher.check(password, password_hash):
+                self._rehash_if_needed(ACCOUNT_TABLES[account_type], email, password, password_hash)
+                return {'type': account_type, 'name': name}
+        return None
+
+    @tracked
+    def find_accounts(self, email):
+        """(account_type, password_hash, name) for the accounts with this email, parents first"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO children (name, email, password_hash, parent_email)
-                VALUES (%s, %s, %s, %s)
-            """, (name, email, password_hash, parent_email))
-            self.conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error creating child: {e}")
-            return False
+                SELECT 'parent', password_hash, name FROM parents WHERE email = %s
+                UNION ALL
+                SELECT 'child', password_hash, name FROM children WHERE email = %s
+            """, (email, email))
+            return sorted(cursor.fetchall(), key=lambda row: row[0] != 'parent')
 
+    @tracked
     def verify_parent(self, email, password):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT password_hash, name FROM parents WHERE email = %s", (email,))
-        result = cursor.fetchone()
-        
-        if result and bcrypt.checkpw(password.encode('utf-8'), result[0].encode('utf-8')):
-            return {'name': result[1]}
-        return None
+        return self._verify('parents', email, password)
 
+    @tracked
     def verify_child(self, email, password):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT password_hash, name FROM children WHERE email = %s", (email,))
-        result = cursor.fetchone()
+        return self._verify('children', email, password)
+
+    def _verify(self, table, email, password):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT password_hash, name FROM {table} WHERE email = %s", (email,))
+            result = cursor.fetchone()
         
-        if result and bcrypt.checkpw(password.encode('utf-8'), result[0].encode('utf-8')):
+        if result and self.hasher.check(password, result[0]):
+            self._rehash_if_needed(table, email, password, result[0])
             return {'name': result[1]}
         return None
 
+    def _rehash_if_needed(self, table, email, password, password_hash):
+        if self.hasher.needs_rehash(password_hash):
+            try:
+                new_hash = self.hasher.hash(password)
+            except HasherBusy:
+                # The login already succeeded; upgrade the hash on a later one
+                logger.info("Hasher busy, not rehashing password for %s", email)
+                return
+            self.replace_hash(table, email, password_hash, new_hash)
+
+    @tracked
+    def replace_hash(self, table, email, password_hash, new_hash):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # Only replace the hash we verified, in case the password changed meanwhile
+                cursor.execute(f"""
+                    UPDATE {table}
+                    SET password_hash = %s
+                    WHERE email = %s AND password_hash = %s
+                """, (new_hash, email, password_hash))
+                conn.commit()
+            except Exception:
+                logger.exception("Error rehashing password")
+
+    def after_fork(self):
+        """Make a Database inherited through fork() safe to use in the child.
+
+        Called in each pre-forked server worker (see serve.py). Pooled
+        connections and background threads belong to the parent process.
+        """
+        self.pool.after_fork()
+        self.replicas.after_fork()
+        self.hasher.after_fork()
+        if self.single_flight:
+            self.single_flight.after_fork()
+        if self.events:
+            self.events.after_fork()
+        if self.write_behind:
+            self.write_behind.after_fork()
+
     def close(self):
-        if self.conn:
-            self.conn.close()
+        if self.write_behind:
+            self.write_behind.close()
+        self.pool.close()
+        self.replicas.close()
+        if self.events:
+            self.events.close()
 
-    def get_children_for_parent(self, parent_email):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT name, email 
-            FROM children 
-            WHERE parent_email = %s
-        """, (parent_email,))
-        return cursor.fetchall() 
+    def _bump_versions(self, cursor, account_type, emails):
+        """Mark accounts as changed so cached copies of their pages revalidate"""
+        emails = [email for email in emails if email]
+        if emails:
+            cursor.execute(f"""
+                UPDATE {ACCOUNT_TABLES[account_type]}
+                SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE email IN ({", ".join(["%s"] * len(emails))})
+            """, emails)
 
-    def get_child_details(self, child_email):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT name, email, monthly_allowance, balance 
-            FROM children 
-            WHERE email = %s
-        """, (child_email,))
-        return cursor.fetchone()
+    @coalesced
+    @tracked
+    def get_version(self, account_type, email):
+        """(version, updated_at) of a parent or child, or None; the cheap check behind ETags"""
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT version, updated_at FROM {ACCOUNT_TABLES[account_type]} WHERE email = %s
+            """, (email,))
+            return cursor.fetchone()
 
-    def update_monthly_allowance(self, child_email, new_amount, allowance_day, start_date):
-        cursor = self.conn.cursor()
+    def invalidate(self, children=(), parents=()):
+        """Drop cached reads for these children and parents after a write
+        commits, and read from the primary for a while so the writer sees it"""
+        self._wrote()
+        if self.cache:
+            self.cache.invalidate(*[f'child:{email}' for email in children],
+                                  *[f'parent:{email}' for email in parents if email])
+
+    def outbox(self):
+        """A list for a transaction's events, or None when nobody listens (see events.py)"""
+        return [] if self.events else None
+
+    def publish(self, outbox):
+        """Send (child_email, event_type, data) events once their transaction has committed.
+
+        The write stands whether or not its events get out, so failures are
+        only logged; open pages then show the change on their next load.
+        """
         try:
-            # Update allowance settings
+            for child_email, event_type, data in outbox or ():
+                self.events.publish(child_email, event_type, data)
+        except Exception:
+            logger.exception("Error publishing %d events", len(outbox))
+
+    @cached('parent:{0}')
+    @coalesced
+    @tracked
+    def get_children_for_parent(self, parent_email):
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                UPDATE children 
-                SET monthly_allowance = %s,
-                    allowance_day = %s,
-                    allowance_start_date = %s
-                WHERE email = %s
-            """, (new_amount, allowance_day, start_date, child_email))
-            
-            # Process past allowances if start date is in the past
-            self.process_past_allowances(child_email)
-            
-            self.conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error updating allowance: {e}")
-            return False
+                SELECT name, email 
+                FROM children 
+                WHERE parent_email = %s
+            """, (parent_email,))
+            return cursor.fetchall() 
 
-    def process_past_allowances(self, child_email):
-        cursor = self.conn.cursor()
-        try:
-            # Get child's allowance details
+    @cached('child:{0}')
+    @coalesced
+    @tracked
+    def get_child_details(self, child_email):
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                SELECT monthly_allowance, allowance_day, allowance_start_date, email
-                FROM children
+                SELECT name, email, monthly_allowance
+                FROM children 
                 WHERE email = %s
             """, (child_email,))
-            
             child = cursor.fetchone()
-            if not child or not child[2]:  # If no start date, skip
-                return
-            
-            monthly_allowance, allowance_day, start_date, email = child
-            
-            # Get the last allowance payment date
+            if not child:
+                return None
+            # The balance comes from the ledger, not the children.balance counter
+            return tuple(child) + (ledger.balance_as_of(cursor, child_email),)
+
+    @cached('child:{0}')
+    @coalesced
+    @tracked
+    def get_balance_as_of(self, child_email, as_of):
+        """The child's balance including every ledger row created up to ``as_of``"""
+        with self.read_connection() as conn:
+            return ledger.balance_as_of(conn.cursor(), child_email, as_of)
+
+    @coalesced
+    @tracked
+    def get_monthly_summary(self, parent_email, months=12, today=None):
+        """Rollup rows (child_email, name, month, type, total, entries) for the
+        parent's children over the last ``months`` months, oldest first.
+
+        Children with nothing earned in the window get one row of NULLs.
+        """
+        today = today or date.today()
+        since = rollups.months_back(today, months)
+        # Future-dated rows (e.g. imported) fall after the window, not into it
+        until = rollups.add_months(today, 1)
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                SELECT MAX(created_at)
-                FROM earnings
-                WHERE child_email = %s AND type = 'allowance'
-            """, (child_email,))
-            
-            last_payment = cursor.fetchone()[0]
-            
-            # If no previous payments, use start date
-            if not last_payment:
-                last_payment = start_date
-            
-            # Calculate all missing allowance payments
-            from datetime import datetime, date
-            today = date.today()
-            current_date = last_payment
-            
-            while current_date <= today:
-                # If it's past the allowance day in the current month
-                if current_date.day >= allowance_day:
-                    # Add allowance entry
-                    cursor.execute("""
-                        INSERT INTO earnings 
-                        (child_email, amount, description, type, created_at)
-                        VALUES (%s, %s, %s, 'allowance', %s)
-                    """, (
-                        email,
-                        monthly_allowance,
-                        f"Monthly Allowance for {current_date.strftime('%B %Y')}",
-                        datetime(current_date.year, current_date.month, allowance_day)
-                    ))
-                    
-                    # Update balance
-                    cursor.execute("""
-                        UPDATE children
-                        SET balance = balance + %s
-                        WHERE email = %s
-                    """, (monthly_allowance, email))
+                SELECT c.email, c.name, r.month, r.type, r.total, r.entries
+                FROM children c
+                LEFT JOIN earnings_monthly r ON r.child_email = c.email AND r.month >= %s AND r.month < %s
+                WHERE c.parent_email = %s
+                ORDER BY c.name, c.email, r.month, r.type
+            """, (since, until, parent_email))
+            return cursor.fetchall()
+
+    @tracked
+    def rebuild_rollups(self, child_emails=None):
+        """Recompute monthly rollups from the ledger; returns the rows written"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            rebuilt = rollups.rebuild(cursor, self.dialect, child_emails)
+            conn.commit()
+            return rebuilt
+
+    @tracked
+    def verify_ledger(self, child_emails=None):
+        """Check balance snapshots and balance counters against the ledger; see ledger.verify"""
+        with self.pool.connection() as conn:
+            return ledger.verify(conn.cursor(), child_emails)
+
+    @tracked
+    def rebuild_snapshots(self, child_emails):
+        """Recompute the given children's balance snapshots from the ledger"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for child_email in child_emails:
+                ledger.rebuild(cursor, child_email)
+            conn.commit()
+            self.invalidate(children=child_emails)
+
+    @tracked
+    def update_monthly_allowance(self, child_email, new_amount, allowance_day, start_date):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # Update allowance settings
+                cursor.execute("""
+                    UPDATE children 
+                    SET monthly_allowance = %s,
+                        allowance_day = %s,
+                        allowance_start_date = %s,
+                        version = version + 1,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE email = %s
+                """, (new_amount, allowance_day, start_date, child_email))
                 
-                # Move to next month
-                if current_date.month == 12:
-                    current_date = date(current_date.year + 1, 1, allowance_day)
-                else:
-                    current_date = date(current_date.year, current_date.month + 1, allowance_day)
-            
-            self.conn.commit()
-        except Exception as e:
-            print(f"Error processing past allowances: {e}")
-            self.conn.rollback()
+                outbox = self.outbox()
+                if outbox is not None:
+                    outbox.append((child_email, 'allowance', {
+                        'monthly_allowance': new_amount, 'allowance_day': allowance_day, 'start_date': start_date,
+                    }))
+                
+                # Process past allowances if start date is in the past,
+                # on the same connection so it sees the new settings
+                self._process_past_allowances(cursor, child_email, outbox=outbox)
+                
+                conn.commit()
+                self.invalidate(children=[child_email])
+                self.publish(outbox)
+                return True
+            except Exception:
+                logger.exception("Error updating allowance")
+                conn.rollback()
+                return False
+
+    @tracked
+    def process_past_allowances(self, child_email, today=None):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                outbox = self.outbox()
+                credited = self._process_past_allowances(cursor, child_email, today, outbox)
+                conn.commit()
+                self.invalidate(children=[child_email])
+                self.publish(outbox)
+                return credited
+            except Exception:
+                logger.exception("Error processing past allowances")
+                conn.rollback()
+                return 0
+
+    def _process_past_allowances(self, cursor, child_email, today=None, outbox=None):
+        return self._credit_allowances(cursor, [child_email], today or date.today(), outbox).get(child_email, 0)
 
+    def _credit_allowances(self, cursor, child_emails, today, outbox=None):
+        """Credit every unpaid allowance up to ``today`` for a batch of children.
+
+        Locks the children's rows so concurrent runs serialize, then only pays
+        the months after each child's last recorded allowance, which makes the
+        back-fill safe to repeat. All payments in the batch go out in one
+        multi-row INSERT and one balance UPDATE. Returns {child_email: payments};
+        the payments' events are added to ``outbox`` if given.
+        """
+        placeholders = ", ".join(["%s"] * len(child_emails))
+        cursor.execute(f"""
+            SELECT email, monthly_allowance, allowance_day, allowance_start_date
+            FROM children
+            WHERE email IN ({placeholders}) AND allowance_start_date IS NOT NULL
+            FOR UPDATE
+        """, list(child_emails))
+        children = cursor.fetchall()
+        if not children:
+            return {}
+        
+        # Get the last allowance payment date for each child
+        cursor.execute(f"""
+            SELECT child_email, MAX(created_at)
+            FROM earnings
+            WHERE type = 'allowance' AND child_email IN ({placeholders})
+            GROUP BY child_email
+        """, list(child_emails))
+        last_payments = dict(cursor.fetchall())
+        
+        rows, deltas, credited = [], {}, {}
+        for email, monthly_allowance, allowance_day, start_date in children:
+            due = allowances.due_dates(start_date, allowance_day or 1, today, last_payments.get(email))
+            if not due:
+                continue
+            rows.extend(
+                (email, monthly_allowance, allowances.allowance_description(day), 'allowance',
+                 datetime(day.year, day.month, day.day))
+                for day in due
+            )
+            deltas[email] = monthly_allowance * len(due)
+            credited[email] = len(due)
+        
+        self._insert_earnings(cursor, rows, outbox)
+        self._apply_balance_deltas(cursor, deltas, outbox)
+        return credited
+
+    def _insert_earnings(self, cursor, rows, outbox=None):
+        """Insert (child_email, amount, description, type, created_at) rows in multi-row statements,
+        adding an ``earning`` event per row to ``outbox`` if given"""
+        for i in range(0, len(rows), INSERT_BATCH_SIZE):
+            batch = rows[i:i + INSERT_BATCH_SIZE]
+            cursor.execute(
+                "INSERT INTO earnings (child_email, amount, description, type, created_at) VALUES "
+                + ", ".join(["(%s, %s, %s, %s, %s)"] * len(batch)),
+                [value for row in batch for value in row]
+            )
+        ledger.after_append(cursor, rows)
+        rollups.after_append(cursor, rows, self.dialect)
+        if outbox is not None:
+            outbox.extend(
+                (child_email, 'earning', {'amount': amount, 'description': description, 'type': entry_type,
+                                          'created_at': created_at})
+                for child_email, amount, description, entry_type, created_at in rows
+            )
+
+    def _apply_balance_deltas(self, cursor, deltas, outbox=None):
+        """Add {child_email: amount} to the children's balances, one UPDATE per batch of children.
+
+        Also bumps each child's version; every earnings write goes through here.
+        With an ``outbox``, adds a ``balance`` event per child carrying the
+        delta and the new balance, read back under the row lock, so clients
+        can apply it in any order.
+        """
+        emails = list(deltas)
+        for i in range(0, len(emails), INSERT_BATCH_SIZE):
+            batch = emails[i:i + INSERT_BATCH_SIZE]
+            cursor.execute(f"""
+                UPDATE children
+                SET balance = balance + CASE email {" ".join(["WHEN %s THEN %s"] * len(batch))} END,
+                    version = version + 1,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE email IN ({", ".join(["%s"] * len(batch))})
+            """, [value for email in batch for value in (email, deltas[email])] + batch)
+            if outbox is not None:
+                cursor.execute(f"""
+                    SELECT email, balance FROM children WHERE email IN ({", ".join(["%s"] * len(batch))})
+                """, batch)
+                outbox.extend((email, 'balance', {'delta': deltas[email], 'balance': balance})
+                              for email, balance in cursor.fetchall())
+
+    @tracked
     def add_earnings(self, child_email, amount, description):
-        cursor = self.conn.cursor()
+        # Checked up front, so a bad amount can't fail a group commit it shares
         try:
-            # Add earnings record with type 'extra'
-            cursor.execute("""
-                INSERT INTO earnings (child_email, amount, description, type, created_at)
-                VALUES (%s, %s, %s, 'extra', CURRENT_TIMESTAMP)
-            """, (child_email, amount, description))
-            
-            # Update child's balance
-            cursor.execute("""
-                UPDATE children 
-                SET balance = balance + %s 
-                WHERE email = %s
-            """, (amount, child_email))
-            
-            self.conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error adding earnings: {e}")
+            amount = ledger.parse_amount(amount)
+        except ValueError:
+            logger.info("Rejected earnings for %s: invalid amount %r", child_email, amount)
             return False
+        if self.write_behind:
+            # Raises QueueFull when the queue has no room
+            entry = (child_email, amount, description, 'extra', datetime.now())
+            committed = self.write_behind.submit(entry)
+            if committed:
+                # The flusher thread invalidated; pin this caller's reads
+                self._wrote()
+            return committed
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # Add earnings record with type 'extra' and update child's balance
+                outbox = self.outbox()
+                self._insert_earnings(cursor, [(child_email, amount, description, 'extra', datetime.now())], outbox)
+                self._apply_balance_deltas(cursor, {child_email: amount}, outbox)
+                conn.commit()
+                self.invalidate(children=[child_email])
+                self.publish(outbox)
+                return True
+            except Exception:
+                logger.exception("Error adding earnings")
+                return False
+
+    @tracked
+    def _flush_earnings(self, entries):
+        """Commit queued add_earnings entries as one multi-row insert and one balance delta per child.
+
+        If the batch fails, its entries are retried one at a time, so one
+        bad entry fails only its own write. Returns a result per entry.
+        """
+        if self._commit_earnings(entries):
+            return [True] * len(entries)
+        if len(entries) == 1:
+            return [False]
+        return [self._commit_earnings([entry]) for entry in entries]
+
+    def _commit_earnings(self, entries):
+        """Insert entries and apply their balance deltas in one transaction; True once committed"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                deltas = {}
+                for child_email, amount, _, _, _ in entries:
+                    deltas[child_email] = deltas.get(child_email, 0) + amount
+                outbox = self.outbox()
+                self._insert_earnings(cursor, entries, outbox)
+                self._apply_balance_deltas(cursor, deltas, outbox)
+                conn.commit()
+                self.invalidate(children=deltas)
+                self.publish(outbox)
+                return True
+            except Exception:
+                logger.exception("Error flushing %d queued earnings", len(entries))
+                return False
+
+    @tracked
+    def import_earnings(self, records, allowed_children=None):
+        """Load (ref, row) records of (child_email, amount, description, type, created_at).
+
+        Rows are inserted in multi-row batches and each child's balance is
+        updated once at the end, all in one transaction. Rows for children
+        that don't exist, or aren't in ``allowed_children`` when given, are
+        skipped and reported back as (ref, reason) in ``rejected``.
+        """
+        known, unknown = set(), set()
+        deltas = {}
+        rejected = []
+        imported = 0
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                batch = []
+                for record in itertools.chain(records, [None]):
+                    if record is not None:
+                        batch.append(record)
+                        if len(batch) < INSERT_BATCH_SIZE:
+                            continue
+                    new = {row[0] for _, row in batch} - known - unknown
+                    if new:
+                        found = self._existing_children(cursor, new)
+                        if allowed_children is not None:
+                            found &= set(allowed_children)
+                        known |= found
+                        unknown |= new - found
+                    rows = []
+                    for ref, row in batch:
+                        if row[0] in known:
+                            rows.append(row)
+                            deltas[row[0]] = deltas.get(row[0], 0) + row[1]
+                        else:
+                            rejected.append((ref, f"unknown child {row[0]}"))
+                    if rows:
+                        self._insert_earnings(cursor, rows)
+                        imported += len(rows)
+                    batch = []
+                self._apply_balance_deltas(cursor, deltas)
+                conn.commit()
+            except Exception:
+                logger.exception("Error importing earnings")
+                raise
+        self.invalidate(children=deltas)
+        return {'imported': imported, 'children': len(deltas), 'rejected': rejected}
+
+    def _existing_children(self, cursor, emails):
+        emails = list(emails)
+        cursor.execute(f"""
+            SELECT email FROM children WHERE email IN ({", ".join(["%s"] * len(emails))})
+        """, emails)
+        return {row[0] for row in cursor.fetchall()}
+
+    def iter_earnings(self, child_emails, batch_size=1000):
+        """Yield every ledger row (child_email, amount, description, type, created_at)
+        for the children, each child's oldest first.
+
+        Rows come off a dedicated streaming connection a batch at a time, so
+        memory stays flat however long the ledger is. The connection is
+        closed when the generator finishes or is closed.
+        """
+        child_emails = list(child_emails)
+        if not child_emails:
+            return
+        if self.replicas and not replicas.reads_from_primary():
+            connect = lambda: self.replicas.connect_streaming(self.backend)
+        else:
+            connect = lambda: self.backend.connect(streaming=True)
+        conn = instrument_connection(connect)()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT child_email, amount, description, type, created_at
+                FROM earnings
+                WHERE child_email IN ({", ".join(["%s"] * len(child_emails))})
+                ORDER BY child_email, created_at, id
+            """, child_emails)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    @cached('child:{0}')
+    @coalesced
+    @tracked
+    def get_earnings_history(self, child_email, limit=None, before=None):
+        """Earnings newest first as (amount, description, type, created_at, id).
+
+        ``before`` is a cursor from get_earnings_page; only older rows are
+        returned. Served from the (child_email, created_at, id) index, so a
+        page costs the same however long the history is.
+        """
+        sql = """
+            SELECT amount, description, type, created_at, id
+            FROM earnings
+            WHERE child_email = %s
+        """
+        params = [child_email]
+        if before:
+            created_at, entry_id = decode_cursor(before)
+            sql += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+            params += [created_at, created_at, entry_id]
+        sql += " ORDER BY created_at DESC, id DESC"
+        if limit:
+            sql += " LIMIT %s"
+            params.append(int(limit))
+        
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return cursor.fetchall()
 
-    def get_earnings_history(self, child_email):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT amount, description, type, created_at 
-            FROM earnings 
-            WHERE child_email = %s 
-            ORDER BY created_at DESC
-        """, (child_email,))
-        return cursor.fetchall() 
\ No newline at end of file
+    @tracked
+    def get_earnings_page(self, child_email, limit, before=None):
+        """One page of earnings plus the cursor for the next, older page (or None)"""
+        rows = self.get_earnings_history(child_email, limit + 1, before)
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1][3], rows[-1][4])
@@ -0,0 +1,445 @@
+"""Live balance and earnings updates, pushed to browsers as server-sent events.
+
+Each child has a channel named after their email. Once an earnings write
+commits (add_earnings, process_past_allowances, update_monthly_allowance or
+an allowance run), the Database publishes an event on that channel. It
+sends one ``earning`` per new ledger row, one ``balance`` per changed
+balance and one ``allowance`` when the settings change. Pages open an
+EventSource on ``/child/<email>/events`` and apply the events as they come,
+so they no longer need to poll or reload.
+
+Buses:
+  * ``EventBus``     - fans events out to this process's streams only; the
+                       default for a single ASGI worker
+  * ``SQLiteBroker`` - a broker stand-in shared by every process on a host. Each
+                       process polls one SQLite file for new events and fans
+                       them out locally, so a write in one worker (or in
+                       ``flask run-allowances``) reaches streams in the others.
+                       The default when the ASGI server runs several workers
+
+Left at its empty default, EVENTS_BROKER builds no bus at all in processes
+that serve no streams (serve.py, flask commands), so their writes publish
+nothing. Set it to 'sqlite' for writes from those to reach ASGI streams.
+
+Every event has an id. A reconnecting EventSource sends the last id it saw
+as ``Last-Event-ID``, and the stream replays what the bus still remembers
+after it. When some of those events are gone, the client gets a ``reset``
+and reloads. An id from another process's memory (or from before a
+restart) names nothing here, so the stream simply carries on from now
+rather than sending the client round again. Pages pass the
+bus's latest id when they are rendered, so nothing between the render and
+the connection is lost. Idle streams send a comment every EVENTS_HEARTBEAT
+seconds, which keeps proxies from closing them and finds dead clients.
+Each user may hold EVENTS_MAX_PER_USER streams per process. A stream whose
+client falls EVENTS_MAX_PENDING events behind is closed, and the client
+catches up by reconnecting.
+
+A stream stays open for as long as its page, which under ``serve.py`` holds
+one of the worker's SERVE_THREADS threads the whole time. Pages only open
+streams when ``app.config['EVENT_STREAMS']`` is set, which the ASGI server
+(asgi.py) does; there an idle stream holds no thread.
+"""
+import asyncio
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+
+from config import Config, server_workers
+import metrics
+
+# ``id`` is what clients see; ``seq`` orders events within one bus
+Event = namedtuple('Event', ('id', 'seq', 'channel', 'type', 'data'))
+
+# Reconnect delay the browser is told to use, in milliseconds
+RETRY_MS = 3000
+
+HEARTBEAT = b': heartbeat\n\n'
+
+
+def format_event(event):
+    """The SSE wire form of an Event"""
+    lines = [f'event: {event.type}', f'data: {event.data}']
+    if event.id is not None:
+        lines.insert(0, f'id: {event.id}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def reset_event(channel):
+    """Tells the client it missed events that can't be replayed"""
+    return Event(None, 0, channel, 'reset', '{}')
+
+
+class Subscription:
+    """A stream's queue of events, read by a blocking thread"""
+
+    def __init__(self, max_pending=None):
+        self._queue = queue.Queue(max_pending or Config.EVENTS_MAX_PENDING)
+        self.overflowed = False
+
+    def deliver(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """The next event, or None after ``timeout`` seconds without one"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    """A stream's queue of events, read by a coroutine on ``loop``"""
+
+    def __init__(self, loop, max_pending=None):
+        self._loop = loop
+        self._queue = asyncio.Queue(max_pending or Config.EVENTS_MAX_PENDING)
+        self.overflowed = False
+
+    def deliver(self, event):
+        # Publishers run on other threads
+        self._loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout):
+        # Not wait_for, which can swallow the cancellation that ends the
+        # stream when an event arrives at the same moment
+        getter = asyncio.ensure_future(self._queue.get())
+        try:
+            done, _ = await asyncio.wait({getter}, timeout=timeout)
+        finally:
+            if not getter.done():
+                getter.cancel()  # Leaves any item it would have taken queued
+        return getter.result() if getter in done else None
+
+
+class EventBus:
+    """In-process publish/subscribe with a short history for resuming streams"""
+
+    def __init__(self, history=None):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # channel -> set of subscriptions
+        self._history = deque(maxlen=history or Config.EVENTS_HISTORY)
+        # Ids carry this process's token, so an id from another worker's
+        # memory is recognised and not mistaken for one of ours
+        self._token = uuid.uuid4().hex[:8]
+        self._seq = itertools.count(1)
+        self.published = 0
+
+    def publish(self, channel, event_type, data):
+        with self._lock:
+            seq = next(self._seq)
+            event = Event(f'{self._token}-{seq}', seq, channel, event_type, json.dumps(data, default=str))
+            self._history.append(event)
+            self.published += 1
+        self._deliver(event)
+
+    def _deliver(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(event.channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def subscribe(self, channel, subscription):
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+
+    def unsubscribe(self, channel, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+    def seq_of(self, event_id):
+        """The seq of an id this bus issued, or None"""
+        token, _, seq = (event_id or '').partition('-')
+        if token != self._token or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def latest_id(self):
+        """The id a stream resumes from to get everything published after now"""
+        with self._lock:
+            return f'{self._token}-{self._history[-1].seq if self._history else 0}'
+
+    def since(self, channel, event_id):
+        """The channel's events after ``event_id``, or None if some are no longer known.
+
+        An id this bus didn't issue has nothing to replay here; the stream
+        goes on from now.
+        """
+        seq = self.seq_of(event_id)
+        if seq is None:
+            return []
+        with self._lock:
+            history = list(self._history)
+        if history and history[0].seq > seq + 1:
+            return None  # Events after it have been dropped from the history
+        return [event for event in history if event.seq > seq and event.channel == channel]
+
+    def after_fork(self):
+        """A forked worker starts with its own memory, and needs its own token"""
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._history.clear()
+        self._token = uuid.uuid4().hex[:8]
+
+    def close(self):
+        pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'published': self.published,
+                'channels': len(self._subscribers),
+                'subscribers': sum(len(s) for s in self._subscribers.values()),
+            }
+
+
+class SQLiteBroker(EventBus):
+    """Event bus shared across processes through one SQLite file.
+
+    Publishing appends a row, whose rowid is the event id everywhere.
+    Processes with streams poll for new rows every EVENTS_POLL_INTERVAL
+    seconds and fan them out locally. Rows older than EVENTS_RETENTION
+    seconds are pruned.
+    """
+
+    PRUNE_EVERY = 1000  # Publishes between prunes
+
+    def __init__(self, path, poll_interval=None, retention=None):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval or Config.EVENTS_POLL_INTERVAL
+        self.retention = retention or Config.EVENTS_RETENTION
+        self._local = threading.local()
+        self._poller = None
+        self._stop = threading.Event()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                type TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS events_channel_idx ON events (channel, id)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def publish(self, channel, event_type, data):
+        conn = self._conn()
+        conn.execute("INSERT INTO events (channel, type, data, created_at) VALUES (?, ?, ?, ?)",
+                     (channel, event_type, json.dumps(data, default=str), time.time()))
+        with self._lock:
+            self.published += 1
+            prune = self.published % self.PRUNE_EVERY == 0
+        if prune:
+            conn.execute("DELETE FROM events WHERE created_at < ?", (time.time() - self.retention,))
+        # Local streams get it from the poller like everyone else's
+
+    def subscribe(self, channel, subscription):
+        super().subscribe(channel, subscription)
+        with self._lock:
+            if self._poller is None:
+                # Only processes with streams poll; publishers never need to
+                self._stop.clear()
+                self._poller = threading.Thread(target=self._poll, args=(self._last_row(),),
+                                                name='events-poller', daemon=True)
+                self._poller.start()
+
+    def _last_row(self):
+        return self._conn().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def _poll(self, last_seen):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                rows = self._conn().execute(
+                    "SELECT id, channel, type, data FROM events WHERE id > ? ORDER BY id LIMIT 1000",
+                    (last_seen,)).fetchall()
+            except sqlite3.Error:
+                continue  # Locked or briefly unavailable; try again next tick
+            for row_id, channel, event_type, data in rows:
+                last_seen = row_id
+                self._deliver(Event(str(row_id), row_id, channel, event_type, data))
+
+    def latest_id(self):
+        return str(self._last_row())
+
+    def seq_of(self, event_id):
+        return int(event_id) if (event_id or '').isdigit() else None
+
+    def since(self, channel, event_id):
+        seq = self.seq_of(event_id)
+        if seq is None:
+            return []
+        conn = self._conn()
+        oldest = conn.execute("SELECT MIN(id) FROM events").fetchone()[0]
+        if oldest is not None and oldest > seq + 1:
+            return None  # Pruned, possibly including some of this channel's
+        rows = conn.execute("SELECT id, channel, type, data FROM events WHERE channel = ? AND id > ? ORDER BY id",
+                            (channel, seq)).fetchall()
+        return [Event(str(row[0]), row[0], *row[1:]) for row in rows]
+
+    def after_fork(self):
+        super().after_fork()
+        self._local = threading.local()
+        self._poller = None
+        self._stop = threading.Event()
+
+    def close(self):
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
+
+
+def default_broker(streams=False):
+    """The bus to use when EVENTS_BROKER is empty: none unless this process
+    serves streams, else 'sqlite' if the server runs several workers, which a
+    memory bus can't span"""
+    if not streams:
+        return 'none'
+    return 'sqlite' if server_workers() > 1 else 'memory'
+
+
+def create_event_bus(streams=False):
+    """Build the bus configured in Config, or None if live updates are off"""
+    broker = Config.EVENTS_BROKER or default_broker(streams)
+    if broker == 'none':
+        return None
+    if broker == 'sqlite':
+        return SQLiteBroker(Config.EVENTS_BROKER_PATH)
+    if broker == 'memory':
+        return EventBus()
+    raise ValueError(f"Unknown EVENTS_BROKER: {broker}")
+
+
+def may_watch(db, user_email, user_type, child_email):
+    """Whether a user may follow a child's updates: the child, or their parent"""
+    if user_type == 'child':
+        return user_email == child_email
+    if user_type != 'parent':
+        return False
+    # At the parent's current version, never from a cache a write hasn't reached
+    with db.versioned('parent', user_email):
+        return any(child[1] == child_email for child in db.get_children_for_parent(user_email))
+
+
+class StreamLimiter:
+    """Counts open streams per user and refuses more than ``max_per_user``"""
+
+    def __init__(self, max_per_user):
+        self.max_per_user = max_per_user
+        self._open = {}
+        self._lock = threading.Lock()
+        self.refused = 0
+
+    def acquire(self, user):
+        with self._lock:
+            if self._open.get(user, 0) >= self.max_per_user:
+                self.refused += 1
+                return False
+            self._open[user] = self._open.get(user, 0) + 1
+            return True
+
+    def release(self, user):
+        with self._lock:
+            self._open[user] -= 1
+            if not self._open[user]:
+                del self._open[user]
+
+    def stats(self):
+        with self._lock:
+            return {'open': sum(self._open.values()), 'users': len(self._open), 'refused': self.refused}
+
+
+def _replay(bus, channel, last_event_id):
+    """Events to send before live ones, and the seq of the last of them"""
+    if not last_event_id:
+        return [], None
+    missed = bus.since(channel, last_event_id)
+    if missed is None:
+        return [reset_event(channel)], None
+    return missed, missed[-1].seq if missed else bus.seq_of(last_event_id)
+
+
+def stream(bus, channel, last_event_id=None, heartbeat=None):
+    """Yield the SSE body for ``channel``: missed events, then live ones as they come"""
+    heartbeat = heartbeat or Config.EVENTS_HEARTBEAT
+    subscription = Subscription()
+    # Subscribe before looking back, so nothing falls between the two
+    bus.subscribe(channel, subscription)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'.encode('ascii')
+        missed, sent = _replay(bus, channel, last_event_id)
+        for event in missed:
+            yield format_event(event)
+        while not subscription.overflowed:
+            event = subscription.get(heartbeat)
+            if event is None:
+                yield HEARTBEAT
+            elif sent is None or event.seq > sent:
+                yield format_event(event)
+    finally:
+        bus.unsubscribe(channel, subscription)
+
+
+async def stream_async(bus, channel, last_event_id=None, heartbeat=None):
+    """``stream`` for an event loop; holds no thread while waiting"""
+    heartbeat = heartbeat or Config.EVENTS_HEARTBEAT
+    subscription = AsyncSubscription(asyncio.get_running_loop())
+    bus.subscribe(channel, subscription)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'.encode('ascii')
+        missed, sent = await asyncio.get_running_loop().run_in_executor(
+            None, _replay, bus, channel, last_event_id)
+        for event in missed:
+            yield format_event(event)
+        while not subscription.overflowed:
+            event = await subscription.get(heartbeat)
+            if event is None:
+                yield HEARTBEAT
+            elif sent is None or event.seq > sent:
+                yield format_event(event)
+    finally:
+        bus.unsubscribe(channel, subscription)
+
+
+def init_app(app):
+    """Leave streams off, limit them per user and export stream and ``app.extensions['db']`` bus state as gauges"""
+    limiter = StreamLimiter(Config.EVENTS_MAX_PER_USER)
+    app.extensions['event_streams'] = limiter
+    app.config.setdefault('EVENT_STREAMS', False)
+
+    def stream_stats():
+        bus = app.extensions['db'].events
+        return {(key,): value for key, value in dict(limiter.stats(), **(bus.stats() if bus else {})).items()}
+
+    metrics.REGISTRY.register(metrics.Gauge(
+        'event_streams', 'Open server-sent event streams and published events', ('stat',), stream_stats))
@@ -0,0 +1,112 @@
+"""Password hashing on a bounded executor.
+
+bcrypt is deliberately slow (100-300 ms of CPU per call), so it runs on a
+small dedicated thread pool instead of on whatever request thread needs it.
+bcrypt releases the GIL, so the pool uses real cores while other requests keep
+being served. When more than ``max_workers + max_queue`` hashes are pending,
+new ones are refused with HasherBusy instead of queueing without bound; a
+login spike then fails fast rather than starving dashboard traffic.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from config import Config
+from metrics import BCRYPT_LATENCY
+
+
+def hash_password(password, rounds):
+    """bcrypt-hash one password; a plain function so process pools can run it"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+
+class PasswordHasher:
+    def __init__(self, rounds=12, max_workers=4, max_queue=32, queue_timeout=0.5):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def after_fork(self):
+        """Start a fresh executor; worker threads don't survive a fork"""
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self._lock = threading.Lock()
+
+    def _submit(self, fn, *args, timeout):
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy("Too many password checks in progress")
+        try:
+            return self._executor.submit(self._call, fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _run(self, fn, *args):
+        return self._submit(fn, *args, timeout=self.queue_timeout).result()
+
+    def _call(self, fn, *args):
+        try:
+            return fn(*args)
+        finally:
+            # Free the slot before the caller is woken with the result
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(self._hash, password)
+
+    def _hash(self, password):
+        with BCRYPT_LATENCY.time('hash'):
+            return hash_password(password, self.rounds)
+
+    def check(self, password, password_hash):
+        return self._run(self._check, password, password_hash)
+
+    def _check(self, password, password_hash):
+        if isinstance(password_hash, str):
+            password_hash = password_hash.encode('utf-8')
+        try:
+            with BCRYPT_LATENCY.time('check'):
+                return bcrypt.checkpw(password.encode('utf-8'), password_hash)
+        except ValueError:
+            # Not a bcrypt hash at all
+            return False
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different cost factor than configured"""
+        if isinstance(password_hash, bytes):
+            password_hash = password_hash.decode('utf-8')
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def stats(self):
+        return {
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'rejected': self.rejected,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def create_hasher():
+    return PasswordHasher(
+        rounds=Config.BCRYPT_ROUNDS,
+        max_workers=Config.BCRYPT_MAX_WORKERS,
+        max_queue=Config.BCRYPT_MAX_QUEUE,
+        queue_timeout=Config.BCRYPT_QUEUE_TIMEOUT
+    )
@@ -0,0 +1,56 @@
+"""Liveness and readiness endpoints for orchestrators and load balancers.
+
+``/health/live`` answers 200 while the process can serve requests at all;
+it never touches the database, so a database outage doesn't get healthy
+workers restarted. ``/health/ready`` answers 200 only when a pooled database
+connection passes a round trip, and 503 once the worker has started
+draining for shutdown, so traffic moves elsewhere before it exits.
+"""
+import threading
+
+from flask import jsonify
+
+from config import Config
+
+_draining = threading.Event()
+
+
+def mark_draining():
+    """Fail readiness from now on; called when a worker is asked to stop"""
+    _draining.set()
+
+
+def is_draining():
+    return _draining.is_set()
+
+
+def after_fork():
+    _draining.clear()
+
+
+def check_database(db):
+    """None if a pooled connection answers SELECT 1, else the error message"""
+    try:
+        with db.pool.connection(timeout=Config.READINESS_TIMEOUT) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        return None
+    except Exception as e:
+        return str(e) or e.__class__.__name__
+
+
+def init_app(app):
+    """Serve the probes; readiness checks ``app.extensions['db']``"""
+    @app.route('/health/live')
+    def liveness():
+        return jsonify(status='ok')
+
+    @app.route('/health/ready')
+    def readiness():
+        if is_draining():
+            return jsonify(status='draining'), 503
+        error = check_database(app.extensions['db'])
+        if error:
+            return jsonify(status='unavailable', database=error), 503
+        return jsonify(status='ok')
@@ -0,0 +1,242 @@
+"""Balances derived from the earnings ledger.
+
+``earnings`` is append-only: every credit is a row, and nothing is updated
+or deleted. A child's balance as of time T is the sum of their rows created
+before T. To avoid summing the whole history, ``balance_snapshots`` stores
+checkpoints. Each snapshot ``(child_email, period_end, balance, entries)``
+holds the sum and count of the child's rows with ``created_at < period_end``.
+A balance is then the latest snapshot at or before T plus a short tail scan
+over the (child_email, created_at, id) index.
+
+Snapshots are written as rows are appended. Once a child's tail reaches
+``Config.LEDGER_SNAPSHOT_EVERY`` rows, it is cut at every month boundary and
+every ``LEDGER_SNAPSHOT_EVERY`` rows. An append dated in the past (allowance
+back-fill) drops the child's snapshots after that date, and they are rebuilt
+from the previous one. ``verify`` checks every snapshot, and the
+``children.balance`` counter, against the ledger in one ordered pass.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+from config import Config
+
+ZERO = Decimal('0.00')
+
+# Largest amount DECIMAL(10,2) holds
+MAX_AMOUNT = Decimal('99999999.99')
+
+# Children per statement when working in bulk
+CHUNK_SIZE = 500
+
+
+def parse_amount(amount):
+    """An earnings amount as a Decimal; raises ValueError unless it fits DECIMAL(10,2) exactly"""
+    try:
+        value = Decimal(str(amount).strip())
+    except ArithmeticError as e:
+        raise ValueError(f"Invalid amount: {amount!r}") from e
+    # Checked in this order, so an out-of-range value is never quantized
+    if not value.is_finite() or abs(value) > MAX_AMOUNT or value != value.quantize(ZERO):
+        raise ValueError(f"Invalid amount: {amount!r}")
+    return value.quantize(ZERO)
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def latest_snapshot(cursor, child_email, as_of=None):
+    """(period_end, balance, entries) of the newest snapshot ending at or before ``as_of``"""
+    sql = """
+        SELECT period_end, balance, entries
+        FROM balance_snapshots
+        WHERE child_email = %s
+    """
+    params = [child_email]
+    if as_of is not None:
+        sql += " AND period_end <= %s"
+        params.append(as_of)
+    cursor.execute(sql + " ORDER BY period_end DESC LIMIT 1", params)
+    return cursor.fetchone() or (None, ZERO, 0)
+
+
+def balance_as_of(cursor, child_email, as_of=None):
+    """Sum of the child's ledger up to and including ``as_of`` (now if None)"""
+    period_end, balance, _ = latest_snapshot(cursor, child_email, as_of)
+    sql = "SELECT COALESCE(SUM(amount), 0) FROM earnings WHERE child_email = %s"
+    params = [child_email]
+    if period_end is not None:
+        sql += " AND created_at >= %s"
+        params.append(period_end)
+    if as_of is not None:
+        sql += " AND created_at <= %s"
+        params.append(as_of)
+    cursor.execute(sql, params)
+    return Decimal(balance) + Decimal(cursor.fetchone()[0])
+
+
+def plan_snapshots(start, rows, every):
+    """Snapshots to cut from a tail of (created_at, amount) rows in ledger order.
+
+    ``start`` is the (period_end, balance, entries) the tail begins at. A
+    snapshot is cut at each month boundary the tail crosses and before every
+    ``every``-th row. Cuts only fall strictly between two rows' timestamps, so
+    rows sharing a timestamp are never split.
+    """
+    _, balance, entries = start
+    balance = Decimal(balance)
+    snapshots = []
+    since = 0
+    previous = None
+    for created_at, amount in rows:
+        if previous is not None and created_at > previous:
+            if month_start(created_at) > previous:
+                snapshots.append((month_start(created_at), balance, entries))
+                since = 0
+            elif since >= every:
+                snapshots.append((created_at, balance, entries))
+                since = 0
+        balance += Decimal(amount)
+        entries += 1
+        since += 1
+        previous = created_at
+    return snapshots
+
+
+def _tail_lengths(cursor, child_emails):
+    """{child_email: rows after the child's latest snapshot}"""
+    cursor.execute(f"""
+        SELECT e.child_email, COUNT(*)
+        FROM earnings e
+        LEFT JOIN (
+            SELECT child_email, MAX(period_end) AS period_end
+            FROM balance_snapshots
+            WHERE child_email IN ({_placeholders(child_emails)})
+            GROUP BY child_email
+        ) s ON s.child_email = e.child_email
+        WHERE e.child_email IN ({_placeholders(child_emails)})
+          AND (s.period_end IS NULL OR e.created_at >= s.period_end)
+        GROUP BY e.child_email
+    """, list(child_emails) * 2)
+    return dict(cursor.fetchall())
+
+
+def snapshot_child(cursor, child_email, every):
+    """Cut any snapshots due in the child's tail; returns how many were written"""
+    start = latest_snapshot(cursor, child_email)
+    sql = "SELECT created_at, amount FROM earnings WHERE child_email = %s"
+    params = [child_email]
+    if start[0] is not None:
+        sql += " AND created_at >= %s"
+        params.append(start[0])
+    cursor.execute(sql + " ORDER BY created_at, id", params)
+    snapshots = plan_snapshots(start, cursor.fetchall(), every)
+    if snapshots:
+        cursor.execute(
+            "INSERT INTO balance_snapshots (child_email, period_end, balance, entries) VALUES "
+            + ", ".join(["(%s, %s, %s, %s)"] * len(snapshots)),
+            [value for snapshot in snapshots for value in (child_email,) + tuple(snapshot)]
+        )
+    return len(snapshots)
+
+
+def after_append(cursor, rows, every=None):
+    """Keep snapshots consistent with freshly inserted (child_email, amount, ..., created_at) rows.
+
+    Runs in the inserting transaction, so snapshots and ledger commit together.
+    Takes the children's row locks (the ones the balance update needs anyway)
+    before reading their tails, so concurrent appends for a child snapshot
+    one after the other and each sees the other's rows.
+    """
+    every = every or Config.LEDGER_SNAPSHOT_EVERY
+    earliest = {}
+    for row in rows:
+        child_email, created_at = row[0], row[-1]
+        if child_email not in earliest or created_at < earliest[child_email]:
+            earliest[child_email] = created_at
+    if not earliest:
+        return
+
+    # A back-dated row changes every snapshot that ends after it
+    emails = sorted(earliest)
+    for i in range(0, len(emails), CHUNK_SIZE):
+        chunk = emails[i:i + CHUNK_SIZE]
+        cursor.execute(f"""
+            SELECT email FROM children WHERE email IN ({_placeholders(chunk)}) ORDER BY email FOR UPDATE
+        """, chunk)
+        cursor.fetchall()
+        cursor.execute(
+            "DELETE FROM balance_snapshots WHERE "
+            + " OR ".join(["(child_email = %s AND period_end > %s)"] * len(chunk)),
+            [value for email in chunk for value in (email, earliest[email])]
+        )
+        for email, tail in _tail_lengths(cursor, chunk).items():
+            if tail >= every:
+                snapshot_child(cursor, email, every)
+
+
+def verify(cursor, child_emails=None):
+    """Check snapshots and ``children.balance`` against the ledger.
+
+    Streams each child's ledger once in order and compares running totals at
+    every snapshot. Returns a report with the mismatches found.
+    """
+    if child_emails is None:
+        cursor.execute("SELECT email FROM children ORDER BY email")
+        child_emails = [row[0] for row in cursor.fetchall()]
+    report = {'children': 0, 'snapshots': 0, 'entries': 0, 'bad_snapshots': [], 'bad_balances': []}
+
+    for i in range(0, len(child_emails), CHUNK_SIZE):
+        chunk = list(child_emails[i:i + CHUNK_SIZE])
+        cursor.execute(f"""
+            SELECT child_email, period_end, balance, entries
+            FROM balance_snapshots
+            WHERE child_email IN ({_placeholders(chunk)})
+            ORDER BY child_email, period_end
+        """, chunk)
+        snapshots = {}
+        for email, period_end, balance, entries in cursor.fetchall():
+            snapshots.setdefault(email, []).append((period_end, Decimal(balance), entries))
+
+        cursor.execute(f"""
+            SELECT email, balance FROM children WHERE email IN ({_placeholders(chunk)})
+        """, chunk)
+        counters = {email: Decimal(balance or 0) for email, balance in cursor.fetchall()}
+
+        cursor.execute(f"""
+            SELECT child_email, created_at, amount
+            FROM earnings
+            WHERE child_email IN ({_placeholders(chunk)})
+            ORDER BY child_email, created_at, id
+        """, chunk)
+        ledger = {}
+        for email, created_at, amount in cursor.fetchall():
+            ledger.setdefault(email, []).append((created_at, Decimal(amount)))
+
+        for email in chunk:
+            report['children'] += 1
+            rows = ledger.get(email, [])
+            report['entries'] += len(rows)
+            balance, entries, position = ZERO, 0, 0
+            for period_end, expected_balance, expected_entries in snapshots.get(email, []):
+                while position < len(rows) and rows[position][0] < period_end:
+                    balance += rows[position][1]
+                    entries += 1
+                    position += 1
+                report['snapshots'] += 1
+                if (balance, entries) != (expected_balance, expected_entries):
+                    report['bad_snapshots'].append((email, period_end, expected_balance, balance))
+            balance += sum((amount for _, amount in rows[position:]), ZERO)
+            if email in counters and counters[email] != balance:
+                report['bad_balances'].append((email, counters[email], balance))
+    return report
+
+
+def rebuild(cursor, child_email, every=None):
+    """Drop and recompute one child's snapshots from the ledger"""
+    cursor.execute("DELETE FROM balance_snapshots WHERE child_email = %s", (child_email,))
+    return snapshot_child(cursor, child_email, every or Config.LEDGER_SNAPSHOT_EVERY)
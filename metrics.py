@@ -0,0 +1,365 @@
+"""In-process performance metrics exported in the Prometheus text format.
+
+Metrics live in a module-level registry and are updated in place by the code
+they measure: routes (see ``init_app``), SQL statements (through
+``instrument_connection``), pool waits and bcrypt calls. ``render`` produces
+the ``/metrics`` payload. Everything is per process; with several workers
+each one is scraped on its own.
+"""
+import bisect
+import hmac
+import ipaddress
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger('game.slow_queries')
+
+# Latency buckets in seconds, from sub-millisecond queries to slow bcrypt calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The Database method currently running, used to label the SQL it issues
+current_method = ContextVar('current_method', default='unknown')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[-1] if series else 0
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    labels = _format_labels(self.labels, label_values, ('le', repr(bound)))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.labels, label_values, ('le', '+Inf'))
+                lines.append(f'{self.name}_bucket{labels} {series[-1]}')
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f'{self.name}_sum{labels} {series[-2]}')
+                lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return lines
+
+
+class Gauge:
+    """A value read from a callback at scrape time; the callback returns {label values: value}"""
+
+    def __init__(self, name, help, labels=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        try:
+            values = self.callback() if self.callback else {}
+        except Exception:
+            logger.exception("Error collecting %s", self.name)
+            values = {}
+        for label_values, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request', ('route', 'method', 'status')))
+TEMPLATE_RENDER = REGISTRY.register(Histogram(
+    'template_render_seconds', 'Time spent rendering a template', ('template',)))
+FRAGMENT_CACHE = REGISTRY.register(Counter(
+    'template_fragment_cache_total', 'Cached template fragments served or rendered', ('template', 'result')))
+QUERY_LATENCY = REGISTRY.register(Histogram(
+    'db_query_duration_seconds', 'Time spent executing SQL, by Database method', ('method',)))
+QUERY_ROWS = REGISTRY.register(Counter(
+    'db_query_rows_total', 'Rows fetched or affected, by Database method', ('method',)))
+QUERY_ERRORS = REGISTRY.register(Counter(
+    'db_query_errors_total', 'SQL statements that raised, by Database method', ('method',)))
+SLOW_QUERIES = REGISTRY.register(Counter(
+    'db_slow_queries_total', 'Statements slower than SLOW_QUERY_THRESHOLD', ('method',)))
+POOL_WAIT = REGISTRY.register(Histogram(
+    'db_pool_wait_seconds', 'Time spent waiting to check out a connection'))
+BCRYPT_LATENCY = REGISTRY.register(Histogram(
+    'bcrypt_duration_seconds', 'Time spent in bcrypt', ('operation',)))
+WRITE_BEHIND_BATCH = REGISTRY.register(Histogram(
+    'write_behind_batch_size', 'Writes committed together by one write-behind flush',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)))
+
+
+def render():
+    return REGISTRY.render()
+
+
+def tracked(method):
+    """Label the SQL issued inside a Database method with the method's name"""
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        token = current_method.set(method.__name__)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            current_method.reset(token)
+    return wrapper
+
+
+class InstrumentedCursor:
+    """Times every statement and counts its rows under the current Database method"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _record(self, sql, elapsed, rows):
+        method = current_method.get()
+        QUERY_LATENCY.observe(elapsed, method)
+        if rows > 0:
+            QUERY_ROWS.inc(method, amount=rows)
+        if elapsed >= Config.SLOW_QUERY_THRESHOLD:
+            SLOW_QUERIES.inc(method)
+            slow_query_logger.warning("Slow query in %s took %.3fs: %s", method, elapsed, ' '.join(sql.split())[:500])
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            result = self._cursor.execute(sql, params) if params is not None else self._cursor.execute(sql)
+        except Exception:
+            QUERY_ERRORS.inc(current_method.get())
+            raise
+        rowcount = self._cursor.rowcount if self._cursor.rowcount and self._cursor.rowcount > 0 else 0
+        is_select = sql.lstrip().upper().startswith(('SELECT', 'WITH'))
+        self._record(sql, time.perf_counter() - start, 0 if is_select else rowcount)
+        return result
+
+    def executemany(self, sql, seq_of_params):
+        start = time.perf_counter()
+        try:
+            result = self._cursor.executemany(sql, seq_of_params)
+        except Exception:
+            QUERY_ERRORS.inc(current_method.get())
+            raise
+        self._record(sql, time.perf_counter() - start, max(self._cursor.rowcount or 0, 0))
+        return result
+
+    def _fetched(self, rows, count):
+        if count:
+            QUERY_ROWS.inc(current_method.get(), amount=count)
+        return rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._fetched(row, 1 if row is not None else 0)
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        return self._fetched(rows, len(rows))
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        return self._fetched(rows, len(rows))
+
+    def __iter__(self):
+        for row in self._cursor:
+            QUERY_ROWS.inc(current_method.get())
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def instrument_connection(connect):
+    """Wrap a ``connect`` callable so its connections report query metrics"""
+    @wraps(connect)
+    def wrapper():
+        return InstrumentedConnection(connect())
+    return wrapper
+
+
+def init_app(app, db=None):
+    """Time every request and template render, and serve /metrics"""
+    from flask import Response, abort, g, request, template_rendered, before_render_template
+
+    import profiler
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        profiler.start_if_requested()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_LATENCY.observe(time.perf_counter() - started, route, request.method, response.status_code)
+        return profiler.finish(response)
+
+    def before_render(sender, template, context, **extra):
+        g.setdefault('render_started', []).append(time.perf_counter())
+
+    def after_render(sender, template, context, **extra):
+        stack = g.get('render_started')
+        if stack:
+            TEMPLATE_RENDER.observe(time.perf_counter() - stack.pop(), template.name or 'string')
+
+    before_render_template.connect(before_render, app, weak=False)
+    template_rendered.connect(after_render, app, weak=False)
+
+    if db is not None:
+        register_database(db)
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if not scrape_allowed(request):
+            abort(404)
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def scrape_allowed(request):
+    """Whether ``request`` may read /metrics: it carries METRICS_TOKEN or
+    comes from METRICS_ALLOWED_NETWORKS"""
+    if Config.METRICS_TOKEN:
+        expected = f'Bearer {Config.METRICS_TOKEN}'.encode('utf-8')
+        if hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'), expected):
+            return True
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in Config.METRICS_ALLOWED_NETWORKS)
+
+
+def register_database(db):
+    """Export pool, cache and hasher state for ``db`` as gauges"""
+    def pool_stats():
+        stats = db.pool.stats()
+        return {(key,): value for key, value in stats.items()}
+
+    REGISTRY.register(Gauge('db_pool', 'Connection pool state and counters', ('stat',), pool_stats))
+
+    def cache_stats():
+        if not db.cache:
+            return {}
+        return {(key,): value for key, value in db.cache.stats().items()}
+
+    REGISTRY.register(Gauge('cache', 'Read cache state and counters', ('stat',), cache_stats))
+    REGISTRY.register(Gauge(
+        'bcrypt_rejected', 'Password checks refused because the queue was full', (),
+        lambda: {(): db.hasher.stats()['rejected']}))
+
+    def write_behind_stats():
+        if not db.write_behind:
+            return {}
+        return {(key,): value for key, value in db.write_behind.stats().items()}
+
+    REGISTRY.register(Gauge('write_behind', 'Write-behind queue state and counters', ('stat',), write_behind_stats))
+
+    def single_flight_stats():
+        if not db.single_flight:
+            return {}
+        return {(key,): value for key, value in db.single_flight.stats().items()}
+
+    REGISTRY.register(Gauge('single_flight', 'Coalesced identical reads', ('stat',), single_flight_stats))
+
+    def replica_stats():
+        return {(name, key): value
+                for name, stats in db.replicas.stats().items() for key, value in stats.items()}
+
+    REGISTRY.register(Gauge('db_replica', 'Read replica health and counters', ('replica', 'stat'), replica_stats))
@@ -0,0 +1,362 @@
+"""Versioned schema migrations.
+
+Migrations are applied in order by ``flask migrate`` and recorded in the
+``schema_version`` table, so running the command again only applies what is
+new. The web process never runs DDL itself. Append new migrations to the end
+of ``MIGRATIONS``; never edit one that has already shipped.
+
+DDL commits as it goes on SingleStore, so a migration that stops partway
+is re-run from its first statement. Steps that can't simply be repeated
+are written with ``create_index``/``add_column`` (or similar step
+functions), which skip what is already there.
+"""
+
+
+def index_exists(cursor, dialect, table, name):
+    if dialect == 'sqlite':
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND name = %s", (name,))
+    else:
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """, (table, name))
+    return cursor.fetchone()[0] > 0
+
+
+def column_exists(cursor, dialect, table, column):
+    if dialect == 'sqlite':
+        cursor.execute(f"PRAGMA table_info({table})")
+        return any(row[1] == column for row in cursor.fetchall())
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cursor.fetchone()[0] > 0
+
+
+def create_index(name, table, columns):
+    """A step creating an index unless it already exists"""
+    def step(cursor, dialect):
+        if not index_exists(cursor, dialect, table, name):
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+    return step
+
+
+def add_column(table, column, definition):
+    """A step adding a column unless it already exists"""
+    def step(cursor, dialect):
+        if not column_exists(cursor, dialect, table, column):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+def table_exists(cursor, dialect, table):
+    if dialect == 'sqlite':
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+    else:
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = %s
+        """, (table,))
+    return cursor.fetchone()[0] > 0
+
+
+def email_is_unique(cursor, table):
+    """Whether a SingleStore table already has a unique key on email alone"""
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = 'email' AND non_unique = 0
+    """, (table,))
+    return cursor.fetchone()[0] > 0
+
+
+class MigrationError(Exception):
+    """A migration can't proceed until the data is fixed by hand"""
+
+
+def refuse_duplicate_emails(table):
+    """A step stopping the migration if any accounts in ``table`` share an email"""
+    def step(cursor, dialect):
+        if not table_exists(cursor, dialect, table):
+            return  # Mid-rebuild; the copy being filled is keyed on email
+        cursor.execute(f"SELECT email, COUNT(*) FROM {table} GROUP BY email HAVING COUNT(*) > 1 ORDER BY email")
+        duplicates = cursor.fetchall()
+        if duplicates:
+            listed = ', '.join(f"{email} ({count})" for email, count in duplicates[:20])
+            raise MigrationError(f"{len(duplicates)} emails have more than one account in {table}: {listed}; "
+                                 "merge or remove them, then migrate again")
+    return step
+
+
+def rebuild_unique_on_email(table, definition, columns):
+    """A SingleStore step swapping ``table`` for a copy keyed and sharded on email.
+
+    SingleStore unique keys must contain the shard key, so the table is
+    rebuilt as ``<table>_new`` from ``definition`` and renamed into place.
+    Each part checks what an interrupted run already did.
+    """
+    def step(cursor, dialect):
+        new = f"{table}_new"
+        if table_exists(cursor, dialect, table) and not email_is_unique(cursor, table):
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {new} ({definition})")
+            cursor.execute(f"INSERT IGNORE INTO {new} ({columns}) SELECT {columns} FROM {table}")
+            cursor.execute(f"DROP TABLE {table}")
+        if table_exists(cursor, dialect, new):
+            cursor.execute(f"ALTER TABLE {new} RENAME TO {table}")
+    return step
+
+
+MIGRATIONS = [
+    (1, "Create parents, children and earnings tables", [
+        {
+            'singlestore': """
+                CREATE TABLE IF NOT EXISTS parents (
+                    id INT AUTO_INCREMENT,
+                    name VARCHAR(100) NOT NULL,
+                    email VARCHAR(100) NOT NULL,
+                    password_hash VARCHAR(255) NOT NULL,
+                    child_email VARCHAR(100),
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (id, email),
+                    INDEX parent_email_idx (email)
+                )
+            """,
+            'sqlite': """
+                CREATE TABLE IF NOT EXISTS parents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name VARCHAR(100) NOT NULL,
+                    email VARCHAR(100) NOT NULL,
+                    password_hash VARCHAR(255) NOT NULL,
+                    child_email VARCHAR(100),
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+        },
+        {'sqlite': "CREATE INDEX IF NOT EXISTS parent_email_idx ON parents (email)"},
+        {
+            'singlestore': """
+                CREATE TABLE IF NOT EXISTS children (
+                    id INT AUTO_INCREMENT,
+                    name VARCHAR(100) NOT NULL,
+                    email VARCHAR(100) NOT NULL,
+                    password_hash VARCHAR(255) NOT NULL,
+                    parent_email VARCHAR(100),
+                    monthly_allowance DECIMAL(10,2) DEFAULT 0.00,
+                    allowance_day INT DEFAULT 1,  # Day of month for allowance
+                    allowance_start_date DATE,    # When allowance starts
+                    balance DECIMAL(10,2) DEFAULT 0.00,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (id, email),
+                    INDEX child_email_idx (email)
+                )
+            """,
+            'sqlite': """
+                CREATE TABLE IF NOT EXISTS children (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name VARCHAR(100) NOT NULL,
+                    email VARCHAR(100) NOT NULL,
+                    password_hash VARCHAR(255) NOT NULL,
+                    parent_email VARCHAR(100),
+                    monthly_allowance DECIMAL(10,2) DEFAULT 0.00,
+                    allowance_day INT DEFAULT 1,
+                    allowance_start_date DATE,
+                    balance DECIMAL(10,2) DEFAULT 0.00,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+        },
+        {'sqlite': "CREATE INDEX IF NOT EXISTS child_email_idx ON children (email)"},
+        {
+            'singlestore': """
+                CREATE TABLE IF NOT EXISTS earnings (
+                    id INT AUTO_INCREMENT,
+                    child_email VARCHAR(100) NOT NULL,
+                    amount DECIMAL(10,2) NOT NULL,
+                    description TEXT,
+                    type VARCHAR(20) NOT NULL,    # 'allowance' or 'extra'
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (id)
+                )
+            """,
+            'sqlite': """
+                CREATE TABLE IF NOT EXISTS earnings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    child_email VARCHAR(100) NOT NULL,
+                    amount DECIMAL(10,2) NOT NULL,
+                    description TEXT,
+                    type VARCHAR(20) NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """,
+        },
+    ]),
+    (2, "Track scheduled allowance run progress per shard", [
+        """
+        CREATE TABLE IF NOT EXISTS allowance_runs (
+            run_date DATE NOT NULL,
+            shards INT NOT NULL,
+            shard INT NOT NULL,
+            last_email VARCHAR(100) NOT NULL,
+            children_credited INT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (run_date, shards, shard)
+        )
+        """,
+    ]),
+    (3, "Index earnings for keyset pagination by child", [
+        create_index('earnings_child_created_idx', 'earnings', 'child_email, created_at, id'),
+    ]),
+    (4, "Add per-child balance snapshots over the earnings ledger", [
+        """
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            child_email VARCHAR(100) NOT NULL,
+            period_end TIMESTAMP NOT NULL,
+            balance DECIMAL(12,2) NOT NULL,
+            entries INT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (child_email, period_end)
+        )
+        """,
+    ]),
+    (5, "Add monthly earnings rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS earnings_monthly (
+            child_email VARCHAR(100) NOT NULL,
+            month DATE NOT NULL,
+            type VARCHAR(20) NOT NULL,
+            total DECIMAL(12,2) NOT NULL,
+            entries INT NOT NULL,
+            PRIMARY KEY (child_email, month, type)
+        )
+        """,
+        create_index('children_parent_email_idx', 'children', 'parent_email'),
+        # Existing ledger rows, rebuilt from scratch so a re-run doesn't
+        # count them twice; new ones are added as they are written
+        "DELETE FROM earnings_monthly",
+        {
+            'singlestore': """
+                INSERT INTO earnings_monthly (child_email, month, type, total, entries)
+                SELECT child_email, DATE(DATE_TRUNC('month', created_at)), type, SUM(amount), COUNT(*)
+                FROM earnings
+                GROUP BY child_email, DATE(DATE_TRUNC('month', created_at)), type
+            """,
+            'sqlite': """
+                INSERT INTO earnings_monthly (child_email, month, type, total, entries)
+                SELECT child_email, date(created_at, 'start of month'), type, SUM(amount), COUNT(*)
+                FROM earnings
+                GROUP BY child_email, date(created_at, 'start of month'), type
+            """,
+        },
+    ]),
+    (6, "Version parents and children for conditional GETs", [
+        add_column('parents', 'version', 'BIGINT NOT NULL DEFAULT 0'),
+        add_column('parents', 'updated_at', 'TIMESTAMP NULL'),
+        "UPDATE parents SET updated_at = created_at WHERE updated_at IS NULL",
+        add_column('children', 'version', 'BIGINT NOT NULL DEFAULT 0'),
+        add_column('children', 'updated_at', 'TIMESTAMP NULL'),
+        "UPDATE children SET updated_at = created_at WHERE updated_at IS NULL",
+    ]),
+    # Account emails were only kept unique by a SELECT before each INSERT,
+    # which two concurrent registrations can both pass. Accounts that
+    # already share an email stop the migration until they are resolved.
+    (7, "Enforce unique parent and child emails", [
+        refuse_duplicate_emails('parents'),
+        {
+            'singlestore': rebuild_unique_on_email('parents', """
+                id INT AUTO_INCREMENT,
+                name VARCHAR(100) NOT NULL,
+                email VARCHAR(100) NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                child_email VARCHAR(100),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                version BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP NULL,
+                PRIMARY KEY (email),
+                SHARD KEY (email),
+                KEY (id)
+            """, "id, name, email, password_hash, child_email, created_at, version, updated_at"),
+            'sqlite': "CREATE UNIQUE INDEX IF NOT EXISTS parents_email_key ON parents (email)",
+        },
+        refuse_duplicate_emails('children'),
+        {
+            'singlestore': rebuild_unique_on_email('children', """
+                id INT AUTO_INCREMENT,
+                name VARCHAR(100) NOT NULL,
+                email VARCHAR(100) NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                parent_email VARCHAR(100),
+                monthly_allowance DECIMAL(10,2) DEFAULT 0.00,
+                allowance_day INT DEFAULT 1,
+                allowance_start_date DATE,
+                balance DECIMAL(10,2) DEFAULT 0.00,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                version BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP NULL,
+                PRIMARY KEY (email),
+                SHARD KEY (email),
+                KEY (id),
+                KEY children_parent_email_idx (parent_email)
+            """, "id, name, email, password_hash, parent_email, monthly_allowance, allowance_day, "
+                 "allowance_start_date, balance, created_at, version, updated_at"),
+            'sqlite': "CREATE UNIQUE INDEX IF NOT EXISTS children_email_key ON children (email)",
+        },
+    ]),
+]
+
+SCHEMA_VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT NOT NULL,
+        description VARCHAR(255),
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (version)
+    )
+"""
+
+
+def statements_for(statements, dialect):
+    """Resolve a migration's statements for one dialect.
+
+    A statement is plain SQL shared by every dialect, a dict of SQL per
+    dialect (dialects missing from it skip that step) or a step function
+    called with (cursor, dialect).
+    """
+    resolved = []
+    for statement in statements:
+        if isinstance(statement, dict):
+            statement = statement.get(dialect)
+        if statement:
+            resolved.append(statement)
+    return resolved
+
+
+def applied_versions(cursor):
+    cursor.execute(SCHEMA_VERSION_TABLE)
+    cursor.execute("SELECT version FROM schema_version")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def pending_migrations(cursor):
+    applied = applied_versions(cursor)
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def migrate(database, target=None):
+    """Apply pending migrations up to ``target`` and return their versions"""
+    applied = []
+    with database.pool.connection() as conn:
+        cursor = conn.cursor()
+        for version, description, statements in pending_migrations(cursor):
+            if target is not None and version > target:
+                break
+            for statement in statements_for(statements, database.dialect):
+                if callable(statement):
+                    statement(cursor, database.dialect)
+                else:
+                    cursor.execute(statement)
+            cursor.execute("""
+                INSERT INTO schema_version (version, description)
+                VALUES (%s, %s)
+            """, (version, description))
+            conn.commit()
+            applied.append(version)
+    return applied
@@ -0,0 +1,184 @@
+"""Bulk registration of families from a CSV or NDJSON file.
+
+Each record registers one child and, on the first record naming them, their
+parent:
+
+    parent_name,parent_email,parent_password,child_name,child_email,child_password
+
+Later records with the same parent email add more children to that parent;
+their parent name and password are ignored. The file is handled in batches
+of ``batch_size`` records. A batch's passwords are bcrypt-hashed in parallel
+on a process pool, one process per core by default; uploads to the API
+share one pool per server process. The accounts are then
+inserted with ``Database.insert_accounts``, parents first, in multi-row
+statements. The unique keys on email reject accounts that already exist.
+
+Invalid records, emails already registered, and children whose parent
+could not be registered come back as (line_number, reason) in
+``rejected``; the rest of the file still loads.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from config import Config, available_cores
+from hashing import hash_password
+import transfer
+
+FIELDS = ('parent_name', 'parent_email', 'parent_password', 'child_name', 'child_email', 'child_password')
+
+# Longest name or email the account tables hold
+MAX_LENGTH = 100
+
+# Records hashed and inserted per round
+BATCH_SIZE = 2000
+
+# Passwords sent to a hashing process at a time
+HASH_CHUNK_SIZE = 16
+
+
+class InvalidFamily(ValueError):
+    """A record in a family file that cannot be registered"""
+
+
+def parse_family(record):
+    """Validate one record into a (parent_name, parent_email, parent_password,
+    child_name, child_email, child_password) tuple"""
+    if not isinstance(record, dict):
+        raise InvalidFamily("not a JSON object")
+    values = []
+    for field in FIELDS:
+        value = record.get(field)
+        value = '' if value is None else str(value)
+        if not field.endswith('_password'):
+            value = value.strip()
+        if not value:
+            raise InvalidFamily(f"{field} is required")
+        if field.endswith('_email') and '@' not in value:
+            raise InvalidFamily(f"invalid {field} {value!r}")
+        if not field.endswith('_password') and len(value) > MAX_LENGTH:
+            raise InvalidFamily(f"{field} is longer than {MAX_LENGTH} characters")
+        values.append(value)
+    if values[1] == values[4]:
+        raise InvalidFamily("parent_email and child_email must differ")
+    return tuple(values)
+
+
+def parse(lines, fmt, errors):
+    """Yield (line_number, family) for valid records; invalid ones go to ``errors``"""
+    for line_number, record in transfer.READERS[fmt](lines):
+        try:
+            yield line_number, parse_family(record)
+        except InvalidFamily as e:
+            errors.append((line_number, str(e)))
+
+
+def _batches(records, size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+def hash_passwords(executor, passwords, rounds):
+    """Hash ``passwords`` on the executor's processes, in order"""
+    return list(executor.map(hash_password, passwords, [rounds] * len(passwords), chunksize=HASH_CHUNK_SIZE))
+
+
+def create_executor(processes=None):
+    # Spawned, not forked: a server worker forking while other threads hold
+    # locks could leave the children stuck
+    processes = processes or Config.ONBOARDING_PROCESSES or available_cores()
+    return ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+
+
+_shared_executor = None
+_shared_lock = threading.Lock()
+
+
+def shared_executor():
+    """The process pool every upload to a server process hashes on, started on
+    first use, so requests don't each start one process per core"""
+    global _shared_executor
+    with _shared_lock:
+        if _shared_executor is None:
+            _shared_executor = create_executor()
+        return _shared_executor
+
+
+class _Registration:
+    def __init__(self, db, executor, rounds):
+        self.db = db
+        self.executor = executor
+        self.rounds = rounds
+        self.parents = {}  # parent_email -> registered?, for parents seen so far
+        self.children = set()
+        self.rejected = {}  # line_number -> reason; the first reason for a line wins
+        self.parent_count = 0
+        self.child_count = 0
+
+    def reject(self, ref, reason):
+        self.rejected.setdefault(ref, reason)
+
+    def register(self, batch):
+        parents, children = [], []
+        for ref, (parent_name, parent_email, parent_password, child_name, child_email, child_password) in batch:
+            if child_email in self.children or child_email in self.parents:
+                self.reject(ref, f"{child_email} appears earlier in the file")
+                continue
+            self.children.add(child_email)
+            if parent_email not in self.parents:
+                self.parents[parent_email] = None
+                parents.append((ref, parent_name, parent_email, parent_password, child_email))
+            children.append((ref, child_name, child_email, child_password, parent_email))
+
+        hashes = hash_passwords(self.executor, [account[3] for account in parents + children], self.rounds)
+        parents = [account[:3] + (password_hash, account[4])
+                   for account, password_hash in zip(parents, hashes)]
+        children = [account[:3] + (password_hash, account[4])
+                    for account, password_hash in zip(children, hashes[len(parents):])]
+
+        inserted, rejected = self.db.insert_accounts('parent', parents)
+        for ref, reason in rejected:
+            self.reject(ref, reason)
+        for account in parents:
+            self.parents[account[2]] = account[2] in inserted
+        self.parent_count += len(inserted)
+
+        registrable = []
+        for account in children:
+            if self.parents[account[4]]:
+                registrable.append(account)
+            else:
+                self.reject(account[0], f"parent {account[4]} is not registered")
+        inserted, rejected = self.db.insert_accounts('child', registrable)
+        for ref, reason in rejected:
+            self.reject(ref, reason)
+        self.child_count += len(inserted)
+
+
+def load(db, lines, fmt, processes=None, batch_size=BATCH_SIZE, executor=None):
+    """Register the families in a CSV or NDJSON file's lines.
+
+    Returns {'parents': registered, 'children': registered,
+    'rejected': [(line_number, reason)]}.
+    """
+    errors = []
+    own_executor = executor is None
+    if own_executor:
+        executor = create_executor(processes)
+    try:
+        registration = _Registration(db, executor, Config.BCRYPT_ROUNDS)
+        for batch in _batches(parse(lines, fmt, errors), batch_size):
+            registration.register(batch)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    return {
+        'parents': registration.parent_count,
+        'children': registration.child_count,
+        'rejected': sorted(errors + list(registration.rejected.items())),
+    }
@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out before the timeout"""
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of DB-API connections.
+
+    Connections are opened lazily through ``connect`` and handed out one per
+    caller. Idle connections are health-checked before reuse and replaced
+    when the check fails, so a dropped connection is reconnected transparently.
+
+    A pool used from a forked child process starts over with connections of
+    its own (see ``after_fork``); sockets inherited from the parent are never
+    used by two processes.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=5.0,
+                 health_check_interval=30.0, on_checkout=None):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: min_size=%s max_size=%s" % (min_size, max_size))
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.on_checkout = on_checkout  # Called with the seconds each checkout waited
+
+        self._cond = threading.Condition()
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._size = 0
+        self._opened = False
+        self._closed = False
+        self._pid = os.getpid()
+
+        self._checkouts = 0
+        self._checkout_failures = 0
+        self._reconnects = 0
+        self._waiting = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+
+    def after_fork(self):
+        """Forget the connections inherited from the parent process.
+
+        They are dropped without being closed: closing would shut down the
+        parent's sockets too. New connections are opened on next checkout.
+        """
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._opened = False
+        self._closed = False
+        self._waiting = 0
+        self._pid = os.getpid()
+
+    def _open(self):
+        """Warm the pool up to ``min_size`` on first use"""
+        self._opened = True
+        while self._size < self.min_size:
+            self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                self._size -= 1
+                raise
+            self._idle.append((conn, time.monotonic()))
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def checkout(self, timeout=None):
+        """Take a connection from the pool, opening one if there is room"""
+        timeout = self.timeout if timeout is None else timeout
+        if self._pid != os.getpid():
+            self.after_fork()
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._cond:
+            try:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if not self._opened:
+                    self._open()
+
+                self._waiting += 1
+                try:
+                    while not self._idle and self._size >= self.max_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise PoolTimeout(
+                                "Timed out after %.2fs waiting for a database connection" % timeout)
+                        self._cond.wait(remaining)
+                        if self._closed:
+                            raise PoolTimeout("Connection pool is closed")
+                finally:
+                    self._waiting -= 1
+
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    conn, last_used = None, None
+                    self._size += 1
+            except Exception:
+                self._checkout_failures += 1
+                raise
+
+        # Connect and health-check outside the lock so other threads keep going
+        try:
+            if conn is not None and time.monotonic() - last_used >= self.health_check_interval:
+                if not self._is_healthy(conn):
+                    self._close_quietly(conn)
+                    conn = None
+                    with self._cond:
+                        self._reconnects += 1
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._checkout_failures += 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_time_total += waited
+            self._wait_time_max = max(self._wait_time_max, waited)
+        if self.on_checkout:
+            self.on_checkout(waited)
+        return conn
+
+    def checkin(self, conn, discard=False):
+        """Return a connection, rolling back anything left uncommitted.
+
+        A connection that cannot be rolled back is assumed broken and is
+        closed; the next checkout opens a fresh one in its place.
+        """
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+                if discard:
+                    self._reconnects += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+
+        if conn is not None:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Check out a connection for the duration of a ``with`` block"""
+        conn = self.checkout(timeout)
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def close(self):
+        """Close idle connections and refuse new checkouts"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'max_size': self.max_size,
+                'in_use': self._size - len(self._idle),
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'checkout_failures': self._checkout_failures,
+                'reconnects': self._reconnects,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_max': self._wait_time_max,
+            }
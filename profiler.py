@@ -0,0 +1,79 @@
+"""On-demand sampling profiler for a single request.
+
+When PROFILER_ENABLED is set, a request carrying ``X-Profile: <PROFILER_TOKEN>``
+is sampled: a background thread records the request thread's stack every
+PROFILER_INTERVAL seconds. The samples are written in the folded-stack format
+used by flamegraph tools, one ``frame;frame;frame count`` line per stack, to
+PROFILER_DIR. The file name is returned in the ``X-Profile-File`` header.
+Requests without the header pay nothing beyond one header lookup.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class Sampler:
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common()) + '\n'
+
+
+def start_if_requested():
+    from flask import g, request
+
+    if not Config.PROFILER_ENABLED or not Config.PROFILER_TOKEN:
+        return
+    if request.headers.get('X-Profile') != Config.PROFILER_TOKEN:
+        return
+    sampler = Sampler(threading.get_ident(), Config.PROFILER_INTERVAL)
+    sampler.start()
+    g.profiler = sampler
+
+
+def finish(response):
+    from flask import g, request
+
+    sampler = g.pop('profiler', None)
+    if sampler is None:
+        return response
+    sampler.stop()
+    os.makedirs(Config.PROFILER_DIR, exist_ok=True)
+    endpoint = (request.endpoint or 'unmatched').replace('.', '-')
+    path = os.path.join(Config.PROFILER_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{os.getpid()}.folded")
+    with open(path, 'w') as f:
+        f.write(sampler.folded())
+    logger.info("Wrote profile of %s (%d samples) to %s", request.path, sum(sampler.samples.values()), path)
+    response.headers['X-Profile-File'] = os.path.basename(path)
+    return response
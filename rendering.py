@@ -0,0 +1,63 @@
+"""Template rendering: shared bytecode cache and cached page fragments.
+
+Compiled templates are kept in ``TEMPLATE_CACHE_DIR``, which every worker
+on a host shares. A cold worker loads a template's bytecode instead of
+compiling it. ``flask compile-templates`` fills the cache ahead of time;
+the Docker image runs it at build. Bytecode is keyed by the template
+source's checksum, so an edited template is recompiled and never served
+stale.
+
+``fragment`` renders a partial template once per key and serves the HTML
+from the cache after that. Callers put the data's version in the key (e.g.
+a child's ledger version) and build the context inside the
+``Database.versioned()`` block that read it. The version and the data then
+come from the primary, in that order, and cached reads are keyed by the
+version, so a write made in between only stores newer content under an
+older key. A fragment is never older than its key, and any change to the
+data moves pages to a new key. The context is built lazily, so a hit also skips the queries behind
+it. Hits and misses are counted in
+``template_fragment_cache_total``; renders are timed like any other
+template.
+"""
+import os
+
+from flask import current_app, render_template
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from cache import create_cache
+from config import Config
+from metrics import FRAGMENT_CACHE
+
+
+def fragment(template, key, load_context):
+    """Render ``template`` with ``load_context()``, cached under ``key``"""
+    cache = current_app.extensions['fragments']
+    if cache is None:
+        return Markup(render_template(template, **load_context()))
+
+    rendered = []
+
+    def render():
+        rendered.append(True)
+        return render_template(template, **load_context())
+
+    html = cache.get_or_load(('fragment', template, Config.RELEASE) + tuple(key), (), render)
+    FRAGMENT_CACHE.inc(template, 'miss' if rendered else 'hit')
+    return Markup(html)
+
+
+def compile_templates(app):
+    """Compile every template into the bytecode cache; returns their names"""
+    names = app.jinja_env.list_templates(extensions=('html',))
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+def init_app(app):
+    """Set up the bytecode and fragment caches; call before anything touches ``app.jinja_env``"""
+    if Config.TEMPLATE_CACHE_DIR:
+        os.makedirs(Config.TEMPLATE_CACHE_DIR, exist_ok=True)
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(Config.TEMPLATE_CACHE_DIR))
+    app.extensions['fragments'] = create_cache(Config.FRAGMENT_CACHE_TTL) if Config.FRAGMENT_CACHE_ENABLED else None
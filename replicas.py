@@ -0,0 +1,159 @@
+"""Read replicas behind Database.
+
+Read methods check out connections through ``ReplicaSet.connection``. It
+sends each read to the healthy replica with the fewest connections in use,
+taking turns on ties. A replica that fails to hand out a working
+connection, or raises a connection-level error mid-query, is marked down
+for ``retry_after`` seconds and skipped. When every replica is down, reads
+fall back to the primary.
+
+Replication is asynchronous, so a request that just wrote could read an
+older copy from a replica. After every write, Database calls
+``stick_to_primary``. For the next ``window`` seconds, reads in the same
+context, and in the same browser session via ``init_app``, go to the
+primary and bypass the read cache.
+"""
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import session
+
+from pool import PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+# Wall-clock time until which this context reads from the primary
+_primary_until = ContextVar('primary_until', default=0.0)
+
+
+def stick_to_primary(window):
+    _primary_until.set(max(_primary_until.get(), time.time() + window))
+
+
+def reads_from_primary():
+    return time.time() < _primary_until.get()
+
+
+def is_connection_error(error):
+    """Errors that say the server is unreachable rather than the query is wrong"""
+    return isinstance(error, (PoolTimeout, ConnectionError, TimeoutError)) or \
+        type(error).__name__ in ('OperationalError', 'InterfaceError')
+
+
+class Replica:
+    def __init__(self, backend, pool):
+        self.name = backend.describe()
+        self.backend = backend
+        self.pool = pool
+        self.down_until = 0.0
+        self.failures = 0
+
+    def healthy(self, now):
+        return now >= self.down_until
+
+
+class ReplicaSet:
+    def __init__(self, replicas, retry_after=10.0, checkout_timeout=1.0):
+        self.replicas = list(replicas)
+        self.retry_after = retry_after
+        self.checkout_timeout = checkout_timeout
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self.fallbacks = 0
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def _mark_down(self, replica, error):
+        with self._lock:
+            replica.down_until = time.monotonic() + self.retry_after
+            replica.failures += 1
+        logger.warning("Replica %s marked down for %.0fs: %s", replica.name, self.retry_after, error)
+
+    def candidates(self):
+        """Healthy replicas, least busy first, rotating between equals"""
+        now = time.monotonic()
+        healthy = [replica for replica in self.replicas if replica.healthy(now)]
+        if not healthy:
+            return []
+        start = next(self._turn) % len(healthy)
+        rotated = healthy[start:] + healthy[:start]
+        return sorted(rotated, key=lambda replica: replica.pool.stats()['in_use'])
+
+    @contextmanager
+    def connection(self, primary):
+        """Check out a replica connection, or one from ``primary`` if none is usable"""
+        for replica in self.candidates():
+            try:
+                conn = replica.pool.checkout(self.checkout_timeout)
+            except Exception as e:
+                self._mark_down(replica, e)
+                continue
+            discard = False
+            try:
+                yield conn
+            except Exception as e:
+                if is_connection_error(e):
+                    discard = True
+                    self._mark_down(replica, e)
+                raise
+            finally:
+                replica.pool.checkin(conn, discard=discard)
+            return
+
+        with self._lock:
+            self.fallbacks += 1
+        with primary.connection() as conn:
+            yield conn
+
+    def connect_streaming(self, primary):
+        """Open an unpooled streaming connection on a replica, else on ``primary``"""
+        for replica in self.candidates():
+            try:
+                return replica.backend.connect(streaming=True)
+            except Exception as e:
+                self._mark_down(replica, e)
+        with self._lock:
+            self.fallbacks += 1
+        return primary.connect(streaming=True)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        for replica in self.replicas:
+            replica.pool.after_fork()
+
+    def close(self):
+        for replica in self.replicas:
+            replica.pool.close()
+
+    def stats(self):
+        """Per-replica counters, plus reads that fell back to the primary"""
+        now = time.monotonic()
+        stats = {'primary': {'fallbacks': self.fallbacks}}
+        for replica in self.replicas:
+            pool = replica.pool.stats()
+            stats[replica.name] = {
+                'healthy': int(replica.healthy(now)),
+                'failures': replica.failures,
+                'in_use': pool['in_use'],
+                'checkouts': pool['checkouts'],
+            }
+        return stats
+
+
+def init_app(app):
+    """Carry read-your-writes stickiness across a browser session's requests"""
+    @app.before_request
+    def restore_stickiness():
+        _primary_until.set(session.get('primary_until', 0.0))
+
+    @app.after_request
+    def save_stickiness(response):
+        until = _primary_until.get()
+        if until > session.get('primary_until', 0.0) and until > time.time():
+            session['primary_until'] = until
+        return response
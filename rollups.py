@@ -0,0 +1,126 @@
+"""Monthly earnings totals per child and type.
+
+``earnings_monthly`` holds one row per (child_email, month, type) with the
+sum and count of that child's earnings in the month. Every append to the
+ledger adds its rows' totals in the same transaction (see
+``Database._insert_earnings``), so the rollup never drifts from the ledger
+it summarises. ``rebuild`` recomputes it from ``earnings`` in bulk, e.g.
+after a backfill or to repair it (``flask rebuild-rollups``).
+
+A parent's twelve-month summary reads at most 24 rows per child through the
+primary key, however long the ledger is.
+"""
+from datetime import date
+from decimal import Decimal
+
+# Add to a month's totals, creating the row the first time it is seen
+UPSERT = {
+    'singlestore': """
+        INSERT INTO earnings_monthly (child_email, month, type, total, entries) VALUES {values}
+        ON DUPLICATE KEY UPDATE total = total + VALUES(total), entries = entries + VALUES(entries)
+    """,
+    'sqlite': """
+        INSERT INTO earnings_monthly (child_email, month, type, total, entries) VALUES {values}
+        ON CONFLICT (child_email, month, type)
+        DO UPDATE SET total = total + excluded.total, entries = entries + excluded.entries
+    """,
+}
+
+# First day of the month a ledger row was created in
+MONTH_OF = {
+    'singlestore': "DATE(DATE_TRUNC('month', created_at))",
+    'sqlite': "date(created_at, 'start of month')",
+}
+
+# Children per statement when working in bulk
+CHUNK_SIZE = 500
+
+
+def month_of(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(day, count):
+    """First day of the month ``count`` months after ``day``'s"""
+    index = day.year * 12 + day.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_back(today, months):
+    """First day of a ``months``-month window ending with ``today``'s month"""
+    return add_months(today, 1 - months)
+
+
+def totals(rows):
+    """{(child_email, month, type): [total, entries]} for (child_email, amount, description, type, created_at) rows"""
+    grouped = {}
+    for child_email, amount, _, entry_type, created_at in rows:
+        key = (child_email, month_of(created_at), entry_type)
+        bucket = grouped.setdefault(key, [Decimal('0.00'), 0])
+        bucket[0] += Decimal(amount)
+        bucket[1] += 1
+    return grouped
+
+
+def after_append(cursor, rows, dialect):
+    """Add freshly inserted ledger rows to their months' totals"""
+    grouped = list(totals(rows).items())
+    for i in range(0, len(grouped), CHUNK_SIZE):
+        batch = grouped[i:i + CHUNK_SIZE]
+        cursor.execute(
+            UPSERT[dialect].format(values=", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))),
+            [value for key, (total, entries) in batch for value in key + (total, entries)]
+        )
+
+
+def rebuild(cursor, dialect, child_emails=None):
+    """Recompute the rollup from ``earnings``; for every child if none are given"""
+    if child_emails is None:
+        cursor.execute("DELETE FROM earnings_monthly")
+        cursor.execute(f"""
+            INSERT INTO earnings_monthly (child_email, month, type, total, entries)
+            SELECT child_email, {MONTH_OF[dialect]}, type, SUM(amount), COUNT(*)
+            FROM earnings
+            GROUP BY child_email, {MONTH_OF[dialect]}, type
+        """)
+        return cursor.rowcount
+    rebuilt = 0
+    child_emails = list(child_emails)
+    for i in range(0, len(child_emails), CHUNK_SIZE):
+        chunk = child_emails[i:i + CHUNK_SIZE]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(f"DELETE FROM earnings_monthly WHERE child_email IN ({placeholders})", chunk)
+        cursor.execute(f"""
+            INSERT INTO earnings_monthly (child_email, month, type, total, entries)
+            SELECT child_email, {MONTH_OF[dialect]}, type, SUM(amount), COUNT(*)
+            FROM earnings
+            WHERE child_email IN ({placeholders})
+            GROUP BY child_email, {MONTH_OF[dialect]}, type
+        """, chunk)
+        rebuilt += cursor.rowcount
+    return rebuilt
+
+
+def summarize(rows, today, months=12):
+    """Shape get_monthly_summary rows for the dashboard and JSON endpoint.
+
+    Every child gets a slot for each month in the window, keyed 'YYYY-MM',
+    holding {type: {'total', 'entries'}} for the types earned that month,
+    plus per-type totals over the whole window.
+    """
+    start = months_back(today, months)
+    labels = [add_months(start, i).strftime('%Y-%m') for i in range(months)]
+    children = {}
+    for email, name, month, entry_type, total, entries in rows:
+        child = children.setdefault(email, {
+            'email': email,
+            'name': name,
+            'months': {label: {} for label in labels},
+            'totals': {},
+        })
+        slot = child['months'].get(month.strftime('%Y-%m')) if month is not None else None
+        if slot is None:
+            continue  # A child with nothing earned in the window, or a row outside it
+        slot[entry_type] = {'total': Decimal(total), 'entries': entries}
+        child['totals'][entry_type] = child['totals'].get(entry_type, Decimal('0.00')) + Decimal(total)
+    return {'months': labels, 'children': list(children.values())}
@@ -0,0 +1,130 @@
+"""Fleet-wide scheduled allowance run.
+
+Finds every child with an allowance due in one set-based query, splits them
+into shards by email hash and credits each shard on its own worker thread in
+batched transactions. After every batch the shard's progress is checkpointed
+in ``allowance_runs`` in the same transaction, so a crashed run picks up where
+it stopped. Crediting is idempotent on its own (see
+``Database._credit_allowances``), so nothing is paid twice even if a
+checkpoint is lost.
+
+Run it daily, e.g. from cron: ``flask run-allowances --workers 8``.
+"""
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import allowances
+
+
+def find_due_children(db, run_date):
+    """Emails of children with at least one unpaid allowance up to ``run_date``"""
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT c.email, c.allowance_day, c.allowance_start_date, paid.last_payment
+            FROM children c
+            LEFT JOIN (
+                SELECT child_email, MAX(created_at) AS last_payment
+                FROM earnings
+                WHERE type = 'allowance'
+                GROUP BY child_email
+            ) paid ON paid.child_email = c.email
+            WHERE c.allowance_start_date IS NOT NULL
+              AND c.allowance_start_date <= %s
+        """, (run_date,))
+        rows = cursor.fetchall()
+
+    return [
+        email for email, allowance_day, start_date, last_payment in rows
+        if allowances.due_dates(start_date, allowance_day or 1, run_date, last_payment)
+    ]
+
+
+def shard_of(email, shards):
+    return zlib.crc32(email.encode('utf-8')) % shards
+
+
+def load_checkpoints(db, run_date, shards):
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT shard, last_email
+            FROM allowance_runs
+            WHERE run_date = %s AND shards = %s
+        """, (run_date, shards))
+        return dict(cursor.fetchall())
+
+
+def _save_checkpoint(cursor, run_date, shards, shard, last_email, credited):
+    cursor.execute("""
+        UPDATE allowance_runs
+        SET last_email = %s,
+            children_credited = children_credited + %s,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE run_date = %s AND shards = %s AND shard = %s
+    """, (last_email, credited, run_date, shards, shard))
+    if cursor.rowcount == 0:
+        cursor.execute("""
+            INSERT INTO allowance_runs (run_date, shards, shard, last_email, children_credited)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (run_date, shards, shard, last_email, credited))
+
+
+def credit_shard(db, run_date, shards, shard, emails, batch_size):
+    """Credit one shard's children in batches; returns (children, payments)"""
+    children = payments = 0
+    for i in range(0, len(emails), batch_size):
+        batch = emails[i:i + batch_size]
+        with db.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                outbox = db.outbox()
+                credited = db._credit_allowances(cursor, batch, run_date, outbox)
+                _save_checkpoint(cursor, run_date, shards, shard, batch[-1], len(credited))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        db.invalidate(children=credited)
+        db.publish(outbox)
+        children += len(credited)
+        payments += sum(credited.values())
+    return children, payments
+
+
+def run_allowances(db, run_date=None, workers=4, batch_size=500):
+    """Credit every due allowance up to ``run_date`` and report throughput"""
+    run_date = run_date or date.today()
+    started = time.monotonic()
+
+    due = find_due_children(db, run_date)
+    checkpoints = load_checkpoints(db, run_date, workers)
+    shards = [[] for _ in range(workers)]
+    skipped = 0
+    for email in sorted(due):
+        shard = shard_of(email, workers)
+        if shard in checkpoints and email <= checkpoints[shard]:
+            skipped += 1
+            continue
+        shards[shard].append(email)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(credit_shard, db, run_date, workers, shard, emails, batch_size)
+            for shard, emails in enumerate(shards) if emails
+        ]
+        results = [future.result() for future in futures]
+
+    elapsed = time.monotonic() - started
+    children = sum(r[0] for r in results)
+    return {
+        'run_date': run_date.isoformat(),
+        'due': len(due),
+        'skipped': skipped,
+        'children_credited': children,
+        'payments': sum(r[1] for r in results),
+        'elapsed': elapsed,
+        'children_per_second': children / elapsed if elapsed else 0.0,
+    }
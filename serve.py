@@ -0,0 +1,87 @@
+"""Production server: pre-forked gunicorn workers running the Flask app.
+
+    python serve.py            # or: flask --app app serve
+
+The app is imported once in the master and forked into SERVE_WORKERS
+processes (default: one per available core), each serving SERVE_THREADS
+requests concurrently. Each worker sets its Database up again after the
+fork, so no connection or background thread is shared between processes.
+
+A worker is recycled after SERVE_MAX_REQUESTS requests, with jitter so
+workers don't restart together. On SIGTERM the worker fails its readiness
+check, stops accepting, and finishes in-flight requests for up to
+SERVE_GRACEFUL_TIMEOUT seconds. It then flushes queued writes and closes
+its connections.
+"""
+import signal
+
+from config import Config, available_cores, server_workers
+import health
+
+
+def options():
+    return {
+        'bind': Config.SERVE_BIND,
+        'workers': server_workers(),
+        'threads': Config.SERVE_THREADS,
+        'worker_class': 'gthread',
+        'max_requests': Config.SERVE_MAX_REQUESTS,
+        'max_requests_jitter': Config.SERVE_MAX_REQUESTS_JITTER,
+        'timeout': Config.SERVE_TIMEOUT,
+        'graceful_timeout': Config.SERVE_GRACEFUL_TIMEOUT,
+        'keepalive': Config.SERVE_KEEPALIVE,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'post_worker_init': post_worker_init,
+        'worker_exit': worker_exit,
+        'accesslog': '-' if Config.SERVE_ACCESS_LOG else None,
+    }
+
+
+def post_fork(server, worker):
+    # The app, and so its Database, was built in the master before forking
+    from app import db
+    db.after_fork()
+    health.after_fork()
+
+
+def post_worker_init(worker):
+    # Fail readiness as soon as the worker is told to stop, then let
+    # gunicorn's own handler start the graceful shutdown
+    handle_exit = signal.getsignal(signal.SIGTERM)
+
+    def drain(signum, frame):
+        health.mark_draining()
+        if callable(handle_exit):
+            handle_exit(signum, frame)
+
+    signal.signal(signal.SIGTERM, drain)
+
+
+def worker_exit(server, worker):
+    from app import db
+    db.close()  # Flushes the write-behind queue before closing connections
+
+
+def run(app=None):
+    if app is None:
+        from app import app
+    if app.config.get('EVENT_STREAMS'):
+        # Each open page would hold one of a worker's few threads
+        raise RuntimeError("Live update streams need the ASGI server (python asgi.py)")
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options().items():
+                if value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,106 @@
+"""Single-flight coalescing of identical concurrent reads.
+
+When several requests ask for the same thing at the same moment, such as
+every device in a family opening a child's page on allowance day, only the
+first call (the leader) runs the query. The others wait for it and get the
+same result, or the same exception. A waiter gives up after ``timeout``
+seconds and runs the query itself, so one slow query can't hold callers
+indefinitely.
+
+Calls are keyed by method name and arguments, like the read cache. The
+cache removes repeated reads over time; this removes duplicate reads that
+happen at the same moment, including on a cache miss.
+"""
+import threading
+from functools import wraps
+
+from config import Config
+
+
+class _Call:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, timeout=2.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key, load):
+        """Return ``load()``, sharing one call among concurrent callers with the same key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+
+        if not leader:
+            if call.done.wait(self.timeout):
+                with self._lock:
+                    self.coalesced += 1
+                if call.error is not None:
+                    raise call.error
+                return call.value
+            with self._lock:
+                self.timeouts += 1
+                self.executed += 1
+            return load()
+
+        try:
+            call.value = load()
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def after_fork(self):
+        # A leader in the parent process will never finish here
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+                'in_flight': len(self._calls),
+            }
+
+
+def create_single_flight():
+    """Build the coalescer configured in Config, or None if it is off"""
+    if not Config.SINGLE_FLIGHT_ENABLED:
+        return None
+    return SingleFlight(Config.SINGLE_FLIGHT_TIMEOUT)
+
+
+def coalesced(method):
+    """Coalesce concurrent identical calls of a Database read method through ``self.single_flight``.
+
+    Reads pinned to the primary after a write don't join a call that may
+    have started before it. Under ``@cached``, misses are coalesced on the
+    cache key instead (see cache.Cache.get_or_load), through ``uncoalesced``.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.single_flight or self.reads_pinned():
+            return method(self, *args, **kwargs)
+        key = (method.__name__, self.read_version()) + args + tuple(sorted(kwargs.items()))
+        return self.single_flight.do(key, lambda: method(self, *args, **kwargs))
+    wrapper.uncoalesced = method
+    return wrapper
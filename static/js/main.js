@@ -48,6 +48,110 @@ function hideEarningsModal() {
     document.getElementById('earningsModal').style.display = 'none';
 }
 
+// Load older earnings in place instead of navigating to the next page
+document.addEventListener('click', function(e) {
+    const link = e.target.closest('.load-more');
+    if (!link) {
+        return;
+    }
+    e.preventDefault();
+    link.classList.add('loading');
+    fetch(link.href)
+        .then(response => response.text())
+        .then(html => {
+            const page = new DOMParser().parseFromString(html, 'text/html');
+            const list = document.querySelector('.earnings-list');
+            page.querySelectorAll('.earnings-list .earning-item').forEach(item => list.appendChild(item));
+            const next = page.querySelector('.load-more');
+            if (next) {
+                link.replaceWith(next);
+            } else {
+                link.remove();
+            }
+        })
+        .catch(() => {
+            window.location.href = link.href;
+        });
+});
+
+// Live balance and earnings updates pushed by the server (see events.py)
+function formatAmount(value) {
+    return '$' + Number(value).toFixed(2);
+}
+
+function earningItem(earning) {
+    const item = document.createElement('div');
+    item.className = 'earning-item';
+    const info = document.createElement('div');
+    info.className = 'earning-info';
+    const amount = document.createElement('p');
+    amount.className = 'amount';
+    amount.textContent = formatAmount(earning.amount);
+    const description = document.createElement('p');
+    description.className = 'description';
+    description.textContent = earning.description;
+    const type = document.createElement('span');
+    type.className = 'earning-type ' + earning.type;
+    type.textContent = earning.type.charAt(0).toUpperCase() + earning.type.slice(1);
+    info.append(amount, description, type);
+    const date = document.createElement('p');
+    date.className = 'date';
+    date.textContent = String(earning.created_at).slice(0, 16);
+    item.append(info, date);
+    return item;
+}
+
+function followEvents(container, url) {
+    const source = new EventSource(url);
+    source.addEventListener('balance', e => {
+        const balance = container.querySelector('[data-balance]');
+        if (balance) {
+            balance.textContent = formatAmount(JSON.parse(e.data).balance);
+        }
+    });
+    source.addEventListener('allowance', e => {
+        const allowance = container.querySelector('[data-monthly-allowance]');
+        if (allowance) {
+            allowance.textContent = formatAmount(JSON.parse(e.data).monthly_allowance);
+        }
+    });
+    source.addEventListener('earning', e => {
+        // Older pages only show older entries
+        if (!container.hasAttribute('data-newest-page')) {
+            return;
+        }
+        let list = container.querySelector('.earnings-list');
+        if (!list) {
+            list = document.createElement('div');
+            list.className = 'earnings-list';
+            const empty = container.querySelector('.no-earnings');
+            empty.replaceWith(list);
+        }
+        list.prepend(earningItem(JSON.parse(e.data)));
+    });
+    source.addEventListener('reset', () => {
+        // Updates were missed; take a fresh copy of the page and follow on from it
+        source.close();
+        fetch(window.location.href, {cache: 'no-store'})
+            .then(response => response.text())
+            .then(html => {
+                const page = new DOMParser().parseFromString(html, 'text/html');
+                const fresh = page.querySelector('[data-events]');
+                container.replaceWith(fresh);
+                followEvents(fresh, fresh.dataset.events);
+            })
+            .catch(() => window.location.reload());
+    });
+    return source;
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const container = document.querySelector('[data-events]');
+    if (container && window.EventSource) {
+        followEvents(container, container.dataset.events);
+    }
+});
+
 // Close modals when clicking outside
 window.onclick = function(event) {
     if (event.target.className === 'modal') {
@@ -0,0 +1,13 @@
+import os
+import tempfile
+
+# Run the suite against the embedded SQLite backend so it needs no network
+# database; this must happen before the app and its Config are imported.
+os.environ.setdefault('DB_BACKEND', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', os.path.join(tempfile.mkdtemp(prefix='game-tests-'), 'game.db'))
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+os.environ.setdefault('TEMPLATE_CACHE_DIR', tempfile.mkdtemp(prefix='game-templates-'))
+# The suite runs in one process, so live updates and the read cache need
+# nothing shared between workers
+os.environ.setdefault('EVENTS_BROKER', 'memory')
+os.environ.setdefault('CACHE_BACKEND', 'memory')
@@ -0,0 +1,25 @@
+from datetime import date, datetime
+from allowances import due_date, due_dates
+
+def test_due_date_clamps_to_month_end():
+    assert due_date(2023, 2, 31) == date(2023, 2, 28)
+    assert due_date(2024, 2, 30) == date(2024, 2, 29)
+    assert due_date(2023, 4, 31) == date(2023, 4, 30)
+    assert due_date(2023, 5, 31) == date(2023, 5, 31)
+
+def test_due_dates_from_start_date():
+    dates = due_dates(date(2023, 1, 15), 31, date(2023, 4, 30))
+    assert dates == [date(2023, 1, 31), date(2023, 2, 28), date(2023, 3, 31), date(2023, 4, 30)]
+
+def test_due_dates_skip_days_before_start():
+    assert due_dates('2023-01-15', 1, date(2023, 3, 1)) == [date(2023, 2, 1), date(2023, 3, 1)]
+
+def test_due_dates_skip_paid_months():
+    paid = datetime(2023, 2, 1)
+    assert due_dates(date(2023, 1, 1), 1, date(2023, 4, 15), paid) == [date(2023, 3, 1), date(2023, 4, 1)]
+    assert due_dates(date(2023, 1, 1), 1, date(2023, 4, 15), datetime(2023, 4, 1)) == []
+
+def test_due_dates_spanning_years():
+    dates = due_dates(date(2019, 1, 1), 1, date(2023, 12, 31))
+    assert len(dates) == 60
+    assert dates[-1] == date(2023, 12, 1)
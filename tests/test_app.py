@@ -2,21 +2,25 @@ import pytest
 from flask import Flask, session
 from app import app, db
 from database import Database
+import migrations
+
+@pytest.fixture(autouse=True)
+def fresh_schema():
+    # Database() no longer touches the schema, so reset it for every test
+    db.drop_tables()
+    db.create_tables()
 
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
     app.config['WTF_CSRF_ENABLED'] = False
     with app.test_client() as client:
-        with app.app_context():
-            db.drop_tables()
-            db.create_tables()
         yield client
 
 def test_landing(client):
     response = client.get('/')
     assert response.status_code == 302
-    assert response.location == 'http://localhost/login'
+    assert response.location == '/login'
 
 def test_login(client):
     response = client.post('/login', data=dict(email='parent@example.com', password='password'))
@@ -24,7 +28,7 @@ def test_login(client):
     assert b'Invalid credentials' in response.data
 
 def test_register_parent(client):
-    response = client.post('/register/parent', data=dict(
+    response = client.post('/register/parent', follow_redirects=True, data=dict(
         name='Parent',
         email='parent@example.com',
         password='password',
@@ -34,7 +38,7 @@ def test_register_parent(client):
     assert b'Registration successful! Please login.' in response.data
 
 def test_register_child(client):
-    response = client.post('/register/child', data=dict(
+    response = client.post('/register/child', follow_redirects=True, data=dict(
         name='Child',
         email='child@example.com',
         password='password',
@@ -64,15 +68,16 @@ def test_logout(client):
         sess['user_email'] = 'parent@example.com'
     response = client.get('/logout')
     assert response.status_code == 302
-    assert response.location == 'http://localhost/login'
+    assert response.location == '/login'
 
 def test_child_details(client):
     with client.session_transaction() as sess:
         sess['user_email'] = 'parent@example.com'
         sess['user_type'] = 'parent'
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
     response = client.get('/child/child@example.com')
     assert response.status_code == 200
-    assert b'Child Details' in response.data
+    assert b"Child's Details" in response.data
 
 def test_update_allowance(client):
     with client.session_transaction() as sess:
@@ -84,7 +89,7 @@ def test_update_allowance(client):
         start_date='2023-01-01'
     ))
     assert response.status_code == 302
-    assert response.location == 'http://localhost/child/child@example.com'
+    assert response.location == '/child/child@example.com'
 
 def test_add_earnings(client):
     with client.session_transaction() as sess:
@@ -95,7 +100,7 @@ def test_add_earnings(client):
         description='Test earnings'
     ))
     assert response.status_code == 302
-    assert response.location == 'http://localhost/child/child@example.com'
+    assert response.location == '/child/child@example.com'
 
 def test_create_parent():
     db = Database()
@@ -150,3 +155,172 @@ def test_get_earnings_history():
     db.add_earnings('child@example.com', 50, 'Test earnings')
     result = db.get_earnings_history('child@example.com')
     assert len(result) == 1
+
+def test_migrate_is_idempotent():
+    assert db.create_tables() == []
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        assert migrations.pending_migrations(cursor) == []
+
+def test_interrupted_migrations_can_be_reapplied():
+    # As if 3, 5, 6 and 7 had stopped after some of their statements ran
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM schema_version WHERE version IN (3, 5, 6, 7)")
+        cursor.execute("DROP INDEX children_email_key")
+        conn.commit()
+    assert db.create_tables() == [3, 5, 6, 7]
+
+def test_duplicate_emails_stop_the_unique_key_migration():
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM schema_version WHERE version = 7")
+        cursor.execute("DROP INDEX parents_email_key")
+        for name in ('First', 'Second'):
+            cursor.execute("INSERT INTO parents (name, email, password_hash) VALUES (%s, 'twice@example.com', 'x')",
+                           (name,))
+        conn.commit()
+    with pytest.raises(migrations.MigrationError, match='twice@example.com'):
+        db.create_tables()
+    # Nothing was deleted to make way for the key
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM parents WHERE email = 'twice@example.com'")
+        assert cursor.fetchone()[0] == 2
+
+def test_database_init_keeps_data():
+    db.create_parent('Parent', 'parent@example.com', 'password', '')
+    Database()
+    assert db.verify_parent('parent@example.com', 'password') is not None
+
+def test_process_past_allowances_is_idempotent():
+    from datetime import date
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    db.update_monthly_allowance('child@example.com', 10, 31, '2023-01-01')
+    assert db.process_past_allowances('child@example.com', date(2023, 3, 15)) == 0
+    history = db.get_earnings_history('child@example.com')
+    dates = sorted(row[3].date() for row in history)
+    assert dates[:2] == [date(2023, 1, 31), date(2023, 2, 28)]
+    assert db.get_child_details('child@example.com')[3] == 10 * len(history)
+
+def test_earnings_history_pages():
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    for i in range(5):
+        db.add_earnings('child@example.com', i + 1, f'Chore {i}')
+    first, cursor = db.get_earnings_page('child@example.com', 3)
+    second, last = db.get_earnings_page('child@example.com', 3, cursor)
+    assert len(first) == 3 and len(second) == 2 and last is None
+    assert {row[4] for row in first}.isdisjoint(row[4] for row in second)
+
+def test_child_details_rejects_bad_cursor(client):
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    with client.session_transaction() as sess:
+        sess['user_email'] = 'parent@example.com'
+        sess['user_type'] = 'parent'
+    response = client.get('/child/child@example.com?before=not-a-cursor')
+    assert response.status_code == 400
+
+def test_monthly_summary(client):
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    db.add_earnings('child@example.com', '7.50', 'Chores')
+    with client.session_transaction() as sess:
+        sess['user_email'] = 'parent@example.com'
+        sess['user_type'] = 'parent'
+    response = client.get('/dashboard/summary')
+    assert response.status_code == 200
+    assert b'$7.50' in response.data
+    data = client.get('/api/summary').get_json()
+    assert len(data['months']) == 12
+    assert data['children'][0]['totals'] == {'extra': '7.50'}
+
+def test_export_and_import_earnings(client):
+    import io
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    with client.session_transaction() as sess:
+        sess['user_email'] = 'parent@example.com'
+        sess['user_type'] = 'parent'
+    upload = b"child_email,amount,description,type,created_at\n" \
+             b"child@example.com,4.00,Chores,extra,2023-01-01 10:00:00\n" \
+             b"other@example.com,4.00,Chores,extra,2023-01-01 10:00:00\n"
+    response = client.post('/import/earnings', data={'file': (io.BytesIO(upload), 'earnings.csv')})
+    assert response.get_json() == {'imported': 1, 'children': 1,
+                                   'rejected': [{'line': 3, 'error': 'unknown child other@example.com'}]}
+
+    response = client.get('/earnings.ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    assert b'"amount": "4.00"' in response.data
+    assert client.get('/child/child@example.com/earnings.csv').data.count(b'\n') == 2
+    assert client.get('/child/other@example.com/earnings.csv').status_code == 403
+
+def test_conditional_get(client):
+    db.create_parent('Parent', 'parent@example.com', 'password', '')
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    with client.session_transaction() as sess:
+        sess['user_email'] = 'parent@example.com'
+        sess['user_type'] = 'parent'
+
+    for path in ('/dashboard', '/child/child@example.com'):
+        response = client.get(path)
+        etag = response.headers['ETag']
+        assert response.status_code == 200 and response.last_modified
+        response = client.get(path, headers={'If-None-Match': etag})
+        assert response.status_code == 304 and response.headers['ETag'] == etag
+        assert not response.data
+
+    child_etag = client.get('/child/child@example.com').headers['ETag']
+    db.add_earnings('child@example.com', 5, 'Chores')
+    response = client.get('/child/child@example.com', headers={'If-None-Match': child_etag})
+    assert response.status_code == 200 and b'$5.00' in response.data
+
+    dashboard_etag = client.get('/dashboard').headers['ETag']
+    db.create_child('Second', 'second@example.com', 'password', 'parent@example.com')
+    response = client.get('/dashboard', headers={'If-None-Match': dashboard_etag})
+    assert response.status_code == 200 and b'Second' in response.data
+
+def test_validated_pages_ignore_stale_cached_reads(client):
+    import contextvars
+    from backends import SQLiteBackend
+    from config import Config
+    db.create_parent('Parent', 'parent@example.com', 'password', '')
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    with client.session_transaction() as sess:
+        sess['user_email'] = 'parent@example.com'
+        sess['user_type'] = 'parent'
+    # Warm this process's cache, then write from another worker, whose
+    # invalidation never reaches it
+    elsewhere = lambda read, *args: contextvars.Context().run(read, *args)
+    elsewhere(db.get_child_details, 'child@example.com')
+    elsewhere(db.get_earnings_history, 'child@example.com', Config.EARNINGS_PAGE_SIZE + 1, None)
+    other = Database(SQLiteBackend(Config.SQLITE_PATH), cache=False, events=False)
+    other.add_earnings('child@example.com', 5, 'Chores')
+    other.close()
+
+    assert elsewhere(db.get_child_details, 'child@example.com')[3] == 0
+    response = client.get('/child/child@example.com')
+    assert b'$5.00' in response.data and b'Chores' in response.data
+    # Reads at an unchanged version are still served from the cache
+    hits = db.cache.stats()['hits']
+    assert b'$5.00' in client.get('/child/child@example.com').data
+    assert db.cache.stats()['hits'] > hits
+
+def test_register_families_api(client, monkeypatch):
+    import io
+    import onboarding
+    from config import Config
+    upload = b"parent_name,parent_email,parent_password,child_name,child_email,child_password\n" \
+             b"Ann,ann@example.com,secret,Amy,amy@example.com,kid\n"
+    def post(token):
+        return client.post('/api/families', headers={'Authorization': f'Bearer {token}'},
+                           data={'file': (io.BytesIO(upload), 'families.csv')})
+    assert post('anything').status_code == 404  # Disabled without a configured token
+
+    monkeypatch.setattr(Config, 'ONBOARDING_TOKEN', 'onboard')
+    monkeypatch.setattr(Config, 'ONBOARDING_PROCESSES', 1)
+    assert post('wrong').status_code == 401
+    assert post('onb\u00f6ard').status_code == 401
+    assert post('onboard').get_json() == {'parents': 1, 'children': 1, 'rejected': []}
+    # Uploads share one process pool
+    executor = onboarding.shared_executor()
+    assert post('onboard').get_json()['parents'] == 0
+    assert onboarding.shared_executor() is executor
+    assert db.verify_credentials('amy@example.com', 'kid') == {'type': 'child', 'name': 'Amy'}
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from app import app, db
+from aio import AsyncDatabase
+from asgi import ASGIApp
+from pool import PoolTimeout
+
+def request(asgi_app, method, path, body=b'', headers=(), chunk_size=None):
+    """Drive one ASGI request; returns (status, headers, body messages)"""
+    chunk_size = chunk_size or max(len(body), 1)
+    incoming = [{'type': 'http.request', 'body': body[i:i + chunk_size],
+                 'more_body': i + chunk_size < len(body)} for i in range(0, max(len(body), 1), chunk_size)]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0) if incoming else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+             'headers': [(k.lower().encode(), v.encode()) for k, v in headers], 'http_version': '1.1',
+             'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000), 'root_path': ''}
+    asyncio.run(asgi_app(scope, receive, send))
+    start = sent[0]
+    return start['status'], dict(start['headers']), [m['body'] for m in sent[1:]]
+
+@pytest.fixture
+def asgi_app():
+    db.drop_tables()
+    db.create_tables()
+    adb = AsyncDatabase(db)
+    yield ASGIApp(app, adb, threads=4)
+    adb.close()
+
+def test_asgi_server_builds_an_event_bus(monkeypatch, tmp_path):
+    from asgi import create_app
+    from backends import SQLiteBackend
+    from config import Config
+    from database import Database
+    monkeypatch.setattr(Config, 'EVENTS_BROKER', '')
+    monkeypatch.setattr(Config, 'SERVE_WORKERS', 1)
+    monkeypatch.setitem(app.config, 'EVENT_STREAMS', False)
+    local = Database(SQLiteBackend(str(tmp_path / 'game.db')))
+    # Nothing serves streams yet, so writes publish nowhere
+    assert local.events is None
+    server = create_app(app, local)
+    assert app.config['EVENT_STREAMS'] and local.events is not None
+    server.adb.close()
+    local.close()
+
+def test_flask_routes_are_served(asgi_app):
+    status, headers, body = request(asgi_app, 'GET', '/login')
+    assert status == 200 and b'<form' in b''.join(body)
+    assert headers[b'content-type'].startswith(b'text/html')
+
+def test_request_body_arrives_in_chunks(asgi_app):
+    db.create_parent('Parent', 'parent@example.com', 'password', '')
+    form = b'email=parent%40example.com&password=password'
+    status, headers, _ = request(asgi_app, 'POST', '/login', form, chunk_size=7,
+                                 headers=[('Content-Type', 'application/x-www-form-urlencoded')])
+    assert status == 302 and headers[b'location'].endswith(b'/dashboard')
+
+def test_streamed_responses_are_sent_chunk_by_chunk():
+    stream_app = Flask(__name__)
+
+    @stream_app.route('/stream')
+    def stream():
+        return stream_app.response_class(iter([b'one', b'two', b'three']))
+
+    status, _, body = request(ASGIApp(stream_app, None, threads=1), 'GET', '/stream')
+    assert status == 200 and body == [b'one', b'two', b'three', b'']
+
+def test_health_is_answered_natively(asgi_app):
+    status, _, body = request(asgi_app, 'GET', '/health/live')
+    assert status == 200 and body == [b'{"status": "ok"}']
+    assert request(asgi_app, 'GET', '/health/ready')[0] == 200
+
+def test_async_database_awaits_reads_and_writes():
+    db.drop_tables()
+    db.create_tables()
+    db.create_parent('Parent', 'parent@example.com', 'password', '')
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    adb = AsyncDatabase(db)
+
+    async def scenario():
+        assert await adb.get_children_for_parent('parent@example.com') == [('Child', 'child@example.com')]
+        assert await adb.add_earnings('child@example.com', 5, 'Chores')
+        details = await asyncio.gather(*[adb.get_child_details('child@example.com') for _ in range(5)])
+        assert [child[3] for child in details] == [5] * 5
+    asyncio.run(scenario())
+    adb.close()
+
+def test_async_calls_wait_for_a_connection_without_threads(monkeypatch):
+    adb = AsyncDatabase(db, max_connections=2)
+    active, peak = [], []
+
+    def slow():
+        active.append(1)
+        peak.append(len(active))
+        time.sleep(0.05)
+        active.pop()
+
+    async def scenario():
+        await asyncio.gather(*[adb.run(slow) for _ in range(10)])
+    asyncio.run(scenario())
+    assert max(peak) == 2
+    assert threading.active_count() < 20
+
+    from config import Config
+    monkeypatch.setattr(Config, 'DB_POOL_TIMEOUT', 0.01)
+
+    async def starved():
+        await asyncio.gather(adb.run(time.sleep, 0.2), adb.run(time.sleep, 0.2), adb.run(time.sleep, 0))
+    with pytest.raises(PoolTimeout):
+        asyncio.run(starved())
+    adb.close()
+
+def test_event_stream_is_served_natively(asgi_app):
+    db.create_parent('Parent', 'parent@example.com', 'password', 'kid@example.com')
+    db.create_child('Kid', 'kid@example.com', 'password', 'parent@example.com')
+    with app.test_client() as client:
+        client.post('/login', data=dict(email='parent@example.com', password='password'))
+        cookie = client.get_cookie('session').value
+    scope = {'type': 'http', 'method': 'GET', 'path': '/child/kid@example.com/events', 'query_string': b'',
+             'headers': [(b'cookie', f'session={cookie}'.encode())], 'http_version': '1.1'}
+    sent = []
+
+    async def scenario():
+        gone = asyncio.Event()
+
+        async def receive():
+            await gone.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if b'event: earning' in message.get('body', b''):
+                gone.set()
+
+        serving = asyncio.ensure_future(asgi_app(scope, receive, send))
+        while len(sent) < 2:
+            await asyncio.sleep(0.01)
+        await asyncio.get_running_loop().run_in_executor(None, db.add_earnings, 'kid@example.com', 3, 'Chores')
+        await asyncio.wait_for(serving, 2)
+    asyncio.run(scenario())
+    assert sent[0]['status'] == 200 and (b'content-type', b'text/event-stream; charset=utf-8') in sent[0]['headers']
+    assert b'event: earning' in sent[2]['body']
+    assert app.extensions['event_streams'].stats()['open'] == 0
+
+    status, _, _ = request(asgi_app, 'GET', '/child/kid@example.com/events')
+    assert status == 401
@@ -0,0 +1,47 @@
+import gzip
+import pytest
+from flask import Flask, render_template_string
+import assets
+
+@pytest.fixture
+def asset_app(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'style.css').write_text('body { color: red; }\n' * 50)
+    (tmp_path / 'logo.png').write_bytes(b'png')
+    app = Flask(__name__, static_folder=str(tmp_path), static_url_path='/static')
+    assets.build(app.static_folder)
+    assets.init_app(app)
+    return app
+
+def test_build_fingerprints_and_compresses(asset_app, tmp_path):
+    manifest = assets.load_manifest(str(tmp_path))
+    assert list(manifest) == ['css/style.css']
+    target = tmp_path / 'dist' / manifest['css/style.css']
+    assert target.read_text() == (tmp_path / 'css' / 'style.css').read_text()
+    assert gzip.decompress((tmp_path / 'dist' / (manifest['css/style.css'] + '.gz')).read_bytes()) == target.read_bytes()
+
+def test_asset_url_uses_manifest(asset_app):
+    with asset_app.test_request_context():
+        url = render_template_string("{{ asset_url('css/style.css') }}")
+        assert url.startswith('/assets/css/style.') and url.endswith('.css')
+        assert render_template_string("{{ asset_url('js/other.js') }}") == '/static/js/other.js'
+
+def test_serves_precompressed_variant(asset_app):
+    client = asset_app.test_client()
+    with asset_app.test_request_context():
+        url = assets.asset_url('css/style.css')
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.mimetype == 'text/css'
+    assert gzip.decompress(response.data).startswith(b'body')
+
+    plain = client.get(url)
+    assert 'Content-Encoding' not in plain.headers and plain.data.startswith(b'body')
+
+def test_rejects_paths_outside_dist(asset_app):
+    client = asset_app.test_client()
+    assert client.get('/assets/../css/style.css').status_code == 404
+    assert client.get('/assets/manifest.json').status_code == 404
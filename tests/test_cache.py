@@ -0,0 +1,89 @@
+import contextvars
+import time
+import pytest
+from cache import Cache, MemoryBackend, SQLiteBackend
+from database import Database
+import backends
+import events
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend(max_entries=10)
+    return SQLiteBackend(str(tmp_path / 'cache.db'), max_entries=10)
+
+def test_read_through(backend):
+    cache = Cache(backend)
+    calls = []
+    load = lambda: calls.append(1) or 'value'
+    assert cache.get_or_load('key', [], load) == 'value'
+    assert cache.get_or_load('key', [], load) == 'value'
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_invalidate_by_tag(backend):
+    cache = Cache(backend)
+    cache.get_or_load('a', ['child:a'], lambda: 1)
+    cache.get_or_load('b', ['child:b'], lambda: 2)
+    cache.invalidate('child:a')
+    assert cache.get_or_load('a', ['child:a'], lambda: 10) == 10
+    assert cache.get_or_load('b', ['child:b'], lambda: 20) == 2
+
+def test_lru_eviction():
+    cache = Cache(MemoryBackend(max_entries=2))
+    cache.get_or_load('a', [], lambda: 1)
+    cache.get_or_load('b', [], lambda: 2)
+    cache.get_or_load('a', [], lambda: 1)
+    cache.get_or_load('c', [], lambda: 3)
+    assert cache.get_or_load('a', [], lambda: 'reloaded') == 1
+    assert cache.get_or_load('b', [], lambda: 'reloaded') == 'reloaded'
+    assert cache.stats()['evictions'] >= 1
+
+def test_ttl_expiry(backend):
+    cache = Cache(backend, ttl=0.01)
+    cache.get_or_load('a', [], lambda: 1)
+    time.sleep(0.02)
+    assert cache.get_or_load('a', [], lambda: 2) == 2
+
+def test_writes_invalidate_database_reads(tmp_path):
+    db = Database(backends.SQLiteBackend(str(tmp_path / 'game.db')),
+                  cache=Cache(MemoryBackend()))
+    db.create_tables()
+    assert db.get_children_for_parent('parent@example.com') == []
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    assert len(db.get_children_for_parent('parent@example.com')) == 1
+
+    # Other requests run in their own contexts, which haven't written
+    elsewhere = lambda read, *args: contextvars.Context().run(read, *args)
+    assert elsewhere(db.get_child_details, 'child@example.com')[3] == 0
+    db.add_earnings('child@example.com', 5, 'Chores')
+    assert elsewhere(db.get_child_details, 'child@example.com')[3] == 5
+    assert len(elsewhere(db.get_earnings_history, 'child@example.com')) == 1
+    assert elsewhere(db.get_child_details, 'child@example.com')[3] == 5
+    assert db.cache.stats()['hits'] == 1
+    # The writer itself reads past the cache for a while
+    assert db.get_child_details('child@example.com')[3] == 5
+    assert db.cache.stats()['hits'] == 1
+
+def test_default_backend_follows_workers(monkeypatch):
+    from config import Config
+    import cache
+    monkeypatch.setattr(Config, 'CACHE_BACKEND', '')
+    monkeypatch.setattr(Config, 'SERVE_WORKERS', 4)
+    assert cache.default_backend() == 'sqlite'
+    monkeypatch.setattr(Config, 'SERVE_WORKERS', 1)
+    assert isinstance(cache.create_cache().backend, MemoryBackend)
+
+def test_authorization_sees_another_workers_writes(tmp_path):
+    path = str(tmp_path / 'game.db')
+    db = Database(backends.SQLiteBackend(path), cache=Cache(MemoryBackend()), events=False)
+    db.create_tables()
+    db.create_parent('Parent', 'parent@example.com', 'password', 'child@example.com')
+    elsewhere = lambda read, *args: contextvars.Context().run(read, *args)
+    assert not elsewhere(events.may_watch, db, 'parent@example.com', 'parent', 'child@example.com')
+
+    # A worker with its own process-local cache adds the child
+    other = Database(backends.SQLiteBackend(path), cache=False, events=False)
+    other.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    assert elsewhere(events.may_watch, db, 'parent@example.com', 'parent', 'child@example.com')
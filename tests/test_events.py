@@ -0,0 +1,181 @@
+import json
+import threading
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from app import app, db
+from backends import SQLiteBackend
+from database import Database
+import events
+
+def received(chunks):
+    """(event type, data) of each event in SSE chunks, skipping comments"""
+    parsed = []
+    for chunk in chunks:
+        fields = dict(line.split(': ', 1) for line in chunk.decode().strip().split('\n') if not line.startswith(':'))
+        if 'event' in fields:
+            parsed.append((fields['event'], json.loads(fields['data'])))
+    return parsed
+
+@pytest.fixture
+def local_db(tmp_path):
+    db = Database(SQLiteBackend(str(tmp_path / 'game.db')), cache=False, events=events.EventBus())
+    db.create_tables()
+    db.create_parent('Parent', 'parent@example.com', 'password', 'kid@example.com')
+    db.create_child('Kid', 'kid@example.com', 'password', 'parent@example.com')
+    yield db
+    db.close()
+
+def test_bus_fans_out_and_replays_by_channel():
+    bus = events.EventBus(history=3)
+    mine, other = events.Subscription(), events.Subscription()
+    bus.subscribe('kid@example.com', mine)
+    bus.subscribe('other@example.com', other)
+    start = bus.latest_id()
+    bus.publish('kid@example.com', 'balance', {'balance': 5})
+    bus.publish('other@example.com', 'balance', {'balance': 7})
+
+    assert mine.get(0).data == '{"balance": 5}' and mine.get(0) is None
+    assert [e.data for e in bus.since('kid@example.com', start)] == ['{"balance": 5}']
+    # Ids from another process's memory name nothing here; ones older than the history can't be resumed
+    assert bus.since('kid@example.com', 'elsewhere-1') == []
+    for i in range(3):
+        bus.publish('other@example.com', 'balance', {'balance': i})
+    assert bus.since('kid@example.com', start) is None
+
+def test_database_publishes_committed_writes(local_db):
+    subscription = events.Subscription()
+    local_db.events.subscribe('kid@example.com', subscription)
+    local_db.add_earnings('kid@example.com', 5, 'Chores')
+    local_db.update_monthly_allowance('kid@example.com', 10, 1, date.today().replace(day=1))
+
+    got = []
+    while True:
+        event = subscription.get(0)
+        if event is None:
+            break
+        got.append((event.type, json.loads(event.data)))
+    assert got[0] == ('earning', dict(got[0][1], amount='5.00', description='Chores', type='extra'))
+    assert got[1][0] == 'balance' and Decimal(got[1][1]['balance']) == 5
+    assert got[2][0] == 'allowance' and got[2][1]['monthly_allowance'] == 10
+    assert got[3][0] == 'earning' and got[3][1]['type'] == 'allowance'
+    assert got[4][0] == 'balance' and Decimal(got[4][1]['balance']) == 15
+    # Nothing was due twice, so nothing more is published
+    assert local_db.process_past_allowances('kid@example.com') == 0
+    assert subscription.get(0) is None
+
+def test_stream_resumes_and_sends_heartbeats():
+    bus = events.EventBus()
+    bus.publish('kid@example.com', 'balance', {'balance': 1})
+    resume_from = bus.latest_id()
+    bus.publish('kid@example.com', 'balance', {'balance': 2})
+
+    body = events.stream(bus, 'kid@example.com', resume_from, heartbeat=0.01)
+    assert next(body).startswith(b'retry:')
+    assert received([next(body)]) == [('balance', {'balance': 2})]
+    assert next(body) == events.HEARTBEAT
+    bus.publish('kid@example.com', 'earning', {'amount': 3})
+    assert received([next(body)]) == [('earning', {'amount': 3})]
+    body.close()
+    assert bus.stats()['subscribers'] == 0
+
+    # Another worker's id carries on from now instead of resetting the page
+    body = events.stream(bus, 'kid@example.com', 'unknown-1')
+    next(body)
+    bus.publish('kid@example.com', 'balance', {'balance': 4})
+    assert received([next(body)]) == [('balance', {'balance': 4})]
+    body.close()
+
+    bus = events.EventBus(history=1)
+    stale = bus.latest_id()
+    bus.publish('other@example.com', 'balance', {'balance': 1})
+    bus.publish('other@example.com', 'balance', {'balance': 2})
+    body = events.stream(bus, 'kid@example.com', stale)
+    next(body)
+    assert received([next(body)]) == [('reset', {})]
+    body.close()
+
+def test_default_broker_follows_streams_and_workers(monkeypatch):
+    from config import Config
+    monkeypatch.setattr(Config, 'SERVE_WORKERS', 4)
+    assert events.default_broker() == 'none'
+    assert events.default_broker(streams=True) == 'sqlite'
+    monkeypatch.setattr(Config, 'SERVE_WORKERS', 1)
+    assert events.default_broker(streams=True) == 'memory'
+
+def test_sqlite_broker_reaches_other_processes(tmp_path):
+    path = str(tmp_path / 'events.db')
+    publisher = events.SQLiteBroker(path, poll_interval=0.01)
+    listener = events.SQLiteBroker(path, poll_interval=0.01)
+    subscription = events.Subscription()
+    listener.subscribe('kid@example.com', subscription)
+    start = listener.latest_id()
+    publisher.publish('kid@example.com', 'balance', {'balance': 4})
+
+    event = subscription.get(2)
+    assert event.type == 'balance' and event.id == publisher.latest_id()
+    # Ids are shared, so any process can resume a stream
+    assert [e.id for e in publisher.since('kid@example.com', start)] == [event.id]
+    listener.close()
+    publisher.close()
+
+def test_stream_limiter():
+    limiter = events.StreamLimiter(2)
+    assert limiter.acquire('a') and limiter.acquire('a') and not limiter.acquire('a')
+    assert limiter.acquire('b')
+    limiter.release('a')
+    assert limiter.acquire('a')
+    assert limiter.stats() == {'open': 3, 'users': 2, 'refused': 1}
+
+@pytest.fixture
+def client():
+    db.drop_tables()
+    db.create_tables()
+    db.create_parent('Parent', 'parent@example.com', 'password', 'kid@example.com')
+    db.create_child('Kid', 'kid@example.com', 'password', 'parent@example.com')
+    with app.test_client() as client:
+        yield client
+
+def log_in(client, email, user_type):
+    with client.session_transaction() as sess:
+        sess['user_email'] = email
+        sess['user_type'] = user_type
+
+def test_event_stream_route(client, monkeypatch):
+    log_in(client, 'parent@example.com', 'parent')
+    # Off by default: each stream would hold a server thread
+    assert client.get('/child/kid@example.com/events').status_code == 404
+    monkeypatch.setitem(app.config, 'EVENT_STREAMS', True)
+    assert client.get('/child/stranger@example.com/events').status_code == 403
+
+    monkeypatch.setattr(app.extensions['event_streams'], 'max_per_user', 1)
+    response = client.get('/child/kid@example.com/events', buffered=False)
+    assert response.status_code == 200 and response.mimetype == 'text/event-stream'
+    assert client.get('/child/kid@example.com/events').status_code == 429
+    chunks = iter(response.response)
+    next(chunks)
+
+    threading.Timer(0.05, db.add_earnings, ('kid@example.com', 2, 'Dishes')).start()
+    assert received([next(chunks)])[0][0] == 'earning'
+    response.close()
+    assert app.extensions['event_streams'].stats()['open'] == 0
+
+def test_game_home_balance_is_not_older_than_its_resume_point(client):
+    import contextvars
+    from config import Config
+    log_in(client, 'kid@example.com', 'child')
+    # This worker's cache holds the balance from before another worker's write
+    contextvars.Context().run(db.get_child_details, 'kid@example.com')
+    other = Database(SQLiteBackend(Config.SQLITE_PATH), cache=False, events=False)
+    other.add_earnings('kid@example.com', 7, 'Elsewhere')
+    other.close()
+    assert '$7.00' in client.get('/game-home').data.decode()
+
+def test_pages_resume_from_their_render(client, monkeypatch):
+    log_in(client, 'kid@example.com', 'child')
+    assert 'data-events' not in client.get('/game-home').data.decode()
+    monkeypatch.setitem(app.config, 'EVENT_STREAMS', True)
+    page = client.get('/game-home').data.decode()
+    assert 'data-balance' in page and f'last_event_id={db.events.latest_id()}' in page
@@ -0,0 +1,65 @@
+import threading
+import pytest
+from hashing import PasswordHasher, HasherBusy
+from database import Database
+from backends import SQLiteBackend
+
+def test_hash_and_check():
+    hasher = PasswordHasher(rounds=4)
+    password_hash = hasher.hash('password')
+    assert hasher.check('password', password_hash)
+    assert not hasher.check('wrong', password_hash)
+    assert not hasher.check('password', 'not-a-hash')
+
+def test_needs_rehash_on_cost_change():
+    password_hash = PasswordHasher(rounds=4).hash('password')
+    assert not PasswordHasher(rounds=4).needs_rehash(password_hash)
+    assert PasswordHasher(rounds=5).needs_rehash(password_hash)
+
+def test_rejects_when_queue_is_full():
+    hasher = PasswordHasher(rounds=4, max_workers=1, max_queue=0, queue_timeout=0.01)
+    started, release = threading.Event(), threading.Event()
+    def slow():
+        started.set()
+        release.wait()
+    worker = threading.Thread(target=hasher._run, args=(slow,))
+    worker.start()
+    started.wait()
+    with pytest.raises(HasherBusy):
+        hasher.hash('password')
+    release.set()
+    worker.join()
+    assert hasher.stats()['rejected'] == 1
+    assert hasher.check('password', hasher.hash('password'))
+
+def test_verify_credentials_and_rehash(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'game.db'))
+    db = Database(backend, hasher=PasswordHasher(rounds=4))
+    db.create_tables()
+    db.create_parent('Parent', 'parent@example.com', 'password', 'child@example.com')
+    db.create_child('Child', 'child@example.com', 'secret', 'parent@example.com')
+
+    assert db.verify_credentials('parent@example.com', 'password') == {'type': 'parent', 'name': 'Parent'}
+    assert db.verify_credentials('child@example.com', 'secret') == {'type': 'child', 'name': 'Child'}
+    assert db.verify_credentials('child@example.com', 'wrong') is None
+    assert db.verify_credentials('nobody@example.com', 'secret') is None
+
+    upgraded = Database(backend, hasher=PasswordHasher(rounds=5))
+    assert upgraded.verify_credentials('child@example.com', 'secret')['type'] == 'child'
+    with upgraded.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT password_hash FROM children WHERE email = %s", ('child@example.com',))
+        assert cursor.fetchone()[0].startswith('$2b$05$')
+
+def test_busy_hasher_skips_rehash(tmp_path, monkeypatch):
+    backend = SQLiteBackend(str(tmp_path / 'game.db'))
+    db = Database(backend, hasher=PasswordHasher(rounds=4))
+    db.create_tables()
+    db.create_child('Child', 'child@example.com', 'secret', 'parent@example.com')
+
+    upgraded = Database(backend, hasher=PasswordHasher(rounds=5))
+
+    def busy(password):
+        raise HasherBusy("full")
+    monkeypatch.setattr(upgraded.hasher, 'hash', busy)
+    assert upgraded.verify_credentials('child@example.com', 'secret')['type'] == 'child'
@@ -0,0 +1,40 @@
+import pytest
+from app import app, db
+from config import Config
+from pool import ConnectionPool
+import health
+import serve
+
+@pytest.fixture
+def client():
+    yield app.test_client()
+    health.after_fork()  # Clear any draining state a test set
+
+def test_liveness(client):
+    assert client.get('/health/live').get_json() == {'status': 'ok'}
+
+def test_readiness(client):
+    assert client.get('/health/ready').status_code == 200
+    health.mark_draining()
+    response = client.get('/health/ready')
+    assert response.status_code == 503
+    assert response.get_json()['status'] == 'draining'
+
+def test_readiness_fails_without_database(client, monkeypatch):
+    def broken():
+        raise ConnectionError("database unreachable")
+    monkeypatch.setattr(db, 'pool', ConnectionPool(broken))
+    response = client.get('/health/ready')
+    assert response.status_code == 503
+    assert response.get_json()['database'] == 'database unreachable'
+
+def test_server_options(monkeypatch):
+    monkeypatch.setattr(Config, 'SERVE_WORKERS', 0)
+    options = serve.options()
+    assert options['workers'] == serve.available_cores()
+    assert options['preload_app'] and options['max_requests'] == Config.SERVE_MAX_REQUESTS
+
+def test_threaded_server_refuses_event_streams(monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENT_STREAMS', True)
+    with pytest.raises(RuntimeError, match='ASGI'):
+        serve.run(app)
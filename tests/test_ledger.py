@@ -0,0 +1,73 @@
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from database import Database
+from backends import SQLiteBackend
+import ledger
+
+@pytest.fixture
+def local_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(ledger.Config, 'LEDGER_SNAPSHOT_EVERY', 5)
+    db = Database(SQLiteBackend(str(tmp_path / 'game.db')))
+    db.create_tables()
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    yield db
+    db.close()
+
+def append(db, entries):
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        rows = [('child@example.com', Decimal(amount), 'Chore', 'extra', created_at) for created_at, amount in entries]
+        db._insert_earnings(cursor, rows)
+        db._apply_balance_deltas(cursor, {'child@example.com': sum(Decimal(amount) for _, amount in entries)})
+        conn.commit()
+    db.invalidate(children=['child@example.com'])
+
+def snapshots(db):
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT period_end, balance, entries FROM balance_snapshots ORDER BY period_end")
+        return cursor.fetchall()
+
+def test_plan_cuts_at_month_boundaries_and_every_n_rows():
+    rows = [(datetime(2023, 1, day), 1) for day in range(1, 8)] + [(datetime(2023, 3, 2), 10)]
+    plan = ledger.plan_snapshots((None, 0, 0), rows, every=3)
+    assert plan == [
+        (datetime(2023, 1, 4), 3, 3),
+        (datetime(2023, 1, 7), 6, 6),
+        (datetime(2023, 3, 1), 7, 7),
+    ]
+
+def test_plan_never_splits_equal_timestamps():
+    rows = [(datetime(2023, 1, 1), 1)] * 4 + [(datetime(2023, 1, 2), 1)]
+    assert ledger.plan_snapshots((None, 0, 0), rows, every=2) == [(datetime(2023, 1, 2), 4, 4)]
+
+def test_balance_as_of_uses_snapshots(local_db):
+    append(local_db, [(datetime(2023, month, 15), '10.00') for month in range(1, 13)])
+    assert snapshots(local_db)  # tail passed the threshold
+    assert local_db.get_child_details('child@example.com')[3] == Decimal('120.00')
+    assert local_db.get_balance_as_of('child@example.com', datetime(2023, 6, 15)) == Decimal('60.00')
+    assert local_db.get_balance_as_of('child@example.com', datetime(2023, 6, 14)) == Decimal('50.00')
+    assert local_db.get_balance_as_of('child@example.com', datetime(2022, 1, 1)) == Decimal('0.00')
+
+def test_back_dated_rows_refresh_snapshots(local_db):
+    append(local_db, [(datetime(2023, month, 15), '10.00') for month in range(1, 13)])
+    append(local_db, [(datetime(2023, 2, 1), '5.00')])
+    assert local_db.get_balance_as_of('child@example.com', datetime(2023, 6, 30)) == Decimal('65.00')
+    report = local_db.verify_ledger()
+    assert report['bad_snapshots'] == [] and report['bad_balances'] == []
+    assert report['entries'] == 13
+
+def test_verify_reports_and_repairs_drift(local_db):
+    append(local_db, [(datetime(2023, month, 15), '10.00') for month in range(1, 13)])
+    with local_db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE balance_snapshots SET balance = balance + 1")
+        cursor.execute("UPDATE children SET balance = 0")
+        conn.commit()
+    report = local_db.verify_ledger()
+    assert report['bad_snapshots']
+    assert report['bad_balances'] == [('child@example.com', Decimal('0.00'), Decimal('120.00'))]
+
+    local_db.rebuild_snapshots(['child@example.com'])
+    assert local_db.verify_ledger()['bad_snapshots'] == []
@@ -0,0 +1,21 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import json
+import loadtest
+import app as webapp
+
+def test_smoke_run(tmp_path):
+    original = webapp.db
+    output = tmp_path / 'results.json'
+    loadtest.main([
+        '--db', str(tmp_path / 'load.db'), '--parents', '5', '--earnings-per-child', '20',
+        '--bcrypt-rounds', '4', '--requests', '60', '--concurrency', '4', '--output', str(output),
+    ])
+    results = json.loads(output.read_text())['results']
+    assert results['total']['requests'] == 60
+    assert results['total']['errors'] == 0
+    assert set(results) == set(loadtest.parse_mix(loadtest.DEFAULT_MIX)) | {'total'}
+    # main() points the app at the benchmark database only while it runs
+    assert webapp.db is original and webapp.app.extensions['db'] is original
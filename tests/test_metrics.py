@@ -0,0 +1,63 @@
+import os
+import metrics
+from config import Config
+from database import Database
+from backends import SQLiteBackend
+from app import app
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram('test_seconds', 'Test', ('route',), buckets=(0.1, 1.0))
+    histogram.observe(0.05, '/a')
+    histogram.observe(0.5, '/a')
+    histogram.observe(5, '/a')
+    lines = histogram.collect()
+    assert 'test_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{route="/a"} 3' in lines
+
+def test_queries_are_recorded_per_method(tmp_path):
+    db = Database(SQLiteBackend(str(tmp_path / 'game.db')), cache=False)
+    db.create_tables()
+    before = metrics.QUERY_LATENCY.count('get_child_details')
+    rows_before = metrics.QUERY_ROWS.value('add_earnings')
+    db.get_child_details('child@example.com')
+    db.add_earnings('child@example.com', 5, 'Chores')
+    assert metrics.QUERY_LATENCY.count('get_child_details') == before + 1
+    # The INSERT, the ledger's tail count and the rollup upsert; there is no child row to update
+    assert metrics.QUERY_ROWS.value('add_earnings') == rows_before + 3
+
+def test_slow_queries_are_logged(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(Config, 'SLOW_QUERY_THRESHOLD', 0)
+    db = Database(SQLiteBackend(str(tmp_path / 'game.db')), cache=False)
+    db.create_tables()
+    db.get_children_for_parent('parent@example.com')
+    assert any('Slow query in get_children_for_parent' in r.getMessage() for r in caplog.records)
+
+def test_metrics_endpoint():
+    client = app.test_client()
+    client.get('/login')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{route="/login",method="GET",status="200"}' in body
+    assert 'template_render_seconds_count{template="login.html"}' in body
+    assert 'db_pool{stat="in_use"}' in body
+
+def test_metrics_endpoint_is_restricted(monkeypatch):
+    client = app.test_client()
+    remote = {'REMOTE_ADDR': '203.0.113.7'}
+    assert client.get('/metrics', environ_base=remote).status_code == 404
+    monkeypatch.setattr(Config, 'METRICS_TOKEN', 'scrape')
+    assert client.get('/metrics', environ_base=remote, headers={'Authorization': 'Bearer wrong'}).status_code == 404
+    assert client.get('/metrics', environ_base=remote, headers={'Authorization': 'Bearer \u00e9'}).status_code == 404
+    assert client.get('/metrics', environ_base=remote, headers={'Authorization': 'Bearer scrape'}).status_code == 200
+
+def test_profile_header(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'PROFILER_ENABLED', True)
+    monkeypatch.setattr(Config, 'PROFILER_TOKEN', 'secret')
+    monkeypatch.setattr(Config, 'PROFILER_DIR', str(tmp_path))
+    client = app.test_client()
+    assert 'X-Profile-File' not in client.get('/login').headers
+    response = client.get('/login', headers={'X-Profile': 'secret'})
+    assert os.path.exists(tmp_path / response.headers['X-Profile-File'])
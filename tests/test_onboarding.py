@@ -0,0 +1,69 @@
+import io
+import pytest
+from database import Database
+from backends import SQLiteBackend
+import onboarding
+
+@pytest.fixture
+def local_db(tmp_path):
+    db = Database(SQLiteBackend(str(tmp_path / 'game.db')), cache=False)
+    db.create_tables()
+    db.create_parent('Taken', 'taken@example.com', 'password', 'kid@example.com')
+    db.create_child('Kid', 'kid@example.com', 'password', 'taken@example.com')
+    yield db
+    db.close()
+
+@pytest.fixture(scope='module')
+def executor():
+    executor = onboarding.create_executor(2)
+    yield executor
+    executor.shutdown()
+
+CSV = """parent_name,parent_email,parent_password,child_name,child_email,child_password
+Ann,ann@example.com,secret1,Amy,amy@example.com,kid1
+Ann,ann@example.com,ignored,Al,al@example.com,kid2
+Ben,ben@example.com,secret2,Bea,bea@example.com,kid3
+Tom,taken@example.com,secret3,Tim,tim@example.com,kid4
+Cat,cat@example.com,secret4,Kid,kid@example.com,kid5
+Dan,dan@example.com,secret5,Amy,amy@example.com,kid6
+Eve,not-an-email,secret6,Eli,eli@example.com,kid7
+Fay,fay@example.com,,Flo,flo@example.com,kid8
+"""
+
+def test_registers_families_and_reports_rejections(local_db, executor):
+    report = onboarding.load(local_db, io.StringIO(CSV), 'csv', batch_size=3, executor=executor)
+    assert report['parents'] == 3  # ann, ben, cat; dan's only row is rejected
+    assert report['children'] == 3  # amy, al, bea
+    assert [line for line, _ in report['rejected']] == [5, 6, 7, 8, 9]
+    assert report['rejected'][0] == (5, "taken@example.com is already registered")
+    assert report['rejected'][1] == (6, "kid@example.com is already registered")
+    assert 'earlier in the file' in report['rejected'][2][1]
+
+    assert local_db.get_children_for_parent('ann@example.com') == [('Amy', 'amy@example.com'), ('Al', 'al@example.com')]
+    assert local_db.verify_credentials('ann@example.com', 'secret1') == {'type': 'parent', 'name': 'Ann'}
+    assert local_db.verify_credentials('al@example.com', 'kid2') == {'type': 'child', 'name': 'Al'}
+    # The existing accounts are untouched
+    assert local_db.verify_credentials('kid@example.com', 'password') == {'type': 'child', 'name': 'Kid'}
+
+def test_loading_twice_registers_nothing_new(local_db, executor):
+    onboarding.load(local_db, io.StringIO(CSV), 'csv', executor=executor)
+    report = onboarding.load(local_db, io.StringIO(CSV), 'csv', executor=executor)
+    assert report['parents'] == report['children'] == 0
+
+def test_unique_key_rejects_duplicate_registration(local_db):
+    assert not local_db.create_parent('Again', 'taken@example.com', 'password', 'kid@example.com')
+    assert not local_db.create_child('Again', 'kid@example.com', 'password', 'taken@example.com')
+    inserted, rejected = local_db.insert_accounts('child', [
+        (1, 'Kid', 'kid@example.com', 'hash', 'taken@example.com'),
+        (2, 'New', 'new@example.com', 'hash', 'taken@example.com'),
+    ])
+    assert inserted == {'new@example.com'}
+    assert rejected == [(1, "kid@example.com is already registered")]
+
+def test_parse_family_validates():
+    record = dict(zip(onboarding.FIELDS, ['P', 'p@example.com', 'pw', 'C', 'c@example.com', 'pw']))
+    assert onboarding.parse_family(record)[4] == 'c@example.com'
+    with pytest.raises(onboarding.InvalidFamily):
+        onboarding.parse_family(dict(record, child_email='p@example.com'))
+    with pytest.raises(onboarding.InvalidFamily):
+        onboarding.parse_family(dict(record, child_name='x' * 101))
@@ -0,0 +1,80 @@
+import sqlite3
+import threading
+import pytest
+from pool import ConnectionPool, PoolTimeout
+
+def sqlite_connect():
+    return sqlite3.connect(':memory:', check_same_thread=False)
+
+def test_checkout_and_return():
+    pool = ConnectionPool(sqlite_connect, min_size=1, max_size=2)
+    with pool.connection() as conn:
+        assert pool.stats()['in_use'] == 1
+        conn.cursor().execute("SELECT 1")
+    stats = pool.stats()
+    assert stats['in_use'] == 0
+    assert stats['idle'] == 1
+    assert stats['checkouts'] == 1
+
+def test_connections_are_reused():
+    pool = ConnectionPool(sqlite_connect, min_size=1, max_size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert pool.stats()['size'] == 1
+
+def test_checkout_timeout_when_exhausted():
+    pool = ConnectionPool(sqlite_connect, min_size=0, max_size=1, timeout=0.05)
+    conn = pool.checkout()
+    with pytest.raises(PoolTimeout):
+        pool.checkout()
+    pool.checkin(conn)
+    assert pool.stats()['checkout_failures'] == 1
+
+def test_waiter_gets_returned_connection():
+    pool = ConnectionPool(sqlite_connect, min_size=0, max_size=1, timeout=2)
+    conn = pool.checkout()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(pool.checkout()))
+    waiter.start()
+    pool.checkin(conn)
+    waiter.join()
+    assert result == [conn]
+    assert pool.stats()['wait_time_max'] > 0
+
+def test_broken_connection_is_replaced():
+    pool = ConnectionPool(sqlite_connect, min_size=1, max_size=1, health_check_interval=0)
+    with pool.connection() as conn:
+        pass
+    conn.close()
+    with pool.connection() as replacement:
+        replacement.cursor().execute("SELECT 1")
+    assert replacement is not conn
+    assert pool.stats()['reconnects'] == 1
+    assert pool.stats()['size'] == 1
+
+def test_failed_connect_releases_slot():
+    calls = []
+    def flaky_connect():
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("connection refused")
+        return sqlite_connect()
+    pool = ConnectionPool(flaky_connect, min_size=0, max_size=1)
+    with pytest.raises(sqlite3.OperationalError):
+        pool.checkout()
+    with pool.connection():
+        pass
+    assert pool.stats()['checkout_failures'] == 1
+
+def test_forked_child_opens_its_own_connections():
+    pool = ConnectionPool(sqlite_connect, min_size=1, max_size=1)
+    with pool.connection() as inherited:
+        pass
+    # Pretend this process was forked from the one that opened the connection
+    pool._pid = -1
+    with pool.connection() as conn:
+        assert conn is not inherited
+    assert pool.stats()['size'] == 1
@@ -0,0 +1,56 @@
+import os
+import pytest
+from app import app, db
+from config import Config
+from metrics import FRAGMENT_CACHE
+import rendering
+
+@pytest.fixture
+def client():
+    db.drop_tables()
+    db.create_tables()
+    app.extensions['fragments'].clear()
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['user_email'] = 'parent@example.com'
+            sess['user_type'] = 'parent'
+        yield client
+
+def test_earnings_list_is_rendered_once_per_version(client):
+    template = '_earnings_list.html'
+    misses, hits = FRAGMENT_CACHE.value(template, 'miss'), FRAGMENT_CACHE.value(template, 'hit')
+    assert b'No earnings recorded yet' in client.get('/child/child@example.com').data
+    assert b'No earnings recorded yet' in client.get('/child/child@example.com').data
+    assert FRAGMENT_CACHE.value(template, 'miss') == misses + 1
+    assert FRAGMENT_CACHE.value(template, 'hit') == hits + 1
+
+    db.add_earnings('child@example.com', 3, 'Dishes')
+    assert b'Dishes' in client.get('/child/child@example.com').data
+    assert FRAGMENT_CACHE.value(template, 'miss') == misses + 2
+
+def test_fragment_context_is_read_at_its_version(client):
+    import contextvars
+    from backends import SQLiteBackend
+    from database import Database
+    # A cached history from before another worker's write must not be
+    # rendered under the key of the version after it
+    contextvars.Context().run(db.get_earnings_history, 'child@example.com', Config.EARNINGS_PAGE_SIZE + 1, None)
+    other = Database(SQLiteBackend(Config.SQLITE_PATH), cache=False, events=False)
+    other.add_earnings('child@example.com', 3, 'Dishes')
+    other.close()
+
+    def render():
+        with app.test_request_context(), db.versioned('child', 'child@example.com') as version:
+            return rendering.fragment('_earnings_list.html', ('child@example.com', *version), lambda: dict(
+                earnings=db.get_earnings_page('child@example.com', Config.EARNINGS_PAGE_SIZE)[0],
+                next_cursor=None, older_page=False, child_email='child@example.com'))
+    assert 'Dishes' in contextvars.Context().run(render)
+
+def test_bad_cursor_is_still_rejected(client):
+    assert client.get('/child/child@example.com?before=garbage').status_code == 400
+
+def test_compile_templates_fills_bytecode_cache():
+    names = rendering.compile_templates(app)
+    assert 'child_details.html' in names and '_earnings_list.html' in names
+    assert len(os.listdir(Config.TEMPLATE_CACHE_DIR)) >= len(names)
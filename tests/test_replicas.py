@@ -0,0 +1,137 @@
+import contextvars
+import os
+
+import pytest
+from flask import Flask
+
+from backends import SQLiteBackend
+from database import Database
+import replicas
+
+
+def fresh(fn, *args):
+    """Run fn in a context that has not written anything yet"""
+    return contextvars.Context().run(fn, *args)
+
+
+def make_db(path):
+    db = Database(backend=SQLiteBackend(path), cache=False, replica_backends=[])
+    db.create_tables()
+    return db
+
+
+@pytest.fixture
+def paths(tmp_path):
+    # Two database files stand in for a primary and its replica
+    primary, replica = str(tmp_path / 'primary.db'), str(tmp_path / 'replica.db')
+    for path, name in ((primary, 'Primary Kid'), (replica, 'Replica Kid')):
+        db = make_db(path)
+        db.create_child(name, 'kid@example.com', 'secret', 'parent@example.com')
+        db.close()
+    return primary, replica
+
+
+def test_reads_go_to_replica_and_writes_to_primary(paths):
+    primary, replica = paths
+    db = Database(backend=SQLiteBackend(primary), cache=False, replica_backends=[SQLiteBackend(replica)])
+
+    assert fresh(db.get_child_details, 'kid@example.com')[0] == 'Replica Kid'
+    assert fresh(db.get_children_for_parent, 'parent@example.com') == [('Replica Kid', 'kid@example.com')]
+
+    def write_then_read():
+        assert db.add_earnings('kid@example.com', 5, 'Chores')
+        return db.get_child_details('kid@example.com')
+
+    # The writer reads its own write from the primary
+    name, _, _, balance = fresh(write_then_read)
+    assert (name, balance) == ('Primary Kid', 5)
+    # Everyone else still reads the (unreplicated) replica
+    assert fresh(db.get_child_details, 'kid@example.com')[3] == 0
+    assert db.replicas.stats()['primary']['fallbacks'] == 0
+    db.close()
+
+
+def test_versioned_reads_come_from_the_primary_and_share_the_cache(paths):
+    from cache import Cache, MemoryBackend
+    primary, replica = paths
+    db = Database(backend=SQLiteBackend(primary), cache=Cache(MemoryBackend()),
+                  replica_backends=[SQLiteBackend(replica)])
+
+    def page():
+        with db.versioned('child', 'kid@example.com') as version:
+            return version, db.get_child_details('kid@example.com')
+
+    version, child = fresh(page)
+    assert version is not None and child[0] == 'Primary Kid'
+    assert fresh(page)[1] == child and db.cache.stats()['hits'] == 1
+    # Outside a block, reads still go to the replica, under their own keys
+    assert fresh(db.get_child_details, 'kid@example.com')[0] == 'Replica Kid'
+    db.close()
+
+
+def test_failed_replica_is_skipped(paths, tmp_path):
+    primary, replica = paths
+    missing = SQLiteBackend(str(tmp_path / 'missing' / 'replica.db'))
+    db = Database(backend=SQLiteBackend(primary), cache=False,
+                  replica_backends=[missing, SQLiteBackend(replica)])
+
+    for _ in range(4):
+        assert fresh(db.get_child_details, 'kid@example.com')[0] == 'Replica Kid'
+    stats = db.replicas.stats()
+    assert stats[missing.describe()]['healthy'] == 0
+    assert stats[missing.describe()]['failures'] == 1
+    db.close()
+
+
+def test_all_replicas_down_falls_back_to_primary(paths, tmp_path):
+    primary, _ = paths
+    db = Database(backend=SQLiteBackend(primary), cache=False,
+                  replica_backends=[SQLiteBackend(str(tmp_path / 'missing' / 'replica.db'))])
+
+    assert fresh(db.get_child_details, 'kid@example.com')[0] == 'Primary Kid'
+    assert fresh(lambda: list(db.iter_earnings(['kid@example.com']))) == []
+    assert db.replicas.stats()['primary']['fallbacks'] == 2
+    db.close()
+
+
+def test_down_replica_is_retried_after_interval(paths, tmp_path):
+    primary, replica = paths
+    path = str(tmp_path / 'late' / 'replica.db')
+    db = Database(backend=SQLiteBackend(primary), cache=False, replica_backends=[SQLiteBackend(path)])
+    db.replicas.retry_after = 0
+
+    assert fresh(db.get_child_details, 'kid@example.com')[0] == 'Primary Kid'
+    os.makedirs(os.path.dirname(path))
+    os.replace(replica, path)
+    assert fresh(db.get_child_details, 'kid@example.com')[0] == 'Replica Kid'
+    db.close()
+
+
+def test_reads_spread_over_replicas(paths):
+    primary, replica = paths
+    db = Database(backend=SQLiteBackend(primary), cache=False,
+                  replica_backends=[SQLiteBackend(replica), SQLiteBackend(primary)])
+    first = [db.replicas.candidates()[0].name for _ in range(4)]
+    assert first[0] != first[1] and first[0] == first[2]
+    db.close()
+
+
+def test_session_stays_on_primary_after_writing():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    replicas.init_app(app)
+
+    @app.route('/write', methods=['POST'])
+    def write():
+        replicas.stick_to_primary(60)
+        return ''
+
+    @app.route('/read')
+    def read():
+        return str(replicas.reads_from_primary())
+
+    client = app.test_client()
+    assert client.get('/read').text == 'False'
+    client.post('/write')
+    assert client.get('/read').text == 'True'
+    assert app.test_client().get('/read').text == 'False'
@@ -0,0 +1,64 @@
+import pytest
+from datetime import date, datetime
+from decimal import Decimal
+from database import Database
+from backends import SQLiteBackend
+import rollups
+
+@pytest.fixture
+def local_db(tmp_path):
+    db = Database(SQLiteBackend(str(tmp_path / 'game.db')))
+    db.create_tables()
+    db.create_child('Alice', 'alice@example.com', 'password', 'parent@example.com')
+    db.create_child('Bob', 'bob@example.com', 'password', 'parent@example.com')
+    yield db
+    db.close()
+
+def rollup_rows(db):
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT child_email, month, type, total, entries FROM earnings_monthly ORDER BY 1, 2, 3")
+        return cursor.fetchall()
+
+def test_write_paths_keep_rollups_current(local_db):
+    local_db.update_monthly_allowance('alice@example.com', 10, 1, '2023-01-01')
+    local_db.add_earnings('alice@example.com', '2.50', 'Chores')
+    local_db.add_earnings('alice@example.com', '1.50', 'Chores')
+    this_month = rollups.month_of(date.today())
+    rows = rollup_rows(local_db)
+    assert ('alice@example.com', date(2023, 1, 1), 'allowance', Decimal('10.00'), 1) in rows
+    assert ('alice@example.com', this_month, 'extra', Decimal('4.00'), 2) in rows
+
+    built = list(rows)
+    local_db.rebuild_rollups()
+    assert rollup_rows(local_db) == built
+
+def test_summary_covers_every_child_and_month(local_db):
+    with local_db.pool.connection() as conn:
+        cursor = conn.cursor()
+        local_db._insert_earnings(cursor, [
+            ('alice@example.com', Decimal('10'), 'Allowance', 'allowance', datetime(2024, 1, 1)),
+            ('alice@example.com', Decimal('3'), 'Chores', 'extra', datetime(2024, 3, 9)),
+            ('alice@example.com', Decimal('99'), 'Old', 'extra', datetime(2022, 3, 9)),
+            ('alice@example.com', Decimal('50'), 'Future', 'extra', datetime(2099, 1, 1)),
+        ])
+        conn.commit()
+    today = date(2024, 3, 15)
+    summary = rollups.summarize(local_db.get_monthly_summary('parent@example.com', 12, today), today)
+    assert summary['months'][0] == '2023-04' and summary['months'][-1] == '2024-03'
+    alice, bob = summary['children']
+    assert alice['months']['2024-01'] == {'allowance': {'total': Decimal('10.00'), 'entries': 1}}
+    assert alice['totals'] == {'allowance': Decimal('10.00'), 'extra': Decimal('3.00')}
+    # Rows outside the window are skipped rather than breaking the summary
+    stray = [('alice@example.com', 'Alice', date(2099, 1, 1), 'extra', Decimal('50'), 1)]
+    assert rollups.summarize(stray, today)['children'][0]['totals'] == {}
+    assert bob['name'] == 'Bob' and bob['totals'] == {}
+
+def test_rebuild_single_child(local_db):
+    local_db.add_earnings('bob@example.com', '5', 'Chores')
+    with local_db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM earnings_monthly")
+        conn.commit()
+    assert local_db.rebuild_rollups(['bob@example.com']) == 1
+    assert [row[0] for row in rollup_rows(local_db)] == ['bob@example.com']
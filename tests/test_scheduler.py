@@ -0,0 +1,73 @@
+import pytest
+from datetime import date
+from database import Database
+from backends import SQLiteBackend
+import scheduler
+
+@pytest.fixture
+def local_db(tmp_path):
+    db = Database(SQLiteBackend(str(tmp_path / 'game.db')))
+    db.create_tables()
+    yield db
+    db.close()
+
+def add_children(db, count, allowance_day=1, start_date='2023-01-01'):
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO children (name, email, password_hash, parent_email,
+                                  monthly_allowance, allowance_day, allowance_start_date)
+            VALUES (%s, %s, 'x', 'parent@example.com', 10, %s, %s)
+        """, [(f'Child {i}', f'child{i}@example.com', allowance_day, start_date) for i in range(count)])
+        conn.commit()
+
+def balances(db):
+    with db.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT email, balance FROM children")
+        return dict(cursor.fetchall())
+
+def test_run_credits_every_due_child(local_db):
+    add_children(local_db, 50)
+    report = scheduler.run_allowances(local_db, date(2023, 3, 15), workers=4, batch_size=7)
+    assert report['due'] == 50
+    assert report['children_credited'] == 50
+    assert report['payments'] == 150
+    assert set(balances(local_db).values()) == {30}
+
+def test_rerun_does_not_double_pay(local_db):
+    add_children(local_db, 20)
+    scheduler.run_allowances(local_db, date(2023, 3, 15), workers=3)
+    report = scheduler.run_allowances(local_db, date(2023, 3, 15), workers=3)
+    assert report['due'] == 0
+    assert set(balances(local_db).values()) == {30}
+
+def test_resume_skips_checkpointed_children(local_db):
+    add_children(local_db, 20)
+    run_date = date(2023, 3, 15)
+    due = sorted(scheduler.find_due_children(local_db, run_date))
+    shard0 = [email for email in due if scheduler.shard_of(email, 2) == 0]
+    # Simulate a run that crashed after crediting the first half of shard 0
+    scheduler.credit_shard(local_db, run_date, 2, 0, shard0[:len(shard0) // 2], 100)
+
+    report = scheduler.run_allowances(local_db, run_date, workers=2)
+    assert report['skipped'] == 0  # already-paid children are no longer due
+    assert report['children_credited'] == 20 - len(shard0) // 2
+    assert set(balances(local_db).values()) == {30}
+
+def test_checkpoint_is_honoured(local_db):
+    add_children(local_db, 10)
+    run_date = date(2023, 3, 15)
+    with local_db.pool.connection() as conn:
+        cursor = conn.cursor()
+        scheduler._save_checkpoint(cursor, run_date, 1, 0, 'child4@example.com', 0)
+        conn.commit()
+    report = scheduler.run_allowances(local_db, run_date, workers=1)
+    assert report['skipped'] == 5
+    assert report['children_credited'] == 5
+
+def test_allowance_day_clamped_in_short_months(local_db):
+    add_children(local_db, 1, allowance_day=31)
+    scheduler.run_allowances(local_db, date(2023, 2, 28), workers=1)
+    history = local_db.get_earnings_history('child0@example.com')
+    assert sorted(row[3].date() for row in history) == [date(2023, 1, 31), date(2023, 2, 28)]
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    def worker(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def slow_load(calls, release, value='value'):
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return value
+    return load
+
+
+def test_concurrent_calls_share_one_load():
+    flight = SingleFlight(timeout=5)
+    calls, release = [], threading.Event()
+    load = slow_load(calls, release)
+    threading.Timer(0.2, release.set).start()
+
+    results = run_concurrently(8, lambda: flight.do(('get_child_details', 'kid@example.com'), load))
+    assert results == ['value'] * 8
+    assert len(calls) == 1
+    assert flight.stats() == {'executed': 1, 'coalesced': 7, 'timeouts': 0, 'in_flight': 0}
+
+
+def test_different_keys_do_not_share():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('b', lambda: 2) == 2
+    assert flight.stats()['executed'] == 2
+
+
+def test_waiters_get_the_leaders_exception():
+    flight = SingleFlight(timeout=5)
+    started, release = threading.Event(), threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("query failed")
+
+    leader = threading.Thread(target=lambda: pytest.raises(RuntimeError, flight.do, 'key', failing))
+    leader.start()
+    started.wait(5)
+    threading.Timer(0.2, release.set).start()
+    with pytest.raises(RuntimeError, match="query failed"):
+        flight.do('key', lambda: 'never called')
+    leader.join()
+    # The failed call is forgotten; the next caller loads again
+    assert flight.do('key', lambda: 'ok') == 'ok'
+
+
+def test_waiter_times_out_and_loads_itself():
+    flight = SingleFlight(timeout=0.05)
+    started, release = threading.Event(), threading.Event()
+
+    def stuck():
+        started.set()
+        release.wait(5)
+        return 'slow'
+
+    leader = threading.Thread(target=flight.do, args=('key', stuck))
+    leader.start()
+    started.wait(5)
+    begun = time.monotonic()
+    assert flight.do('key', lambda: 'fast') == 'fast'
+    assert time.monotonic() - begun < 1
+    release.set()
+    leader.join()
+    assert flight.stats()['timeouts'] == 1
+
+
+def test_cache_misses_after_an_invalidation_start_a_new_flight():
+    from cache import Cache, MemoryBackend
+    cache, flight = Cache(MemoryBackend()), SingleFlight(timeout=5)
+    calls, release = [], threading.Event()
+    load = lambda value: cache.get_or_load('key', ['child:a'], slow_load(calls, release, value), flight)
+
+    before_write = threading.Thread(target=load, args=('old',))
+    before_write.start()
+    while not calls:
+        time.sleep(0.01)
+    cache.invalidate('child:a')
+    after_write = threading.Thread(target=load, args=('new',))
+    after_write.start()
+    release.set()
+    before_write.join()
+    after_write.join()
+    assert len(calls) == 2
+    assert cache.get_or_load('key', ['child:a'], lambda: 'reloaded', flight) == 'new'
+
+
+def test_database_reads_are_coalesced(monkeypatch):
+    from app import db
+    import ledger
+
+    db.create_child('Flight Kid', 'flight.kid@example.com', 'secret', 'flight.parent@example.com')
+    monkeypatch.setattr(db, 'cache', None)
+    monkeypatch.setattr(db, 'single_flight', SingleFlight(timeout=5))
+    balance_as_of = ledger.balance_as_of
+
+    def slow_balance(*args):
+        time.sleep(0.2)
+        return balance_as_of(*args)
+    monkeypatch.setattr(ledger, 'balance_as_of', slow_balance)
+
+    results = run_concurrently(4, lambda: db.get_child_details('flight.kid@example.com'))
+    assert all(result[1] == 'flight.kid@example.com' for result in results)
+    assert db.single_flight.stats()['executed'] == 1
+    assert db.single_flight.stats()['coalesced'] == 3
@@ -0,0 +1,71 @@
+import io
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from database import Database
+from backends import SQLiteBackend
+import transfer
+
+@pytest.fixture
+def local_db(tmp_path):
+    db = Database(SQLiteBackend(str(tmp_path / 'game.db')))
+    db.create_tables()
+    db.create_child('Alice', 'alice@example.com', 'password', 'parent@example.com')
+    db.create_child('Bob', 'bob@example.com', 'password', 'parent@example.com')
+    yield db
+    db.close()
+
+CSV = """child_email,amount,description,type,created_at
+alice@example.com,10.00,Allowance,allowance,2023-01-01 00:00:00
+alice@example.com,2.50,"Dishes, twice",extra,2023-01-05 18:30:00
+bob@example.com,1.25,Chores,extra,2023-02-01 09:00:00
+nobody@example.com,1.00,Chores,extra,2023-02-01 09:00:00
+alice@example.com,abc,Bad,extra,2023-02-01 09:00:00
+alice@example.com,1.00,Bad,bonus,2023-02-01 09:00:00
+alice@example.com,1.001,Bad,extra,2023-02-01 09:00:00
+bob@example.com,1.00,Bad,extra,yesterday
+"""
+
+def test_import_validates_and_applies_balances(local_db):
+    report = transfer.load(local_db, io.StringIO(CSV), 'csv')
+    assert report['imported'] == 3
+    assert report['children'] == 2
+    assert [line for line, _ in report['rejected']] == [5, 6, 7, 8, 9]
+    assert 'unknown child' in report['rejected'][0][1]
+    assert local_db.get_child_details('alice@example.com')[3] == Decimal('12.50')
+    assert local_db.get_child_details('bob@example.com')[3] == Decimal('1.25')
+    assert local_db.verify_ledger()['bad_balances'] == []
+
+def test_import_respects_allowed_children(local_db):
+    report = transfer.load(local_db, io.StringIO(CSV), 'csv', allowed_children=['bob@example.com'])
+    assert report['imported'] == 1
+
+@pytest.mark.parametrize('fmt', ['csv', 'ndjson'])
+def test_export_round_trips(local_db, tmp_path, fmt):
+    transfer.load(local_db, io.StringIO(CSV), 'csv')
+    exported = ''.join(transfer.EXPORTERS[fmt](local_db.iter_earnings(['alice@example.com', 'bob@example.com'])))
+
+    copy = Database(SQLiteBackend(str(tmp_path / 'copy.db')))
+    copy.create_tables()
+    copy.create_child('Alice', 'alice@example.com', 'password', 'parent@example.com')
+    copy.create_child('Bob', 'bob@example.com', 'password', 'parent@example.com')
+    report = transfer.load(copy, io.StringIO(exported), fmt)
+    assert report == {'imported': 3, 'children': 2, 'rejected': []}
+    assert list(copy.iter_earnings(['alice@example.com', 'bob@example.com'])) == \
+        list(local_db.iter_earnings(['alice@example.com', 'bob@example.com']))
+    copy.close()
+
+def test_export_streams_in_chunks(local_db, monkeypatch):
+    monkeypatch.setattr(transfer, 'CSV_CHUNK_ROWS', 2)
+    rows = [('alice@example.com', Decimal('1.00'), 'x', 'extra', datetime(2023, 1, i + 1)) for i in range(5)]
+    chunks = list(transfer.to_csv(iter(rows)))
+    assert len(chunks) == 3
+    assert ''.join(chunks).count('\n') == 6
+
+def test_ndjson_rejects_malformed_lines(local_db):
+    lines = io.StringIO('{"child_email": "bob@example.com", "amount": 3, "created_at": "2023-01-01"}\n'
+                        '\n'
+                        'not json\n')
+    report = transfer.load(local_db, lines, 'ndjson')
+    assert report['imported'] == 1
+    assert report['rejected'] == [(3, 'not a JSON object')]
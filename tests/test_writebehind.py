@@ -0,0 +1,96 @@
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+import pytest
+from database import Database
+from backends import SQLiteBackend
+from writebehind import WriteBehindQueue, QueueFull
+
+def test_concurrent_writes_share_a_commit():
+    batches = []
+    queue = WriteBehindQueue(lambda items: batches.append(items) or True, flush_size=50, flush_interval=0.2)
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(queue.submit(i))) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queue.close()
+    assert results == [True] * 20
+    assert sorted(item for batch in batches for item in batch) == list(range(20))
+    assert len(batches) < 20
+
+def test_failed_flush_is_reported_to_every_writer():
+    def flush(items):
+        raise RuntimeError("disk full")
+    queue = WriteBehindQueue(flush, flush_interval=0)
+    assert queue.submit('a') is False
+    queue.close()
+    assert queue.stats()['failed'] == 1
+
+def test_rejects_when_queue_is_full():
+    started, release = threading.Event(), threading.Event()
+    def slow(items):
+        started.set()
+        release.wait()
+        return True
+    queue = WriteBehindQueue(slow, max_queue=1, flush_size=1, flush_interval=0, enqueue_timeout=0.01)
+    first = threading.Thread(target=queue.submit, args=('a',))
+    first.start()
+    started.wait()  # 'a' is being flushed
+    second = threading.Thread(target=queue.submit, args=('b',))
+    second.start()
+    while queue.stats()['queued'] < 1:
+        time.sleep(0.001)
+    with pytest.raises(QueueFull):
+        queue.submit('c')
+    release.set()
+    first.join()
+    second.join()
+    queue.close()
+    assert queue.stats()['rejected'] == 1
+
+def test_add_earnings_group_commits_balance(tmp_path):
+    db = Database(SQLiteBackend(str(tmp_path / 'game.db')), write_behind=True)
+    db.create_tables()
+    db.create_child('Child', 'child@example.com', 'password', 'parent@example.com')
+    threads = [threading.Thread(target=db.add_earnings, args=('child@example.com', '1.50', f'Chore {i}'))
+               for i in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert db.get_child_details('child@example.com')[3] == Decimal('60.00')
+    assert len(db.get_earnings_history('child@example.com')) == 40
+    assert db.add_earnings('child@example.com', 'not a number', 'Chore') is False
+    db.close()
+
+def test_flush_can_fail_single_writes():
+    queue = WriteBehindQueue(lambda items: [item != 'bad' for item in items], flush_size=3, flush_interval=0.2)
+    results = {}
+    threads = [threading.Thread(target=lambda item=item: results.update({item: queue.submit(item)}))
+               for item in ('a', 'bad', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {'a': True, 'bad': False, 'b': True}
+    assert queue.stats()['failed'] == 1
+    queue.close()
+
+def test_bad_earnings_fail_alone(tmp_path):
+    db = Database(SQLiteBackend(str(tmp_path / 'game.db')), write_behind=True)
+    db.create_tables()
+    db.create_child('A', 'a@example.com', 'password', 'parent@example.com')
+    db.create_child('B', 'b@example.com', 'password', 'parent@example.com')
+    for amount in ('1e400', 'NaN', 'Infinity', '100000000', '1.001', None):
+        assert db.add_earnings('b@example.com', amount, 'Too much') is False
+
+    # Whatever slips past validation is retried entry by entry
+    now = datetime.now()
+    entries = [('a@example.com', Decimal('5'), 'Good', 'extra', now),
+               ('b@example.com', object(), 'Unstorable', 'extra', now)]
+    assert db._flush_earnings(entries) == [True, False]
+    assert db.get_child_details('a@example.com')[3] == Decimal('5.00')
+    db.close()
@@ -0,0 +1,137 @@
+"""Bulk export and import of the earnings ledger as CSV or NDJSON.
+
+Exports are generators over a streaming cursor (``Database.iter_earnings``),
+so a response or file of any size is produced in constant memory. Imports
+parse a file lazily, validate each record, and hand the good ones to
+``Database.import_earnings``. That loads them in multi-row batches and
+applies one balance delta per child. Bad records are reported with their
+line number instead of aborting the whole file.
+
+Both formats carry the same fields, in ledger order:
+
+    child_email,amount,description,type,created_at
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from ledger import parse_amount
+
+FIELDS = ('child_email', 'amount', 'description', 'type', 'created_at')
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+EARNING_TYPES = ('allowance', 'extra')
+
+# Rows rendered per chunk of CSV output
+CSV_CHUNK_ROWS = 500
+
+
+class InvalidRecord(ValueError):
+    """A record in an import file that cannot be loaded"""
+
+
+def to_csv(rows):
+    """Yield CSV text for ledger rows, header first, a few hundred rows per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for count, (child_email, amount, description, entry_type, created_at) in enumerate(rows, 1):
+        writer.writerow((child_email, amount, description or '', entry_type, created_at.isoformat(' ')))
+        if count % CSV_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def to_ndjson(rows):
+    """Yield one JSON object per ledger row"""
+    for child_email, amount, description, entry_type, created_at in rows:
+        yield json.dumps({
+            'child_email': child_email,
+            'amount': str(amount),
+            'description': description,
+            'type': entry_type,
+            'created_at': created_at.isoformat(' '),
+        }) + '\n'
+
+
+EXPORTERS = {'csv': to_csv, 'ndjson': to_ndjson}
+
+
+def read_csv(lines):
+    """Yield (line_number, record) from CSV text lines with a header row"""
+    reader = csv.DictReader(lines)
+    for record in reader:
+        yield reader.line_num, record
+
+
+def read_ndjson(lines):
+    """Yield (line_number, record) from NDJSON text lines, skipping blank ones"""
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+def format_of(filename, default='csv'):
+    """Pick the format from a file name's extension"""
+    extension = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    if extension in ('ndjson', 'jsonl'):
+        return 'ndjson'
+    if extension == 'csv':
+        return 'csv'
+    return default
+
+
+def parse_record(record):
+    """Validate one import record into a (child_email, amount, description, type, created_at) row"""
+    if not isinstance(record, dict):
+        raise InvalidRecord("not a JSON object")
+    child_email = str(record.get('child_email') or '').strip()
+    if not child_email:
+        raise InvalidRecord("child_email is required")
+    try:
+        amount = parse_amount(record.get('amount', ''))
+    except ValueError:
+        raise InvalidRecord(f"invalid amount {record.get('amount')!r}")
+    entry_type = str(record.get('type') or 'extra').strip()
+    if entry_type not in EARNING_TYPES:
+        raise InvalidRecord(f"type must be one of {', '.join(EARNING_TYPES)}")
+    try:
+        created_at = datetime.fromisoformat(str(record.get('created_at', '')).strip())
+    except ValueError:
+        raise InvalidRecord(f"invalid created_at {record.get('created_at')!r}")
+    if created_at.tzinfo is not None:
+        raise InvalidRecord("created_at must not carry a time zone")
+    return child_email, amount, str(record.get('description') or ''), entry_type, created_at
+
+
+def parse(lines, fmt, errors):
+    """Yield (line_number, row) for valid records; invalid ones go to ``errors`` as (line_number, message)"""
+    for line_number, record in READERS[fmt](lines):
+        try:
+            yield line_number, parse_record(record)
+        except InvalidRecord as e:
+            errors.append((line_number, str(e)))
+
+
+def load(db, lines, fmt, allowed_children=None):
+    """Import a CSV or NDJSON file's lines; returns Database.import_earnings' report
+    with the records rejected by validation merged into ``rejected``"""
+    errors = []
+    report = db.import_earnings(parse(lines, fmt, errors), allowed_children)
+    report['rejected'] = sorted(errors + report['rejected'])
+    return report
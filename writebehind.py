@@ -0,0 +1,156 @@
+"""Group-commit queue for high-rate writes.
+
+Each write is appended to a bounded in-memory queue, and a single flusher
+thread drains it in batches. The whole batch goes to ``flush`` in one
+transaction. The submitting thread blocks until that transaction has
+committed (or failed), so a caller that gets True back knows the row is
+durable. ``flush`` returns one verdict for the batch, or a list with one
+per item when only some of them were written.
+
+When ``max_queue`` writes are already pending, new ones wait up to
+``enqueue_timeout`` for room and are then refused with QueueFull. A burst
+therefore gets pushed back to the client instead of growing memory without
+bound.
+
+A batch is flushed once ``flush_size`` writes are waiting or the oldest
+one has waited ``flush_interval`` seconds, whichever comes first.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from config import Config
+from metrics import WRITE_BEHIND_BATCH
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when the write-behind queue has no room"""
+
+
+class _Pending:
+    __slots__ = ('item', 'done', 'result')
+
+    def __init__(self, item):
+        self.item = item
+        self.done = threading.Event()
+        self.result = False
+
+
+class WriteBehindQueue:
+    def __init__(self, flush, max_queue=1000, flush_size=200, flush_interval=0.01, enqueue_timeout=0.5):
+        self.flush = flush
+        self.max_queue = max_queue
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.submitted = 0
+        self.flushes = 0
+        self.failed = 0
+        self.rejected = 0
+        self._start()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def after_fork(self):
+        """Restart the flusher in a forked child.
+
+        Writes queued in the parent belong to the parent's writers, who
+        are waiting for that process's flusher, so the child starts empty.
+        """
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._start()
+
+    def submit(self, item):
+        """Queue ``item`` and block until its batch commits; returns flush's verdict"""
+        pending = _Pending(item)
+        deadline = time.monotonic() + self.enqueue_timeout
+        with self._cond:
+            while len(self._queue) >= self.max_queue and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += 1
+                    raise QueueFull("Too many writes waiting to be committed")
+                self._cond.wait(remaining)
+            if self._closed:
+                raise QueueFull("Write-behind queue is closed")
+            self._queue.append(pending)
+            self.submitted += 1
+            self._cond.notify_all()
+        pending.done.wait()
+        return pending.result
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            # Hold the batch open briefly so concurrent writers share the commit
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.flush_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._queue.popleft() for _ in range(min(self.flush_size, len(self._queue)))]
+            # Wake writers waiting for room
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            WRITE_BEHIND_BATCH.observe(len(batch))
+            try:
+                results = self.flush([pending.item for pending in batch])
+            except Exception:
+                logger.exception("Write-behind flush failed")
+                results = False
+            if not isinstance(results, (list, tuple)):
+                results = [bool(results)] * len(batch)
+            with self._cond:
+                self.flushes += 1
+                self.failed += sum(1 for ok in results if not ok)
+            for pending, ok in zip(batch, results):
+                pending.result = bool(ok)
+                pending.done.set()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'max_queue': self.max_queue,
+                'submitted': self.submitted,
+                'flushes': self.flushes,
+                'failed': self.failed,
+                'rejected': self.rejected,
+            }
+
+    def close(self):
+        """Flush whatever is queued and stop the flusher thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+def create_write_behind(flush):
+    return WriteBehindQueue(
+        flush,
+        max_queue=Config.WRITE_BEHIND_MAX_QUEUE,
+        flush_size=Config.WRITE_BEHIND_FLUSH_SIZE,
+        flush_interval=Config.WRITE_BEHIND_FLUSH_INTERVAL,
+        enqueue_timeout=Config.WRITE_BEHIND_ENQUEUE_TIMEOUT
+    )